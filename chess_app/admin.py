@@ -1,7 +1,8 @@
 from django.contrib import admin
 from .models import (
     Opening, Game, Move, UserProfile, 
-    OpeningPosition, UserProgress, Challenge, UserChallenge
+    OpeningPosition, UserProgress, Challenge, UserChallenge, CachedFeedback, LLMUsage,
+    PipelineWatermark, GameReview
 )
 
 @admin.register(UserProfile)
@@ -29,6 +30,26 @@ class MoveAdmin(admin.ModelAdmin):
     search_fields = ('game__user__username', 'move_san')
     date_hierarchy = 'created_at'
 
+@admin.register(CachedFeedback)
+class CachedFeedbackAdmin(admin.ModelAdmin):
+    list_display = ('key', 'hits', 'created_at', 'last_used')
+    search_fields = ('key',)
+
+@admin.register(LLMUsage)
+class LLMUsageAdmin(admin.ModelAdmin):
+    list_display = ('call_site', 'date', 'calls', 'failures', 'cache_hits', 'over_budget', 'prompt_tokens', 'completion_tokens')
+    list_filter = ('call_site',)
+    date_hierarchy = 'date'
+
+@admin.register(GameReview)
+class GameReviewAdmin(admin.ModelAdmin):
+    list_display = ('game', 'ply_count', 'user_accuracy', 'opponent_accuracy', 'blunders', 'updated_at')
+    search_fields = ('game__user__username',)
+
+@admin.register(PipelineWatermark)
+class PipelineWatermarkAdmin(admin.ModelAdmin):
+    list_display = ('name', 'last_id', 'updated_at')
+
 # Register your models with the admin site
 admin.site.register(OpeningPosition)
 admin.site.register(UserProgress)
@@ -0,0 +1,225 @@
+import asyncio
+import json
+import logging
+import re
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+
+import chess
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.db import close_old_connections
+from django.http.request import split_domain_port, validate_host
+from django.utils.module_loading import import_string
+
+from .models import Game, Move
+from . import registry, tasks, views
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+GAME_PATH = re.compile(r'^/ws/game/(?P<game_id>\d+)/$')
+
+def database_sync_to_async(func):
+    """Run blocking ORM/engine code on a worker thread with its own, cleaned-up database connection."""
+    def run(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(run, thread_sensitive=False)
+
+def _headers(scope):
+    return {name.decode('latin1').lower(): value.decode('latin1') for name, value in scope.get('headers', [])}
+
+def _origin_allowed(headers):
+    """Refuse browser connections from other sites, which would carry the user's session cookie."""
+    origin = headers.get('origin')
+    if not origin:
+        return True
+    allowed_hosts = settings.ALLOWED_HOSTS
+    if settings.DEBUG and not allowed_hosts:
+        allowed_hosts = ['.localhost', '127.0.0.1', '[::1]']
+    domain, _ = split_domain_port(urlsplit(origin).netloc)
+    return bool(domain) and validate_host(domain, allowed_hosts)
+
+def _authenticate(headers):
+    """The user logged in with the session cookie sent on the handshake."""
+    cookies = {}
+    for part in headers.get('cookie', '').split(';'):
+        name, _, value = part.strip().partition('=')
+        cookies[name] = value
+    session_store = import_string(f"{settings.SESSION_ENGINE}.SessionStore")
+    session = session_store(cookies.get(settings.SESSION_COOKIE_NAME))
+    return get_user(SimpleNamespace(session=session))
+
+class GameConsumer:
+    """
+    One WebSocket connection to a game. The board is held on the server for
+    the connection's lifetime, so the client sends only the move in UCI,
+    e.g. {"type": "move", "uci": "e2e4"}. The server replies with:
+      state     the position and move list (on connect, "sync" or a desync)
+      move      the user's move with its engine classification
+      eval      a new evaluation (pawns, white's perspective)
+      ai_move   the AI's reply
+      feedback  the coaching text for the user's move, once generated
+      error     a refused message
+    """
+    def __init__(self, scope, receive, send, game_id):
+        self.scope = scope
+        self.receive = receive
+        self.send = send
+        self.game_id = game_id
+        self.game = None
+        self.board = None
+        self.feedback_tasks = set()
+
+    async def send_json(self, **data):
+        await self.send({'type': 'websocket.send', 'text': json.dumps(data)})
+
+    async def run(self):
+        message = await self.receive()
+        if message['type'] != 'websocket.connect':
+            return
+        headers = _headers(self.scope)
+        if not _origin_allowed(headers):
+            await self.send({'type': 'websocket.close', 'code': 4003})
+            return
+        user = await database_sync_to_async(_authenticate)(headers)
+        if not user.is_authenticated:
+            await self.send({'type': 'websocket.close', 'code': 4001})
+            return
+        self.game = await database_sync_to_async(
+            lambda: Game.objects.select_related('opening').filter(id=self.game_id, user=user).first()
+        )()
+        if self.game is None:
+            await self.send({'type': 'websocket.close', 'code': 4004})
+            return
+
+        await self.send({'type': 'websocket.accept'})
+        await self.load_state()
+        try:
+            while True:
+                message = await self.receive()
+                if message['type'] == 'websocket.disconnect':
+                    break
+                if message['type'] == 'websocket.receive':
+                    await self.handle(message.get('text') or '')
+        finally:
+            for task in list(self.feedback_tasks):
+                task.cancel()
+
+    async def load_state(self):
+        """Reload the board from the database and send it to the client."""
+        def load():
+            self.game.refresh_from_db(fields=['move_data', 'fen_position'])
+            self.board = self.game.board()
+            return list(
+                Move.objects.filter(game=self.game, detached=False).order_by('move_number')
+                .values_list('move_number', 'move_san', 'player')
+            )
+        moves = await database_sync_to_async(load)()
+        await self.send_json(
+            type='state', fen=self.board.fen(), ply=len(self.board.move_stack),
+            moves=[{'move_number': n, 'move_san': san, 'player': player} for n, san, player in moves]
+        )
+
+    async def handle(self, text):
+        try:
+            data = json.loads(text)
+        except ValueError:
+            await self.send_json(type='error', message='Messages must be JSON')
+            return
+        if data.get('type') == 'sync':
+            await self.load_state()
+        elif data.get('type') == 'move':
+            await self.play(data.get('uci'))
+        else:
+            await self.send_json(type='error', message='Unknown message type')
+
+    async def play(self, uci):
+        try:
+            move = chess.Move.from_uci(uci or '')
+        except ValueError:
+            await self.send_json(type='error', message='Illegal move')
+            return
+        user_turn = chess.WHITE if self.game.user_color == 'white' else chess.BLACK
+        if self.board.turn != user_turn:
+            await self.send_json(type='error', message='Not your turn')
+            return
+
+        try:
+            move_obj, classification, reason, context = await database_sync_to_async(views.record_user_move)(
+                self.game, self.board, move
+            )
+        except views.MoveRejected as e:
+            await self.send_json(type='error', message=str(e))
+            if e.status == 409:
+                await self.load_state()
+            return
+        await self.send_json(
+            type='move', move_id=move_obj.id, uci=move_obj.move_uci, san=move_obj.move_san,
+            move_number=move_obj.move_number, classification=classification, reason=reason
+        )
+        if move_obj.eval_score is not None:
+            await self.send_json(type='eval', ply=move_obj.move_number, score=move_obj.eval_score)
+
+        try:
+            if not self.board.is_game_over():
+                await self.play_reply()
+        finally:
+            # Started once the reply is recorded, so the two never write at once;
+            # the feedback is then pushed whenever it is ready
+            task = asyncio.ensure_future(self.push_feedback(move_obj.id, context))
+            self.feedback_tasks.add(task)
+            task.add_done_callback(self.feedback_tasks.discard)
+
+    async def play_reply(self):
+        try:
+            ai_move_obj = await database_sync_to_async(views.play_ai_move)(self.game, self.board)
+        except views.MoveRejected as e:
+            await self.send_json(type='error', message=str(e))
+            await self.load_state()
+            return
+        if ai_move_obj is None:
+            await self.send_json(type='error', message='Could not generate AI move')
+            return
+        await self.send_json(
+            type='ai_move', uci=ai_move_obj.move_uci, san=ai_move_obj.move_san,
+            move_number=ai_move_obj.move_number, feedback=ai_move_obj.feedback, fen=self.board.fen()
+        )
+        if ai_move_obj.eval_score is not None:
+            await self.send_json(type='eval', ply=ai_move_obj.move_number, score=ai_move_obj.eval_score)
+
+    async def push_feedback(self, move_id, context):
+        try:
+            await database_sync_to_async(tasks.generate_move_feedback)(
+                registry.get_feedback_generator(), move_id, context
+            )
+            move_obj = await database_sync_to_async(
+                lambda: Move.objects.only('feedback', 'improvement_suggestion', 'quality', 'feedback_status').get(id=move_id)
+            )()
+        except Exception as e:
+            # Nothing awaits this task, so report the failure rather than lose it
+            logger.error(f"Error generating feedback for move {move_id}: {e}")
+            await database_sync_to_async(
+                lambda: Move.objects.filter(id=move_id, feedback_status='pending').update(feedback_status='failed')
+            )()
+            await self.send_json(type='error', move_id=move_id, message='Feedback could not be generated')
+            return
+        await self.send_json(
+            type='feedback', move_id=move_id, feedback=move_obj.feedback or '',
+            improvement=move_obj.improvement_suggestion or '', classification=move_obj.quality,
+            status=move_obj.feedback_status
+        )
+
+async def websocket_application(scope, receive, send):
+    """ASGI entry point for WebSocket connections (see chess_project/asgi.py)."""
+    match = GAME_PATH.match(scope['path'])
+    if match is None:
+        await receive()  # websocket.connect
+        await send({'type': 'websocket.close', 'code': 4004})
+        return
+    await GameConsumer(scope, receive, send, int(match['game_id'])).run()
@@ -0,0 +1,321 @@
+import logging
+import threading
+import time
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import LLMUsage
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+def retryable_errors():
+    """
+    Errors worth retrying; anything else (bad request, auth) fails straight away.
+    openai is imported here rather than at module level as it is slow to import.
+    """
+    from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+    return (APIConnectionError, APITimeoutError, InternalServerError, RateLimitError)
+
+class LLMUnavailable(Exception):
+    """Raised when the LLM provider cannot answer within the deadline."""
+
+class LLMBudgetExceeded(LLMUnavailable):
+    """Raised when a prompt is larger than its call site's token budget."""
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token)."""
+    return len(text) // 4 + 1
+
+class PromptTemplate:
+    """
+    A prompt split into a static prefix and a formatted body.
+    The prefix is identical on every call, so the provider can cache it,
+    and its token count is only computed once.
+    """
+    def __init__(self, name, prefix, body):
+        self.name = name
+        self.prefix = prefix
+        self.body = body
+        self.prefix_tokens = estimate_tokens(prefix)
+
+    def render(self, **values):
+        return self.prefix + self.body.format(**values)
+
+def record_usage(call_site, calls=0, failures=0, cache_hits=0, over_budget=0,
+                 prompt_tokens=0, completion_tokens=0, latency_ms=0):
+    """Add to today's usage totals for a call site with a single atomic update."""
+    if not getattr(settings, 'LLM_USAGE_TRACKING', True):
+        return
+    today = timezone.localdate()
+    increments = {
+        'calls': F('calls') + calls,
+        'failures': F('failures') + failures,
+        'cache_hits': F('cache_hits') + cache_hits,
+        'over_budget': F('over_budget') + over_budget,
+        'prompt_tokens': F('prompt_tokens') + prompt_tokens,
+        'completion_tokens': F('completion_tokens') + completion_tokens,
+        'total_latency_ms': F('total_latency_ms') + latency_ms,
+        'max_latency_ms': Greatest(F('max_latency_ms'), latency_ms),
+    }
+    try:
+        if LLMUsage.objects.filter(call_site=call_site, date=today).update(**increments):
+            return
+        try:
+            with transaction.atomic():
+                LLMUsage.objects.create(
+                    call_site=call_site, date=today, calls=calls, failures=failures,
+                    cache_hits=cache_hits, over_budget=over_budget,
+                    prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                    total_latency_ms=latency_ms, max_latency_ms=latency_ms
+                )
+        except IntegrityError:
+            # Another request created today's row first
+            LLMUsage.objects.filter(call_site=call_site, date=today).update(**increments)
+    except DatabaseError as e:
+        logger.warning(f"Could not record LLM usage for {call_site}: {e}")
+
+class CircuitBreaker:
+    """
+    Stops calling the provider after repeated failures.
+    Once open, calls fail fast until the cooldown has passed, then a single
+    trial call is let through to decide whether to close it again.
+    """
+    def __init__(self, failure_threshold=5, cooldown=30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+    def allow(self):
+        """Return True if a call may be attempted now."""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial_running or time.monotonic() - self._opened_at < self.cooldown:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def release_trial(self):
+        """End a call that neither succeeded nor failed (e.g. abandoned by the caller)."""
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning("LLM circuit breaker opened after repeated failures")
+                self._opened_at = time.monotonic()
+
+class LLMGateway:
+    """
+    Single entry point for LLM completions.
+    Holds one client with a pooled HTTP connection, and applies a deadline,
+    bounded retries and a circuit breaker to every call. Without an API key
+    (OPENAI_API_KEY in the environment) every call fails fast.
+    """
+    def __init__(self):
+        self.api_key = getattr(settings, 'OPENAI_API_KEY', '')
+        if not self.api_key:
+            logger.warning("OPENAI_API_KEY is not set; LLM features are unavailable")
+        self.model = getattr(settings, 'LLM_MODEL', 'google/gemini-2.0-flash-001')
+        self.timeout = getattr(settings, 'LLM_TIMEOUT', 15.0)
+        self.max_retries = getattr(settings, 'LLM_MAX_RETRIES', 2)
+        self.breaker = CircuitBreaker(
+            failure_threshold=getattr(settings, 'LLM_BREAKER_THRESHOLD', 5),
+            cooldown=getattr(settings, 'LLM_BREAKER_COOLDOWN', 30.0)
+        )
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        """The shared OpenAI-compatible client, created on first use."""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    import httpx
+                    from openai import OpenAI
+                    max_connections = getattr(settings, 'LLM_MAX_CONNECTIONS', 20)
+                    self._client = OpenAI(
+                        base_url=getattr(settings, 'LLM_BASE_URL', 'https://openrouter.ai/api/v1'),
+                        api_key=self.api_key,
+                        timeout=self.timeout,
+                        max_retries=0,  # Retries are bounded by the deadline below
+                        http_client=httpx.Client(
+                            limits=httpx.Limits(
+                                max_connections=max_connections,
+                                max_keepalive_connections=max_connections
+                            )
+                        )
+                    )
+        return self._client
+
+    def _check_budget(self, prompt, call_site):
+        """Refuse prompts over the call site's LLM_PROMPT_BUDGETS entry."""
+        budget = getattr(settings, 'LLM_PROMPT_BUDGETS', {}).get(call_site)
+        tokens = estimate_tokens(prompt)
+        if budget and tokens > budget:
+            record_usage(call_site, over_budget=1)
+            logger.warning(f"Prompt for {call_site} has ~{tokens} tokens, over its budget of {budget}")
+            raise LLMBudgetExceeded(f"Prompt for {call_site} exceeds its token budget")
+        return tokens
+
+    def _allow(self, call_site):
+        """Refuse the call without an API key or while the breaker is open."""
+        if self._client is None and not self.api_key:
+            reason = "No LLM API key configured"
+        elif not self.breaker.allow():
+            reason = "LLM circuit breaker is open"
+        else:
+            return
+        record_usage(call_site, calls=1, failures=1)
+        raise LLMUnavailable(reason)
+
+    def complete(self, prompt, timeout=None, model=None, call_site='default'):
+        """
+        Return the completion text for a single user prompt.
+        Raises LLMUnavailable if there is no API key, the breaker is open or
+        the deadline passes.
+        Tokens, latency and failures are recorded against call_site.
+        """
+        prompt_tokens = self._check_budget(prompt, call_site)
+        self._allow(call_site)
+
+        retryable = retryable_errors()
+        started = time.monotonic()
+        deadline = started + (timeout or self.timeout)
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                completion = self.client.with_options(timeout=remaining).chat.completions.create(
+                    model=model or self.model,
+                    messages=[
+                        {
+                            "role": "user",
+                            "content": prompt
+                        }
+                    ]
+                )
+                self.breaker.record_success()
+                text = completion.choices[0].message.content.strip()
+                usage = getattr(completion, 'usage', None)
+                record_usage(
+                    call_site,
+                    calls=1,
+                    prompt_tokens=getattr(usage, 'prompt_tokens', None) or prompt_tokens,
+                    completion_tokens=getattr(usage, 'completion_tokens', None) or estimate_tokens(text),
+                    latency_ms=int((time.monotonic() - started) * 1000)
+                )
+                return text
+            except retryable as e:
+                last_error = e
+                logger.warning(f"LLM call failed (attempt {attempt + 1}): {e}")
+                # Back off briefly, but never past the deadline
+                if attempt < self.max_retries:
+                    time.sleep(min(0.5 * (2 ** attempt), max(deadline - time.monotonic(), 0)))
+            except Exception as e:
+                last_error = e
+                break
+
+        self.breaker.record_failure()
+        record_usage(
+            call_site, calls=1, failures=1,
+            latency_ms=int((time.monotonic() - started) * 1000)
+        )
+        raise LLMUnavailable(f"LLM call failed: {last_error or 'deadline exceeded'}")
+
+    def stream(self, prompt, timeout=None, model=None, call_site='default'):
+        """
+        Yield the completion text in chunks as the provider produces them.
+        The timeout bounds the wait for each chunk rather than the whole
+        reply. Closing the generator (e.g. when the client disconnects)
+        closes the upstream response so the provider stops generating.
+        """
+        prompt_tokens = self._check_budget(prompt, call_site)
+        self._allow(call_site)
+
+        started = time.monotonic()
+        try:
+            response = self.client.with_options(timeout=timeout or self.timeout).chat.completions.create(
+                model=model or self.model,
+                messages=[
+                    {
+                        "role": "user",
+                        "content": prompt
+                    }
+                ],
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+        except Exception as e:
+            self.breaker.record_failure()
+            record_usage(call_site, calls=1, failures=1)
+            raise LLMUnavailable(f"LLM stream failed to start: {e}")
+
+        usage = None
+        completion_chars = 0
+        try:
+            for chunk in response:
+                # The last chunk carries the token usage and no choices
+                if getattr(chunk, 'usage', None):
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                text = chunk.choices[0].delta.content
+                if text:
+                    completion_chars += len(text)
+                    yield text
+            self.breaker.record_success()
+            record_usage(
+                call_site,
+                calls=1,
+                prompt_tokens=getattr(usage, 'prompt_tokens', None) or prompt_tokens,
+                completion_tokens=getattr(usage, 'completion_tokens', None) or completion_chars // 4,
+                latency_ms=int((time.monotonic() - started) * 1000)
+            )
+        except GeneratorExit:
+            # The client left; says nothing about the provider, but a trial
+            # call must not stay running or the breaker never closes
+            self.breaker.release_trial()
+            raise
+        except Exception as e:
+            self.breaker.record_failure()
+            record_usage(call_site, calls=1, failures=1)
+            raise LLMUnavailable(f"LLM stream failed: {e}")
+        finally:
+            response.close()
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+def get_gateway():
+    """Return the process-wide LLM gateway."""
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = LLMGateway()
+    return _gateway
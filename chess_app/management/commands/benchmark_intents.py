@@ -0,0 +1,123 @@
+import time
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from chess_app import registry
+from chess_app.services import ChessNLP
+
+# Hand-labelled chat messages used to compare the classifiers
+SAMPLE_MESSAGES = [
+    ("Hello!", 'greeting'),
+    ("hi there", 'greeting'),
+    ("Hey, ready to play?", 'greeting'),
+    ("Can I get a hint?", 'hint'),
+    ("What should I play here?", 'hint'),
+    ("Any advice for my next move?", 'hint'),
+    ("What is the best move in this position?", 'hint'),
+    ("Could you recommend a plan?", 'hint'),
+    ("Tell me about this opening", 'opening_info'),
+    ("What is the main line of the Ruy Lopez opening?", 'opening_info'),
+    ("Is this still book theory?", 'opening_info'),
+    ("Which opening are we playing?", 'opening_info'),
+    ("Was e4 a good move?", 'move_analysis'),
+    ("Why is Nf3 better than Nc3?", 'move_analysis'),
+    ("Was g1f3 a mistake?", 'move_analysis'),
+    ("Analyze Bb5 for me", 'move_analysis'),
+    ("How do I attack with a fork?", 'general'),
+    ("What is a pin?", 'general'),
+    ("How should I use my knight in the endgame?", 'general'),
+    ("Who has the advantage in space?", 'general'),
+    ("What's the weather like?", 'other'),
+    ("Tell me a joke", 'other'),
+    ("I like pizza", 'other'),
+    ("thanks", 'other'),
+]
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+class Command(BaseCommand):
+    help = 'Compares accuracy and latency of local and remote intent classification'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--remote',
+            action='store_true',
+            help='Also benchmark the LLM classifier (makes one API call per message)',
+        )
+        parser.add_argument(
+            '--spacy',
+            action='store_true',
+            help='Use the NLP_SPACY_MODEL pipeline for lemmatization',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=20,
+            help='Repetitions for the local timing runs',
+        )
+
+    def handle(self, *args, **options):
+        nlp = None
+        if options['spacy']:
+            nlp = registry.get_spacy_pipeline()
+            if nlp is None:
+                self.stderr.write(self.style.WARNING(
+                    f"spaCy model {getattr(settings, 'NLP_SPACY_MODEL', None)!r} is not available; "
+                    "benchmarking plain tokenization instead"
+                ))
+        chess_nlp = ChessNLP(nlp=nlp)
+        messages = [message for message, _ in SAMPLE_MESSAGES]
+        labels = [label for _, label in SAMPLE_MESSAGES]
+
+        # Local classifier, one message at a time
+        latencies = []
+        for _ in range(options['repeat']):
+            for message in messages:
+                start = time.perf_counter()
+                chess_nlp.classify_intent(message)
+                latencies.append(time.perf_counter() - start)
+        local_results = chess_nlp.classify_intents(messages)
+        self._report('local', [intent for intent, _ in local_results], labels, latencies)
+
+        # Local classifier, whole batch through nlp.pipe
+        start = time.perf_counter()
+        for _ in range(options['repeat']):
+            chess_nlp.classify_intents(messages)
+        per_message = (time.perf_counter() - start) / (options['repeat'] * len(messages))
+        self.stdout.write(f"local batch: {per_message * 1000:.3f} ms/message")
+
+        escalated = sum(
+            1 for _, confidence in local_results if confidence < chess_nlp.intent_threshold
+        )
+        self.stdout.write(
+            f"escalated to LLM: {escalated}/{len(messages)} "
+            f"(threshold {chess_nlp.intent_threshold})"
+        )
+
+        if not options['remote']:
+            return
+
+        # Remote classifier only
+        remote_intents, latencies = [], []
+        for message in messages:
+            start = time.perf_counter()
+            remote_intents.append(chess_nlp._classify_intent_remote(message))
+            latencies.append(time.perf_counter() - start)
+        self._report('remote', remote_intents, labels, latencies)
+
+        # Local first, LLM only for low-confidence messages
+        hybrid_intents, latencies = [], []
+        for message in messages:
+            start = time.perf_counter()
+            hybrid_intents.append(chess_nlp.analyze_message(message)['intent'])
+            latencies.append(time.perf_counter() - start)
+        self._report('hybrid', hybrid_intents, labels, latencies)
+
+    def _report(self, name, predicted, labels, latencies):
+        correct = sum(1 for p, label in zip(predicted, labels) if p == label)
+        self.stdout.write(
+            f"{name}: accuracy {correct}/{len(labels)} ({100.0 * correct / len(labels):.0f}%), "
+            f"mean {1000 * sum(latencies) / len(latencies):.3f} ms, "
+            f"p95 {1000 * _percentile(latencies, 0.95):.3f} ms"
+        )
@@ -0,0 +1,50 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db.models import Max, Sum
+from django.utils import timezone
+from chess_app.models import LLMUsage
+from chess_app.prompts import CHAT_PROMPT, CHAT_SUMMARY_PROMPT, INTENT_PROMPT, MOVE_FEEDBACK_PROMPT
+
+class Command(BaseCommand):
+    help = 'Reports LLM calls, tokens and latency per call site'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=7,
+            help='Number of days to include, today included',
+        )
+
+    def handle(self, *args, **options):
+        since = timezone.localdate() - timedelta(days=options['days'] - 1)
+        rows = (
+            LLMUsage.objects.filter(date__gte=since)
+            .values('call_site')
+            .annotate(
+                calls=Sum('calls'),
+                failures=Sum('failures'),
+                cache_hits=Sum('cache_hits'),
+                over_budget=Sum('over_budget'),
+                prompt_tokens=Sum('prompt_tokens'),
+                completion_tokens=Sum('completion_tokens'),
+                total_latency_ms=Sum('total_latency_ms'),
+                max_latency_ms=Max('max_latency_ms'),
+            )
+            .order_by('call_site')
+        )
+
+        self.stdout.write(f"LLM usage since {since}:")
+        for row in rows:
+            calls = row['calls'] or 0
+            self.stdout.write(
+                f"{row['call_site']}: {calls} calls, {row['failures']} failed, "
+                f"{row['cache_hits']} cache hits, {row['over_budget']} over budget, "
+                f"avg {row['prompt_tokens'] // max(calls, 1)} prompt / "
+                f"{row['completion_tokens'] // max(calls, 1)} completion tokens, "
+                f"avg {row['total_latency_ms'] // max(calls, 1)} ms, max {row['max_latency_ms']} ms"
+            )
+
+        # Static prefix sizes, i.e. the part of each prompt the provider can cache
+        for template in (CHAT_PROMPT, MOVE_FEEDBACK_PROMPT, INTENT_PROMPT, CHAT_SUMMARY_PROMPT):
+            self.stdout.write(f"{template.name} prompt prefix: ~{template.prefix_tokens} tokens")
@@ -0,0 +1,98 @@
+import os
+import signal
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from chess_app import registry
+from chess_app.services import OpeningBook
+
+FIELDS = ['Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty']
+
+def read_smaps_rollup(pid):
+    """Return the memory totals of a process in kB from /proc/<pid>/smaps_rollup."""
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            lines = f.read().splitlines()
+    except OSError as e:
+        raise CommandError(f"Cannot read memory of process {pid}: {e}")
+    totals = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        if name in FIELDS:
+            totals[name] = int(value.split()[0])
+    return totals
+
+def warm_up():
+    """Touch the same services a worker uses while serving requests."""
+    OpeningBook.compile_all()
+    try:
+        registry.get_chess_nlp().stop_words
+    except LookupError:
+        pass  # Reported once by preload()
+
+class Command(BaseCommand):
+    help = 'Reports RSS/PSS of forked workers with and without preloading shared state'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Number of workers to fork',
+        )
+        parser.add_argument(
+            '--pids',
+            nargs='+',
+            type=int,
+            help='Report on running processes (e.g. gunicorn workers) instead of forking',
+        )
+
+    def handle(self, *args, **options):
+        if options['pids']:
+            self._report('processes', {pid: read_smaps_rollup(pid) for pid in options['pids']})
+            return
+
+        # Without preloading first: every worker builds its own copy
+        self._report('without preload', self._fork_workers(options['workers']))
+        registry.preload()
+        self._report('with preload', self._fork_workers(options['workers']))
+
+    def _fork_workers(self, count):
+        """Fork workers that warm up and wait, measure them, then stop them."""
+        connections.close_all()
+        workers = []
+        for _ in range(count):
+            read_fd, write_fd = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                os.close(read_fd)
+                try:
+                    warm_up()
+                    os.write(write_fd, b'1')
+                    signal.pause()
+                finally:
+                    os._exit(0)
+            os.close(write_fd)
+            workers.append((pid, read_fd))
+
+        usage = {}
+        try:
+            for pid, read_fd in workers:
+                os.read(read_fd, 1)  # Wait until the worker is warmed up
+                os.close(read_fd)
+                usage[pid] = read_smaps_rollup(pid)
+        finally:
+            for pid, _ in workers:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+        return usage
+
+    def _report(self, label, usage):
+        self.stdout.write(f"{label}:")
+        for pid, totals in usage.items():
+            self.stdout.write(
+                f"  pid {pid}: rss {totals['Rss'] / 1024:.1f} MB, pss {totals['Pss'] / 1024:.1f} MB, "
+                f"private {(totals['Private_Clean'] + totals['Private_Dirty']) / 1024:.1f} MB, "
+                f"shared {(totals['Shared_Clean'] + totals['Shared_Dirty']) / 1024:.1f} MB"
+            )
+        total_pss = sum(totals['Pss'] for totals in usage.values())
+        self.stdout.write(f"  total pss {total_pss / 1024:.1f} MB across {len(usage)} workers")
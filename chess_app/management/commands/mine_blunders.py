@@ -0,0 +1,45 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from chess_app.services import BlunderMiner, EnginePool
+
+class Command(BaseCommand):
+    help = "Turns users' saved mistakes into challenges, resuming from the last processed move"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            help='Mistakes analysed per batch (defaults to BLUNDER_MINING_BATCH_SIZE)',
+        )
+        parser.add_argument(
+            '--depth',
+            type=int,
+            help='Engine search depth (defaults to BLUNDER_MINING_DEPTH)',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            help='Stockfish processes analysing in parallel (defaults to ENGINE_POOL_SIZE)',
+        )
+        parser.add_argument(
+            '--follow',
+            action='store_true',
+            help='Keep running, polling for new mistakes',
+        )
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=60,
+            help='Seconds between polls with --follow',
+        )
+
+    def handle(self, *args, **options):
+        with EnginePool(options['workers']) as pool:
+            if not pool.available:
+                raise CommandError('Stockfish is not available')
+            while True:
+                scanned, created = BlunderMiner.run(pool, options['batch_size'], options['depth'])
+                self.stdout.write(f"Scanned {scanned} mistakes, created {created} challenges")
+                if not options['follow']:
+                    break
+                time.sleep(options['interval'])
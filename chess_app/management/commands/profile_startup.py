@@ -0,0 +1,84 @@
+import os
+import subprocess
+import sys
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Run in a fresh interpreter so nothing is already imported
+STARTUP_SCRIPT = """
+import time
+start = time.perf_counter()
+import django
+django.setup()
+setup_done = time.perf_counter()
+import importlib
+for module in {modules!r}:
+    importlib.import_module(module)
+from chess_app.registry import loaded_services
+print(f"setup {{setup_done - start:.6f}}")
+print(f"imports {{time.perf_counter() - setup_done:.6f}}")
+print("services " + ",".join(loaded_services()))
+"""
+
+class Command(BaseCommand):
+    help = 'Reports the import time of each module loaded when a worker starts'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'modules',
+            nargs='*',
+            help='Modules imported after django.setup() (defaults to the URLconf)',
+        )
+        parser.add_argument(
+            '--top',
+            type=int,
+            default=20,
+            help='Number of modules to list',
+        )
+        parser.add_argument(
+            '--nested',
+            action='store_true',
+            help='Rank every module by its own import time instead of top-level packages by cumulative time',
+        )
+
+    def handle(self, *args, **options):
+        modules = options['modules'] or [settings.ROOT_URLCONF]
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get(
+            'DJANGO_SETTINGS_MODULE', 'chess_project.settings'
+        ))
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', STARTUP_SCRIPT.format(modules=modules)],
+            capture_output=True, text=True, env=env
+        )
+        if result.returncode != 0:
+            self.stderr.write(result.stderr.splitlines()[-1] if result.stderr else 'Startup failed')
+            return
+
+        # Lines look like "import time:   self |  cumulative | <indent>module"
+        timings = []
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            self_us, cumulative_us, name = line[len('import time:'):].split('|')
+            nested = len(name) - len(name.lstrip()) > 1
+            timings.append((name.strip(), int(self_us), int(cumulative_us), nested))
+
+        if options['nested']:
+            ranked = sorted(timings, key=lambda t: t[1], reverse=True)
+            self.stdout.write('Slowest modules by own import time:')
+            for name, self_us, _, _ in ranked[:options['top']]:
+                self.stdout.write(f"  {self_us / 1000:8.1f} ms  {name}")
+        else:
+            ranked = sorted((t for t in timings if not t[3]), key=lambda t: t[2], reverse=True)
+            self.stdout.write('Slowest top-level imports (cumulative):')
+            for name, _, cumulative_us, _ in ranked[:options['top']]:
+                self.stdout.write(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+        for line in result.stdout.splitlines():
+            key, _, value = line.partition(' ')
+            if key == 'setup':
+                self.stdout.write(f"django.setup(): {float(value) * 1000:.1f} ms")
+            elif key == 'imports':
+                self.stdout.write(f"{', '.join(modules)}: {float(value) * 1000:.1f} ms")
+            elif key == 'services':
+                self.stdout.write(f"Services built at import: {value or 'none'}")
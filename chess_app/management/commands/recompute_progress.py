@@ -0,0 +1,21 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from chess_app.services import ProgressTracker
+
+class Command(BaseCommand):
+    help = 'Rebuilds opening progress and profile statistics from the stored games and moves'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            action='append',
+            dest='usernames',
+            help='Only recompute this user (can be repeated)',
+        )
+
+    def handle(self, *args, **options):
+        users = None
+        if options['usernames']:
+            users = User.objects.filter(username__in=options['usernames'])
+        count = ProgressTracker.recompute(users)
+        self.stdout.write(self.style.SUCCESS(f"Recomputed {count} progress entries"))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-19 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chess_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='move',
+            name='feedback_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], default='ready', max_length=10),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2 on 2026-10-19 10:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chess_app', '0002_move_feedback_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CachedFeedback',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('feedback', models.TextField()),
+                ('hits', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used', models.DateTimeField(auto_now=True, db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2 on 2026-10-19 10:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chess_app', '0003_cachedfeedback'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='chat_summary',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.CreateModel(
+            name='ChatMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('user', 'User'), ('assistant', 'Assistant')], max_length=10)),
+                ('content', models.TextField()),
+                ('in_summary', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_messages', to='chess_app.game')),
+            ],
+            options={
+                'ordering': ['created_at', 'id'],
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2 on 2026-10-19 10:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chess_app', '0004_chat_history'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LLMUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('call_site', models.CharField(max_length=50)),
+                ('date', models.DateField()),
+                ('calls', models.IntegerField(default=0)),
+                ('failures', models.IntegerField(default=0)),
+                ('cache_hits', models.IntegerField(default=0)),
+                ('over_budget', models.IntegerField(default=0)),
+                ('prompt_tokens', models.BigIntegerField(default=0)),
+                ('completion_tokens', models.BigIntegerField(default=0)),
+                ('total_latency_ms', models.BigIntegerField(default=0)),
+                ('max_latency_ms', models.IntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('call_site', 'date')},
+            },
+        ),
+    ]
@@ -0,0 +1,111 @@
+# Generated by Django 5.2 on 2026-10-19 10:28
+
+from array import array
+
+import chess
+import chess.polyglot
+from django.db import migrations, models
+
+
+def _encode(move):
+    return move.from_square | (move.to_square << 6) | ((move.promotion or 0) << 12)
+
+
+def _decode(code):
+    return chess.Move(code & 0x3f, (code >> 6) & 0x3f, (code >> 12) or None)
+
+
+def _position_key(board):
+    key = chess.polyglot.zobrist_hash(board)
+    return key - (1 << 64) if key >= (1 << 63) else key
+
+
+def pack_moves(apps, schema_editor):
+    """Pack each game's moves into Game.move_data and key every move by its position."""
+    Game = apps.get_model('chess_app', 'Game')
+    Move = apps.get_model('chess_app', 'Move')
+    for game in Game.objects.all().iterator():
+        codes = array('H')
+        board = chess.Board()
+        replayable = True
+        moves = list(Move.objects.filter(game=game).order_by('move_number', 'id'))
+        for ply, move in enumerate(moves):
+            try:
+                played = chess.Move.from_uci(move.move_uci)
+            except ValueError:
+                played = chess.Move.null()  # Never legal, so replay stops here
+            codes.append(_encode(played))
+            try:
+                move.position_key = _position_key(chess.Board(move.position_before))
+            except ValueError:
+                move.position_key = None
+            # Move numbers index the packed list, so make them contiguous
+            move.move_number = ply + 1
+            if replayable and board.is_legal(played):
+                board.push(played)
+            else:
+                replayable = False
+        Move.objects.bulk_update(moves, ['position_key', 'move_number'])
+        game.move_data = codes.tobytes()
+        if replayable:
+            # AI moves used to leave the game at the position before the move
+            game.fen_position = board.fen()
+        game.save(update_fields=['move_data', 'fen_position'])
+
+
+def unpack_moves(apps, schema_editor):
+    """Restore the FEN columns by replaying each game's packed moves."""
+    Game = apps.get_model('chess_app', 'Game')
+    Move = apps.get_model('chess_app', 'Move')
+    for game in Game.objects.all().iterator():
+        codes = array('H')
+        codes.frombytes(bytes(game.move_data))
+        moves = list(Move.objects.filter(game=game).order_by('move_number'))
+        board = chess.Board()
+        for move, code in zip(moves, codes):
+            move.position_before = board.fen()
+            played = _decode(code)
+            if board.is_legal(played):
+                board.push(played)
+            move.position_after = board.fen()
+        Move.objects.bulk_update(moves, ['position_before', 'position_after'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chess_app', '0005_llmusage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='move_data',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.AddField(
+            model_name='move',
+            name='position_key',
+            field=models.BigIntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(pack_moves, unpack_moves),
+        # A default lets the columns be re-added when migrating backwards
+        migrations.AlterField(
+            model_name='move',
+            name='position_after',
+            field=models.CharField(default='', max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='move',
+            name='position_before',
+            field=models.CharField(default='', max_length=100),
+        ),
+        migrations.RemoveField(
+            model_name='move',
+            name='position_after',
+        ),
+        migrations.RemoveField(
+            model_name='move',
+            name='position_before',
+        ),
+    ]
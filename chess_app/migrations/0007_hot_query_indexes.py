@@ -0,0 +1,35 @@
+# Generated by Django 5.2 on 2026-10-19 10:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chess_app', '0006_compact_moves'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(fields=['user', 'opening', 'status'], name='game_user_opening_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(fields=['user', '-updated_at'], name='game_user_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='move',
+            index=models.Index(fields=['game', 'move_number'], name='move_game_number_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='move',
+            index=models.Index(fields=['game', 'player', 'move_number'], name='move_game_player_number_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userprogress',
+            index=models.Index(fields=['user', '-mastery_level'], name='progress_user_mastery_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2 on 2026-10-19 10:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chess_app', '0007_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='challenge',
+            index=models.Index(fields=['difficulty', 'id'], name='challenge_difficulty_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='challenge',
+            index=models.Index(fields=['opening', 'difficulty', 'id'], name='challenge_opening_diff_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='challenge',
+            index=models.Index(fields=['title', 'id'], name='challenge_title_idx'),
+        ),
+    ]
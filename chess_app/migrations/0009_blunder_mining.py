@@ -0,0 +1,27 @@
+# Generated by Django 5.2 on 2026-10-19 10:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chess_app', '0008_challenge_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PipelineWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('last_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='challenge',
+            name='position_key',
+            field=models.BigIntegerField(blank=True, editable=False, null=True, unique=True),
+        ),
+    ]
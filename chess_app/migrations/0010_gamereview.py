@@ -0,0 +1,31 @@
+# Generated by Django 5.2 on 2026-10-19 10:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chess_app', '0009_blunder_mining'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GameReview',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ply_count', models.IntegerField()),
+                ('user_accuracy', models.FloatField()),
+                ('opponent_accuracy', models.FloatField()),
+                ('avg_centipawn_loss', models.FloatField()),
+                ('inaccuracies', models.IntegerField(default=0)),
+                ('mistakes', models.IntegerField(default=0)),
+                ('blunders', models.IntegerField(default=0)),
+                ('missing_evals', models.IntegerField(default=0)),
+                ('report', models.TextField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('game', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='review', to='chess_app.game')),
+            ],
+        ),
+    ]
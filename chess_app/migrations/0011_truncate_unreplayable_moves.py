@@ -0,0 +1,46 @@
+# Generated by Django 5.2 on 2026-10-19 12:05
+
+from array import array
+
+import chess
+from django.db import migrations
+
+
+def _decode(code):
+    return chess.Move(code & 0x3f, (code >> 6) & 0x3f, (code >> 12) or None)
+
+
+def truncate_moves(apps, schema_editor):
+    """
+    Cut each game's packed moves at the first move that cannot be replayed.
+    0006 packs those too, but Game.board() stops before them, so record_move
+    saw a ply count it could never match and refused every move. The rows
+    past the cut are kept; 0014 detaches them from the game.
+    """
+    Game = apps.get_model('chess_app', 'Game')
+    for game in Game.objects.iterator():
+        codes = array('H')
+        codes.frombytes(bytes(game.move_data))
+        board = chess.Board()
+        for code in codes:
+            move = _decode(code)
+            if not board.is_legal(move):
+                break
+            board.push(move)
+        ply_count = len(board.move_stack)
+        if ply_count == len(codes):
+            continue
+        game.move_data = codes[:ply_count].tobytes()
+        game.fen_position = board.fen()
+        game.save(update_fields=['move_data', 'fen_position'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chess_app', '0010_gamereview'),
+    ]
+
+    operations = [
+        migrations.RunPython(truncate_moves, migrations.RunPython.noop),
+    ]
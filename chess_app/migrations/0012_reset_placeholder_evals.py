@@ -0,0 +1,94 @@
+# Generated by Django 5.2 on 2026-10-19 12:40
+
+from array import array
+
+import chess
+from django.db import migrations
+
+
+# Positions (FEN without the move counters) and moves that StockfishEngine
+# accepted as standard opening moves without a search, saving 0.0
+STANDARD_OPENING_MOVES = {
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq -': {'e2e4', 'd2d4', 'c2c4', 'g1f3'},
+    'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq -': {'e7e5', 'c7c5', 'e7e6', 'c7c6'},
+    'rnbqkbnr/pppppppp/8/8/3P4/8/PPP1PPPP/RNBQKBNR b KQkq -': {'d7d5', 'g8f6', 'e7e6', 'g7g6'},
+    'rnbqkbnr/pppppppp/8/8/2P5/8/PP1PPPPP/RNBQKBNR b KQkq -': {'e7e5', 'c7c5', 'g8f6'},
+    'rnbqkbnr/pppppppp/8/8/8/5N2/PPPPPPPP/RNBQKB1R b KQkq -': {'d7d5', 'g8f6', 'c7c5'},
+    'rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w KQkq -': {'g1f3', 'b1c3', 'f1c4'},
+    'rnbqkbnr/pppp1ppp/8/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R b KQkq -': {'b8c6', 'g8f6'},
+    'r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq -': {'f1b5'},
+    'r1bqkbnr/pppp1ppp/2n5/1B2p3/4P3/5N2/PPPP1PPP/RNBQK2R b KQkq -': {'g8f6'},
+}
+
+
+def _decode(code):
+    return chess.Move(code & 0x3f, (code >> 6) & 0x3f, (code >> 12) or None)
+
+
+def _placeholder_plies(game):
+    """
+    The plies whose 0.0 evaluation can only be a placeholder: the AI's book
+    moves (the game still on the opening's main line) and the user's
+    standard opening moves, neither of which was searched.
+    """
+    codes = array('H')
+    codes.frombytes(bytes(game.move_data))
+    main_line = [move for move in (game.opening.main_line or '').split() if not move.endswith('.')]
+    board = chess.Board()
+    on_book = True
+    book, standard = set(), set()
+    for ply, code in enumerate(codes, 1):
+        move = _decode(code)
+        if not board.is_legal(move):
+            break
+        on_book = on_book and ply <= len(main_line) and board.san(move) == main_line[ply - 1]
+        if on_book:
+            book.add(ply)
+        if move.uci() in STANDARD_OPENING_MOVES.get(' '.join(board.fen().split(' ')[:4]), ()):
+            standard.add(ply)
+        board.push(move)
+    return book, standard
+
+
+def reset_evals(apps, schema_editor):
+    """
+    Clear the 0.0 evaluations that were saved as placeholders rather than
+    searched: AI book moves, standard opening moves, and user moves
+    classified "normal", which is what a missing engine or failed search
+    saved (a searched move is always given a graded classification). Other
+    0.0 scores are genuine equal positions and are kept, as are AI engine
+    moves, whose score for the position before the move is the score of the
+    line the engine played. Stored reviews of the games changed here were
+    computed from the placeholders; they are removed so the next request
+    reviews those games again (GameReviewer.stored only checks the ply count).
+    """
+    Move = apps.get_model('chess_app', 'Move')
+    GameReview = apps.get_model('chess_app', 'GameReview')
+    zeros = Move.objects.filter(eval_score=0.0).select_related('game__opening').order_by('game_id')
+    plies = {}
+    cleared = {}
+    for move in zeros.iterator():
+        if move.game_id not in plies:
+            # Rows come grouped by game, so only the current game is kept
+            plies = {move.game_id: _placeholder_plies(move.game)}
+        book, standard = plies[move.game_id]
+        if move.player == 'ai':
+            placeholder = move.move_number in book
+        else:
+            placeholder = move.move_number in standard or move.quality == 'normal'
+        if placeholder:
+            cleared.setdefault(move.game_id, []).append(move.id)
+    for game_id, move_ids in cleared.items():
+        Move.objects.filter(id__in=move_ids).update(eval_score=None)
+        GameReview.objects.filter(game_id=game_id).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chess_app', '0011_truncate_unreplayable_moves'),
+    ]
+
+    operations = [
+        migrations.RunPython(reset_evals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-19 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chess_app', '0012_reset_placeholder_evals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userchallenge',
+            name='progress_fen',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+    ]
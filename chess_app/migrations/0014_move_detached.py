@@ -0,0 +1,30 @@
+# Generated by Django 5.2 on 2026-10-19 16:40
+
+from django.db import migrations, models
+
+
+def detach_moves(apps, schema_editor):
+    """
+    Detach the rows past the end of each game's packed moves (those 0011 cut
+    off) rather than deleting them, so their feedback stays in the history.
+    """
+    Game = apps.get_model('chess_app', 'Game')
+    Move = apps.get_model('chess_app', 'Move')
+    for game in Game.objects.only('id', 'move_data').iterator():
+        Move.objects.filter(game=game, move_number__gt=len(game.move_data) // 2).update(detached=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chess_app', '0013_userchallenge_progress_fen'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='move',
+            name='detached',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(detach_moves, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,22 @@
+from array import array
+from functools import cached_property
+import chess
+import chess.polyglot
 from django.db import models
 from django.contrib.auth.models import User
 
+def encode_move(move):
+    """Pack a move into 16 bits: from square, to square and promotion piece type."""
+    return move.from_square | (move.to_square << 6) | ((move.promotion or 0) << 12)
+
+def decode_move(code):
+    return chess.Move(code & 0x3f, (code >> 6) & 0x3f, (code >> 12) or None)
+
+def position_key(board):
+    """Zobrist hash of a position as a signed 64-bit integer (fits a BigIntegerField)."""
+    key = chess.polyglot.zobrist_hash(board)
+    return key - (1 << 64) if key >= (1 << 63) else key
+
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     elo_rating = models.IntegerField(default=1200)
@@ -64,9 +80,47 @@ class Game(models.Model):
     ai_strength = models.IntegerField(default=15)  # Stockfish depth
     in_opening_book = models.BooleanField(default=True)  # Whether we're still in the opening book
     result = models.CharField(max_length=10, blank=True, null=True)  # "1-0", "0-1", "1/2-1/2"
+    chat_summary = models.TextField(blank=True, default='')  # Rolling summary of older chat messages
+    move_data = models.BinaryField(default=b'', editable=False)  # Moves played, 16 bits each (see encode_move)
+    
+    class Meta:
+        indexes = [
+            # The game view's get_or_create of the ongoing game
+            models.Index(fields=['user', 'opening', 'status'], name='game_user_opening_status_idx'),
+            # Recent games on the profile page
+            models.Index(fields=['user', '-updated_at'], name='game_user_updated_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.opening.name} ({self.created_at.strftime('%Y-%m-%d')})"
+    
+    @property
+    def ply_count(self):
+        return len(self.move_data) // 2
+    
+    def get_moves(self):
+        """Decode the packed move list into chess.Move objects."""
+        codes = array('H')
+        codes.frombytes(bytes(self.move_data))
+        return [decode_move(code) for code in codes]
+    
+    def board(self, ply=None):
+        """
+        Replay the game from the starting position, up to ply half-moves if given.
+        Replay stops at the first move that is not legal, as older games may
+        hold moves recorded against a different position.
+        """
+        board = chess.Board()
+        moves = self.get_moves()
+        for move in moves[:ply] if ply is not None else moves:
+            if not board.is_legal(move):
+                break
+            board.push(move)
+        return board
+    
+    def append_move(self, move):
+        """Add a move to the packed move list; the caller saves the game."""
+        self.move_data = bytes(self.move_data) + array('H', [encode_move(move)]).tobytes()
 
 class Move(models.Model):
     MOVE_QUALITY_CHOICES = [
@@ -79,12 +133,17 @@ class Move(models.Model):
         ('normal', 'Normal')
     ]
     
+    FEEDBACK_STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    ]
+    
     game = models.ForeignKey(Game, on_delete=models.CASCADE, related_name='moves')
     move_number = models.IntegerField()
     move_uci = models.CharField(max_length=10)
     move_san = models.CharField(max_length=10)
-    position_before = models.CharField(max_length=100)
-    position_after = models.CharField(max_length=100)
+    position_key = models.BigIntegerField(null=True, blank=True, db_index=True)  # Zobrist hash of position_before
     player = models.CharField(max_length=10)  # 'user' or 'ai'
     eval_score = models.FloatField(null=True, blank=True)
     
@@ -93,13 +152,58 @@ class Move(models.Model):
     quality = models.CharField(max_length=10, choices=MOVE_QUALITY_CHOICES, default='normal')
     feedback = models.TextField(blank=True, null=True)
     improvement_suggestion = models.TextField(blank=True, null=True)
+    feedback_status = models.CharField(max_length=10, choices=FEEDBACK_STATUS_CHOICES, default='ready')  # Filled in by a background worker
+    # Recorded past the point where the game's moves replay; kept for its
+    # feedback but no longer part of the game, so its number may be reused
+    detached = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         ordering = ['move_number']
+        indexes = [
+            # Move history and the next move number of a game
+            models.Index(fields=['game', 'move_number'], name='move_game_number_idx'),
+            # Last move by one side (e.g. the AI move to explain)
+            models.Index(fields=['game', 'player', 'move_number'], name='move_game_player_number_idx'),
+        ]
         
     def __str__(self):
         return f"{self.game} - Move {self.move_number}: {self.move_san}"
+    
+    # Positions are derived from the game's packed move list, where this
+    # move is at index move_number - 1; the game is replayed once per row
+    @cached_property
+    def position_before(self):
+        return self.game.board(self.move_number - 1).fen()
+    
+    @cached_property
+    def position_after(self):
+        board = chess.Board(self.position_before)
+        move = chess.Move.from_uci(self.move_uci)
+        if board.is_legal(move):
+            board.push(move)
+        return board.fen()
+
+class ChatMessage(models.Model):
+    """
+    Model to store the chat conversation for a game on the server.
+    """
+    ROLE_CHOICES = [
+        ('user', 'User'),
+        ('assistant', 'Assistant'),
+    ]
+    
+    game = models.ForeignKey(Game, on_delete=models.CASCADE, related_name='chat_messages')
+    role = models.CharField(max_length=10, choices=ROLE_CHOICES)
+    content = models.TextField()
+    in_summary = models.BooleanField(default=False)  # Folded into Game.chat_summary
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['created_at', 'id']
+        
+    def __str__(self):
+        return f"{self.game} - {self.role}: {self.content[:30]}"
 
 class UserProgress(models.Model):
     """
@@ -118,6 +222,10 @@ class UserProgress(models.Model):
     
     class Meta:
         unique_together = ['user', 'opening']
+        indexes = [
+            # Progress list on the profile page, highest mastery first
+            models.Index(fields=['user', '-mastery_level'], name='progress_user_mastery_idx'),
+        ]
         
     def __str__(self):
         return f"{self.user.username} - {self.opening.name} (Mastery: {self.mastery_level}%)"
@@ -141,6 +249,16 @@ class Challenge(models.Model):
     opening = models.ForeignKey(Opening, on_delete=models.CASCADE, related_name='challenges')
     difficulty = models.IntegerField(choices=DIFFICULTY_CHOICES, default=1)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Zobrist hash of fen_position for mined challenges, one challenge per position
+    position_key = models.BigIntegerField(null=True, blank=True, unique=True, editable=False)
+    
+    class Meta:
+        indexes = [
+            # Keyset pagination of the challenges listing, with and without an opening filter
+            models.Index(fields=['difficulty', 'id'], name='challenge_difficulty_idx'),
+            models.Index(fields=['opening', 'difficulty', 'id'], name='challenge_opening_diff_idx'),
+            models.Index(fields=['title', 'id'], name='challenge_title_idx'),
+        ]
     
     def __str__(self):
         return self.title
@@ -154,6 +272,8 @@ class UserChallenge(models.Model):
     is_solved = models.BooleanField(default=False)
     attempts = models.IntegerField(default=0)
     solved_date = models.DateTimeField(null=True, blank=True)
+    # Position of the attempt in progress, with the solver to move; blank at the start
+    progress_fen = models.CharField(max_length=100, blank=True, default='')
     
     class Meta:
         unique_together = ['user', 'challenge']
@@ -161,3 +281,72 @@ class UserChallenge(models.Model):
     def __str__(self):
         status = "Solved" if self.is_solved else "Unsolved"
         return f"{self.user.username} - {self.challenge.title} ({status})"
+
+
+class CachedFeedback(models.Model):
+    """
+    AI move feedback shared between users, keyed by a hash of the
+    position, move, classification, opening and prompt version.
+    """
+    key = models.CharField(max_length=64, unique=True)
+    feedback = models.TextField()
+    hits = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used = models.DateTimeField(auto_now=True, db_index=True)
+    
+    def __str__(self):
+        return f"{self.key[:12]} ({self.hits} hits)"
+
+class LLMUsage(models.Model):
+    """
+    Daily LLM usage totals per call site, used to find cost and latency hotspots.
+    """
+    call_site = models.CharField(max_length=50)
+    date = models.DateField()
+    calls = models.IntegerField(default=0)
+    failures = models.IntegerField(default=0)
+    cache_hits = models.IntegerField(default=0)
+    over_budget = models.IntegerField(default=0)  # Calls refused for exceeding the prompt budget
+    prompt_tokens = models.BigIntegerField(default=0)
+    completion_tokens = models.BigIntegerField(default=0)
+    total_latency_ms = models.BigIntegerField(default=0)
+    max_latency_ms = models.IntegerField(default=0)
+    
+    class Meta:
+        unique_together = ['call_site', 'date']
+        
+    def __str__(self):
+        return f"{self.call_site} on {self.date} ({self.calls} calls)"
+
+class PipelineWatermark(models.Model):
+    """
+    Progress of an incremental background pipeline: the id of the last row
+    it has processed, so each run resumes where the previous one stopped.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    last_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.name} @ {self.last_id}"
+
+class GameReview(models.Model):
+    """
+    Post-game review computed from the game's evaluation series: accuracy
+    per side, the user's centipawn loss and error counts, and a JSON report
+    with the per-move numbers and the breakdown by game phase.
+    """
+    game = models.OneToOneField(Game, on_delete=models.CASCADE, related_name='review')
+    ply_count = models.IntegerField()  # Moves covered; the review is redone if the game continues
+    user_accuracy = models.FloatField()  # 0-100
+    opponent_accuracy = models.FloatField()  # 0-100
+    avg_centipawn_loss = models.FloatField()  # User's moves
+    inaccuracies = models.IntegerField(default=0)
+    mistakes = models.IntegerField(default=0)
+    blunders = models.IntegerField(default=0)
+    missing_evals = models.IntegerField(default=0)  # Moves without an evaluation when reviewed
+    report = models.TextField()  # JSON: per-move evaluations and the phase breakdown
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Review of {self.game} ({self.user_accuracy:.1f}%)"
@@ -0,0 +1,91 @@
+import atexit
+import gc
+import logging
+import threading
+from django.conf import settings
+from django.db import connections
+
+from .llm import retryable_errors
+from .services import ChessNLP, EnginePool, FeedbackGenerator, OpeningBook, SolutionTree, StockfishEngine
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Heavy services are built on first use rather than at import time, so
+# worker boot, management commands and tests only pay for what they touch.
+_services = {}
+_lock = threading.RLock()
+
+def _get(name, factory):
+    service = _services.get(name)
+    if service is None:
+        with _lock:
+            service = _services.get(name)
+            if service is None:
+                service = factory()
+                _services[name] = service
+    return service
+
+def loaded_services():
+    """Names of the services built so far in this process."""
+    return sorted(_services)
+
+def get_spacy_pipeline():
+    """
+    The spaCy pipeline named by NLP_SPACY_MODEL, or None if it is disabled
+    or not installed (ChessNLP then falls back to plain tokenization).
+    """
+    def load():
+        model = getattr(settings, 'NLP_SPACY_MODEL', 'en_core_web_sm')
+        if not model:
+            return False
+        try:
+            import spacy
+            return spacy.load(model)
+        except (ImportError, OSError) as e:
+            logger.warning(f"spaCy model {model} unavailable: {e}")
+            return False
+    # False marks a failed load so it is not retried on every call
+    return _get('spacy', load) or None
+
+def get_stockfish_engine():
+    return _get('stockfish', StockfishEngine)
+
+def get_engine_pool():
+    """Engine processes for request-time batch analysis, started on first use and kept for the process."""
+    def start():
+        pool = EnginePool(
+            getattr(settings, 'ANALYSIS_POOL_SIZE', 2), getattr(settings, 'ANALYSIS_POOL_TIMEOUT', 2.0)
+        ).__enter__()
+        atexit.register(pool.__exit__, None, None, None)
+        return pool
+    return _get('engine_pool', start)
+
+def get_chess_nlp():
+    return _get('chess_nlp', lambda: ChessNLP(nlp=get_spacy_pipeline()))
+
+def get_feedback_generator():
+    return _get('feedback_generator', lambda: FeedbackGenerator(get_stockfish_engine()))
+
+def preload():
+    """
+    Build the read-only shared state before the server forks its workers:
+    the compiled opening book and challenge solutions, the NLP resources
+    and the LLM client module.
+    gc.freeze() then moves everything into the permanent generation so the
+    collector never writes to those pages and they stay shared between
+    workers (copy-on-write). Stockfish, the LLM client and the thread pool
+    are per-process and are still created in each worker on first use.
+    """
+    openings = OpeningBook.compile_all()
+    challenges = SolutionTree.compile_all()
+    try:
+        get_chess_nlp().stop_words
+    except LookupError as e:
+        logger.warning(f"NLTK stopwords not preloaded: {e}")
+    retryable_errors()  # imports openai
+    # Database connections must not be inherited by the workers
+    connections.close_all()
+    gc.collect()
+    gc.freeze()
+    logger.info(f"Preloaded {openings} openings, {challenges} challenges and services: {', '.join(loaded_services())}")
@@ -1,52 +1,124 @@
 import chess
 import chess.engine
 import chess.pgn
+import base64
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
 from functools import lru_cache
-import nltk
-from nltk.tokenize import word_tokenize
-from nltk.corpus import stopwords
+import hashlib
+import io
+import json
 import logging
+import os
+import queue
 from django.conf import settings
+from django.core.cache import cache
 import re
-from openai import OpenAI
+import threading
+import time
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, Exists, F, FloatField, IntegerField, OuterRef, Q, Value, When
+from django.db.models.functions import Cast, Floor, Greatest, Least
+from django.utils import timezone
+
+from .llm import LLMUnavailable, estimate_tokens, get_gateway, record_usage
+from .models import (
+    CachedFeedback, Challenge, ChatMessage, Game, GameReview, Move, Opening, PipelineWatermark, UserChallenge, UserProfile,
+    UserProgress, position_key
+)
+from .prompts import CHAT_SUMMARY_PROMPT, INTENT_PROMPT, MOVE_FEEDBACK_PROMPT
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+class AnalysisContext:
+    """
+    Memoizes engine search results for the duration of one move submission.
+    Pass the same context to StockfishEngine and FeedbackGenerator calls so
+    each position is searched at most once.
+    """
+    def __init__(self):
+        self._results = {}
+    
+    def get(self, fen, depth, num_moves=1):
+        """Return a cached search with at least num_moves lines, or None."""
+        result = self._results.get((fen, depth))
+        if result is None:
+            return None
+        # A search that found fewer lines than requested has exhausted the legal moves
+        if result['multipv'] >= num_moves or len(result['lines']) < result['multipv']:
+            return result
+        return None
+    
+    def store(self, fen, depth, result):
+        """Remember a search result, keeping the one with the most lines."""
+        current = self._results.get((fen, depth))
+        if current is None or result['multipv'] >= current['multipv']:
+            self._results[(fen, depth)] = result
+        return result
+
+def _search_result(board, analysis, num_moves):
+    """Score (pawns, white's perspective) and top lines of a multipv search."""
+    lines = []
+    for info in analysis:
+        if not info.get("pv"):
+            continue
+        move = info["pv"][0]
+        lines.append({
+            "move": move,
+            "san": board.san(move),
+            "score": info["score"].white().score(mate_score=10000) / 100.0
+        })
+    score = analysis[0]["score"].white().score(mate_score=10000) if analysis else None
+    return {
+        'score': score / 100.0 if score is not None else 0.0,
+        'lines': lines,
+        'multipv': num_moves,
+        'depth': analysis[0].get("depth", 0) if analysis else 0
+    }
+
 class StockfishEngine:
     """
     Service class to handle Stockfish engine communication.
     Uses singleton pattern to ensure only one engine instance.
+    The engine is shared with background workers, so every command sent to
+    it is serialized through a lock (a new command would cancel a running one).
     """
     _instance = None
     _engine = None
+    _lock = threading.RLock()
+    
+    # Lines searched by analyze_move, enough to cover the move feedback
+    ANALYSIS_LINES = 3
     
     def __new__(cls):
+        # The engine process itself is started on first use (_ensure_engine_running)
         if cls._instance is None:
             cls._instance = super(StockfishEngine, cls).__new__(cls)
-            cls._instance._initialize_engine()
         return cls._instance
     
     def _initialize_engine(self):
         """Initialize or reinitialize the Stockfish engine."""
-        # First close any existing engine
-        if self._engine:
+        with self._lock:
+            # First close any existing engine
+            if self._engine:
+                try:
+                    self._engine.quit()
+                except Exception as e:
+                    logger.error(f"Error quitting Stockfish: {e}")
+                self._engine = None
+            
             try:
-                self._engine.quit()
+                # Try to find Stockfish in the system path
+                self._engine = chess.engine.SimpleEngine.popen_uci("stockfish")
+                # logger.info("Stockfish engine initialized")
+                return True
             except Exception as e:
-                logger.error(f"Error quitting Stockfish: {e}")
-            self._engine = None
-            
-        try:
-            # Try to find Stockfish in the system path
-            self._engine = chess.engine.SimpleEngine.popen_uci("stockfish")
-            # logger.info("Stockfish engine initialized")
-            return True
-        except Exception as e:
-            logger.warning(f"Failed to initialize Stockfish: {e}")
-            logger.warning("Running without Stockfish support. Some features may be limited.")
-            self._engine = None
-            return False
+                logger.warning(f"Failed to initialize Stockfish: {e}")
+                logger.warning("Running without Stockfish support. Some features may be limited.")
+                self._engine = None
+                return False
     
     def __del__(self):
         if self._engine:
@@ -64,15 +136,96 @@ class StockfishEngine:
         try:
             # Ping the engine with a simple command
             test_board = chess.Board()
-            self._engine.analyse(test_board, chess.engine.Limit(depth=1, time=0.1))
+            with self._lock:
+                self._engine.analyse(test_board, chess.engine.Limit(depth=1, time=0.1))
             return True
         except Exception as e:
             logger.error(f"Engine check failed: {e}")
             # logger.info("Attempting to restart Stockfish engine")
             return self._initialize_engine()
     
+    def _search(self, fen, num_moves=1, depth=15, context=None, shared=True):
+        """
+        Run a single multipv search and return the position score together
+        with the top lines. Results are memoized on the context if given.
+        With shared off the AnalysisCache is not read, as it answers with
+        deeper searches than asked for.
+        """
+        if context is not None:
+            cached = context.get(fen, depth, num_moves)
+            if cached is not None:
+                return cached
+        
+        # Searches are shared between requests and warmed up by ponder()
+        result = AnalysisCache.search_result(fen, depth, num_moves) if shared else None
+        if result is None:
+            board = chess.Board(fen)
+            with self._lock:
+                # A ponder search of this position may have just finished
+                if shared:
+                    result = AnalysisCache.search_result(fen, depth, num_moves)
+                if result is None:
+                    analysis = self._engine.analyse(
+                        board,
+                        chess.engine.Limit(depth=depth),
+                        multipv=num_moves
+                    )
+            if result is None:
+                result = _search_result(board, analysis, num_moves)
+                AnalysisCache.store(fen, result)
+        if context is not None:
+            context.store(fen, depth, result)
+        return result
+    
+    def ponder(self, fen, depth=15):
+        """
+        Search a position before it is needed, while the user is thinking,
+        with the lines analyze_move uses. The result goes to the
+        AnalysisCache, where analyze_move, get_hint and the move feedback
+        pick it up. The search stops after PONDER_TIME seconds.
+        """
+        if AnalysisCache.search_result(fen, depth, self.ANALYSIS_LINES) is not None:
+            return
+        if not self._ensure_engine_running():
+            return
+        board = chess.Board(fen)
+        if board.is_game_over():
+            return
+        try:
+            with self._lock:
+                if AnalysisCache.search_result(fen, depth, self.ANALYSIS_LINES) is not None:
+                    return
+                analysis = self._engine.analyse(
+                    board,
+                    chess.engine.Limit(depth=depth, time=getattr(settings, 'PONDER_TIME', 2.0)),
+                    multipv=self.ANALYSIS_LINES
+                )
+        except Exception as e:
+            logger.error(f"Error pondering {fen}: {e}")
+            return
+        AnalysisCache.store(fen, _search_result(board, analysis, self.ANALYSIS_LINES))
+    
+    def evaluate_position(self, fen, depth=15, context=None):
+        """
+        Evaluate a position and return the score from white's perspective.
+        Reuses the search stored on the context when one is given.
+        """
+        if context is None:
+            return self._evaluate_position(fen, depth)
+        
+        if not self._ensure_engine_running():
+            return 0.0  # Fallback to neutral evaluation
+        
+        try:
+            return self._search(fen, 1, depth, context)['score']
+        except Exception as e:
+            logger.error(f"Error evaluating position: {e}")
+            # Try to restart the engine on failure
+            self._initialize_engine()
+            return 0.0
+    
     @lru_cache(maxsize=1024)
-    def evaluate_position(self, fen, depth=15):
+    def _evaluate_position(self, fen, depth=15):
         """
         Evaluate a position and return the score from white's perspective.
         Uses LRU cache to avoid redundant evaluations.
@@ -84,7 +237,8 @@ class StockfishEngine:
             board = chess.Board(fen)
             
             # Get info from engine
-            info = self._engine.analyse(board, chess.engine.Limit(depth=depth))
+            with self._lock:
+                info = self._engine.analyse(board, chess.engine.Limit(depth=depth))
             
             # Convert score to a numerical value
             score = info["score"].white().score(mate_score=10000)
@@ -98,7 +252,7 @@ class StockfishEngine:
             self._initialize_engine()
             return 0.0
     
-    def get_best_move(self, fen, depth=15):
+    def get_best_move(self, fen, depth=15, context=None):
         """Get the best move for a position."""
         if not self._ensure_engine_running():
             # If Stockfish is not available, make a basic move using Python-chess
@@ -126,8 +280,15 @@ class StockfishEngine:
             if board.is_game_over():
                 return None
             
+            # Reuse the principal variation of a search on the context. The
+            # depth is the AI's strength, so a deeper shared search must not answer
+            if context is not None:
+                lines = self._search(fen, 1, depth, context, shared=False)['lines']
+                return lines[0]['move'] if lines else None
+            
             # Get best move from engine
-            result = self._engine.play(board, chess.engine.Limit(depth=depth))
+            with self._lock:
+                result = self._engine.play(board, chess.engine.Limit(depth=depth))
             
             return result.move
         except Exception as e:
@@ -147,9 +308,9 @@ class StockfishEngine:
             
             return None
     
-    def get_top_moves(self, fen, num_moves=3, depth=15):
+    def get_top_moves(self, fen, num_moves=3, depth=15, context=None):
         """Get the top N moves for a position with evaluations."""
-        if not self._engine:
+        if not self._ensure_engine_running():
             # Simplified fallback if Stockfish is not available
             try:
                 board = chess.Board(fen)
@@ -172,52 +333,36 @@ class StockfishEngine:
             if board.is_game_over():
                 return []
             
-            # Get multiple lines from engine
-            multipv_results = []
-            
-            # Use a separate Stockfish instance for multipv analysis
-            try:
-                with chess.engine.SimpleEngine.popen_uci("stockfish") as temp_engine:
-                    analysis = temp_engine.analyse(
-                        board, 
-                        chess.engine.Limit(depth=depth),
-                        multipv=num_moves
-                    )
-                    for result in analysis:
-                        move = result["pv"][0]
-                        score = result["score"].white().score(mate_score=10000) / 100.0
-                        multipv_results.append({
-                            "move": move,
-                            "san": board.san(move),
-                            "score": score
-                        })
-            except Exception as e:
-                logger.error(f"Error with temporary engine: {e}")
-                # Fallback to the main engine if temp engine fails
-                if self._engine:
-                    best_move = self.get_best_move(fen, depth)
-                    if best_move:
-                        multipv_results.append({
-                            "move": best_move,
-                            "san": board.san(best_move),
-                            "score": 0.0
-                        })
-            
-            return multipv_results
+            # Get multiple lines from the engine in a single multipv search
+            return self._search(fen, num_moves, depth, context)['lines'][:num_moves]
         except Exception as e:
             logger.error(f"Error getting top moves: {e}")
+            # Fallback to a single best move
+            best_move = self.get_best_move(fen, depth)
+            if best_move:
+                return [{
+                    "move": best_move,
+                    "san": chess.Board(fen).san(best_move),
+                    "score": 0.0
+                }]
             return []
     
-    def analyze_move(self, fen, move_uci, depth=15):
+    def analyze_move(self, fen, move_uci, depth=15, context=None):
         # print("analyze_move method called")
         # print(f"FEN: {fen}")
         # print(f"Move UCI: {move_uci}")
         """
         Analyze a specific move compared to the best move.
-        Returns evaluation, classification and reason.
+        Returns evaluation, classification and reason; the evaluation is
+        None when the move was not searched (no engine, a standard opening
+        move or an error), so no placeholder is saved as a score.
+        The position is searched once with enough lines for the feedback
+        that follows; pass a context to share that search with it.
         """
         if not self._ensure_engine_running():
-            return 0.0, "normal", "No engine available for detailed analysis."
+            return None, "normal", "No engine available for detailed analysis."
+        if context is None:
+            context = AnalysisContext()
         try:
             board = chess.Board(fen)
             move = chess.Move.from_uci(move_uci)
@@ -226,23 +371,23 @@ class StockfishEngine:
                 return None, "illegal", "This move is not legal in the given position."
             # Special handling for standard opening moves
             if self._is_standard_opening_move(board, move):
-                return 0.0, "good", "This is a standard opening move."
-            eval_before = self.evaluate_position(fen, depth)
-            best_move = self.get_best_move(fen, depth)
-            if best_move:
-                best_board = chess.Board(fen)
-                best_board.push(best_move)
-                eval_best = self.evaluate_position(best_board.fen(), depth)
-            else:
-                eval_best = eval_before
+                return None, "good", "This is a standard opening move."
+            analysis = self._search(fen, self.ANALYSIS_LINES, depth, context)
+            lines = analysis['lines']
+            eval_best = lines[0]['score'] if lines else analysis['score']
             board.push(move)
-            eval_after = self.evaluate_position(board.fen(), depth)
+            # The score of the played move is already known if it is one of the top lines
+            played = next((line for line in lines if line['move'] == move), None)
+            if played is not None:
+                eval_after = played['score']
+            else:
+                eval_after = self.evaluate_position(board.fen(), depth, context)
             move_loss = eval_best - eval_after
             classification, reason = self._classify_move(move_loss, board.turn)
             return eval_after, classification, reason
         except Exception as e:
             logger.error(f"Error analyzing move: {e}")
-            return 0.0, "normal", "Error during analysis."
+            return None, "normal", "Error during analysis."
     
     def _is_standard_opening_move(self, board, move):
         """
@@ -333,23 +478,219 @@ class StockfishEngine:
         else:
             return "blunder", "This move is a blunder that could cost you the game."
 
-class ChessNLP:
+class EngineBusy(Exception):
+    """No engine in the pool became free within its checkout timeout."""
+
+class EnginePool:
     """
-    Natural Language Processing service for chess-related conversations.
+    A set of Stockfish processes for batch analysis. StockfishEngine runs
+    every search through one shared process; the pool runs one search per
+    process in parallel. Use it as a context manager so the processes are
+    stopped when the batch work is done. A search waits at most
+    checkout_timeout seconds for a free engine (None waits until one is
+    free) and then raises EngineBusy.
     """
-    def __init__(self):
-        # Download necessary NLTK packages if not already downloaded
+    def __init__(self, size=None, checkout_timeout=None):
+        self.size = size or getattr(settings, 'ENGINE_POOL_SIZE', None) or os.cpu_count() or 1
+        self.checkout_timeout = checkout_timeout
+        self._engines = queue.Queue()
+        self._started = []
+
+    def __enter__(self):
+        for _ in range(self.size):
+            try:
+                engine = chess.engine.SimpleEngine.popen_uci("stockfish")
+            except Exception as e:
+                logger.warning(f"Failed to start Stockfish for the engine pool: {e}")
+                break
+            self._started.append(engine)
+            self._engines.put(engine)
+        return self
+
+    def __exit__(self, *exc_info):
+        for engine in self._started:
+            try:
+                engine.quit()
+            except Exception as e:
+                logger.error(f"Error quitting Stockfish: {e}")
+        self._started = []
+
+    @property
+    def available(self):
+        return bool(self._started)
+
+    def _checkout(self):
         try:
-            nltk.data.find('tokenizers/punkt')
-        except LookupError:
-            nltk.download('punkt')
-        
+            return self._engines.get(timeout=self.checkout_timeout)
+        except queue.Empty:
+            raise EngineBusy(f"No free engine after {self.checkout_timeout}s") from None
+
+    def analyse(self, fen, depth=15, num_moves=1, time=None):
+        """Search one position on the next free engine (same result as StockfishEngine._search)."""
+        board = chess.Board(fen)
+        engine = self._checkout()
         try:
-            nltk.data.find('corpora/stopwords')
-        except LookupError:
-            nltk.download('stopwords')
-        
-        self.stop_words = set(stopwords.words('english'))
+            analysis = engine.analyse(board, chess.engine.Limit(depth=depth, time=time), multipv=num_moves)
+        except chess.engine.EngineTerminatedError:
+            engine = self._restart(engine)
+            raise
+        finally:
+            self._engines.put(engine)
+        return _search_result(board, analysis, num_moves)
+
+    def _restart(self, engine):
+        """Replace a crashed engine process; returns the engine to put back in the pool."""
+        try:
+            replacement = chess.engine.SimpleEngine.popen_uci("stockfish")
+        except Exception as e:
+            logger.error(f"Failed to restart Stockfish in the engine pool: {e}")
+            return engine
+        self._started[self._started.index(engine)] = replacement
+        return replacement
+
+    def analyse_many(self, fens, depth=15, num_moves=1, time=None):
+        """Search positions in parallel; returns {fen: result} with each position searched once."""
+        fens = list(dict.fromkeys(fens))
+        if not fens:
+            return {}
+        with ThreadPoolExecutor(max_workers=len(self._started)) as executor:
+            results = executor.map(lambda fen: self.analyse(fen, depth, num_moves, time), fens)
+            return dict(zip(fens, results))
+
+    def analyse_iter(self, fens, depth=15, num_moves=1, time=None):
+        """
+        Search positions in parallel, yielding (fen, result) as each search
+        finishes; result is None if the search failed. Searches not yet
+        started are cancelled if the caller stops iterating.
+        """
+        executor = ThreadPoolExecutor(max_workers=len(self._started))
+        try:
+            futures = {
+                executor.submit(self.analyse, fen, depth, num_moves, time): fen
+                for fen in dict.fromkeys(fens)
+            }
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result()
+                except Exception as e:
+                    logger.error(f"Error analysing {futures[future]}: {e}")
+                    yield futures[future], None
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def analysis_depths(self, fen, depth=15, num_moves=1, time=None):
+        """
+        Search one position, yielding a result (as analyse returns, with each
+        line's principal variation added in SAN) every time the search
+        completes a new depth. Closing the generator stops the search.
+        """
+        board = chess.Board(fen)
+        last_line = min(num_moves, board.legal_moves.count())
+        engine = self._checkout()
+        try:
+            with engine.analysis(board, chess.engine.Limit(depth=depth, time=time), multipv=num_moves) as analysis:
+                reported = 0
+                for info in analysis:
+                    # Each depth reports its lines in order, so the last one completes it
+                    if info.get('multipv', 1) != last_line or 'pv' not in info or info.get('depth', 0) <= reported:
+                        continue
+                    reported = info['depth']
+                    lines = [line for line in analysis.multipv if line.get('pv')]
+                    result = _search_result(board, lines, num_moves)
+                    for line, line_info in zip(result['lines'], lines):
+                        line['pv'] = board.variation_san(line_info['pv'])
+                    yield result
+        except chess.engine.EngineTerminatedError:
+            engine = self._restart(engine)
+            raise
+        finally:
+            self._engines.put(engine)
+
+class AnalysisCache:
+    """
+    Engine results shared by every worker through the Django cache. Each
+    position has one entry holding its deepest search so far, which also
+    answers requests for a shallower search or fewer lines. Entries are
+    stored JSON-ready, with moves as UCI strings.
+    """
+    @staticmethod
+    def cache_key(fen):
+        # The move counters do not change the analysis
+        position = ' '.join(fen.split(' ')[:4])
+        return f"analysis:{hashlib.sha1(position.encode()).hexdigest()}"
+
+    @classmethod
+    def _entry(cls, fen, depth, num_moves):
+        entry = cache.get(cls.cache_key(fen))
+        if entry is None or entry['depth'] < depth:
+            return None
+        # A search that found fewer lines than requested has exhausted the legal moves
+        if entry['multipv'] < num_moves and len(entry['lines']) >= entry['multipv']:
+            return None
+        return entry
+
+    @classmethod
+    def get(cls, fen, depth, num_moves=1):
+        """The JSON-ready entry with num_moves lines, or None if no deep enough search is cached."""
+        entry = cls._entry(fen, depth, num_moves)
+        return entry and dict(entry, lines=entry['lines'][:num_moves])
+
+    @classmethod
+    def search_result(cls, fen, depth, num_moves=1):
+        """Like get, but in the form StockfishEngine._search returns (moves as chess.Move)."""
+        entry = cls._entry(fen, depth, num_moves)
+        if entry is None:
+            return None
+        lines = [dict(line, move=chess.Move.from_uci(line['move'])) for line in entry['lines']]
+        return dict(entry, lines=lines)
+
+    @classmethod
+    def store(cls, fen, result):
+        """Save a search result unless a deeper one is cached; returns the JSON-ready entry."""
+        entry = {
+            'score': result['score'],
+            'depth': result['depth'],
+            'multipv': result['multipv'],
+            'lines': [
+                {'move': line['move'].uci(), 'san': line['san'], 'score': line['score']}
+                for line in result['lines']
+            ],
+        }
+        key = cls.cache_key(fen)
+        cached = cache.get(key)
+        if cached is None or cached['depth'] < entry['depth'] or cached['multipv'] < entry['multipv']:
+            cache.set(key, entry, getattr(settings, 'ANALYSIS_CACHE_TTL', 24 * 3600))
+        return entry
+
+# English stopwords used when the NLTK corpus is not installed
+STOP_WORDS = frozenset("""
+a about above after again against all am an and any are as at be because been before being below between both
+but by can could did do does doing down during each few for from further had has have having he her here hers
+herself him himself his how i if in into is it its itself just me more most my myself no nor not now of off on
+once only or other our ours ourselves out over own same she should so some such than that the their theirs them
+themselves then there these they this those through to too under until up very was we were what when where which
+while who whom why will with would you your yours yourself yourselves
+""".split())
+
+class ChessNLP:
+    """
+    Natural Language Processing service for chess-related conversations.
+    Intents are classified locally with keyword rules (on spaCy lemmas when a
+    pipeline is given); only low-confidence messages are sent to the LLM.
+    """
+    INTENTS = ['opening_info', 'move_analysis', 'general', 'greeting', 'hint', 'other']
+    
+    # Phrases that ask for the next move even without a help keyword
+    HINT_PHRASES = ['best move', 'next move', 'what should', 'what do i play', 'what to play', 'what now']
+    
+    # Words that ask for a judgement on a specific move
+    MOVE_QUALITY_WORDS = ['good', 'bad', 'mistake', 'blunder', 'analyze', 'analyse', 'analysis', 'strong', 'weak']
+    
+    def __init__(self, nlp=None):
+        # Optional spaCy pipeline used for lemmatization
+        self.nlp = nlp
+        self.intent_threshold = getattr(settings, 'INTENT_CONFIDENCE_THRESHOLD', 0.6)
+        self._stop_words = None
         self.chess_keywords = {
             'opening': ['opening', 'variant', 'line', 'theory', 'book'],
             'tactic': ['tactic', 'fork', 'pin', 'skewer', 'discovered', 'attack', 'sacrifice'],
@@ -363,50 +704,32 @@ class ChessNLP:
             'greeting': ['hello', 'hi', 'hey', 'greetings']
         }
     
+    @property
+    def stop_words(self):
+        """
+        NLTK English stopwords if the corpus is installed (see NLTK_DATA_PATH),
+        else the built-in STOP_WORDS. Never downloaded at request time.
+        """
+        if self._stop_words is None:
+            try:
+                import nltk
+                data_path = getattr(settings, 'NLTK_DATA_PATH', None)
+                if data_path and data_path not in nltk.data.path:
+                    nltk.data.path.append(data_path)
+                from nltk.corpus import stopwords
+                self._stop_words = frozenset(stopwords.words('english'))
+            except (ImportError, LookupError):
+                logger.info("NLTK stopwords not installed; using the built-in list")
+                self._stop_words = STOP_WORDS
+        return self._stop_words
+    
     def analyze_message(self, message, board_fen=None, opening=None):
         # print("analyze message called")
-        # Compose a prompt for Gemini
-        prompt = (
-            "Classify the user's intent as one of: opening_info, move_analysis, general, greeting, hint, or other.\n"
-            f"User message: '{message}'\n"
-            "Return only the intent."
-        )
-        try:
-            client = OpenAI(
-                base_url="https://openrouter.ai/api/v1",
-                api_key=getattr(settings, 'OPENAI_API_KEY', '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')
-            )
-            completion = client.chat.completions.create(
-                extra_body={},
-                model="google/gemini-2.0-flash-001",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ]
-            )
-            intent = completion.choices[0].message.content.strip().lower()
-        except Exception as e:
-            # print(f"Gemini intent detection failed: {e}")
-            intent = "general"
+        intent, confidence = self.classify_intent(message)
+        if confidence < self.intent_threshold:
+            intent = self._classify_intent_remote(message, default=intent)
 
-        # Extract move UCI using multiple patterns
-        move_uci = None
-        # Try to find UCI format (e2e4, g1f3, etc.)
-        uci_match = re.search(r'([a-h][1-8][a-h][1-8][qrbn]?)', message.lower())
-        if uci_match:
-            move_uci = uci_match.group(1)
-        else:
-            # Try to find SAN format (e4, Nf3, O-O, etc.)
-            san_match = re.search(r'\b([KQRBN]?[a-h]?[1-8]?x?[a-h][1-8](?:=[QRBN])?|O-O(?:-O)?)\b', message)
-            if san_match and board_fen:
-                try:
-                    board = chess.Board(board_fen)
-                    move = board.parse_san(san_match.group(1))
-                    move_uci = move.uci()
-                except ValueError:
-                    pass
+        move_uci = self._extract_move(message, board_fen)
 
         # print("move", move_uci)
         if intent == "move_analysis" and move_uci:
@@ -416,6 +739,111 @@ class ChessNLP:
         # print("returning intent")
         return {'intent': intent}
     
+    def classify_intent(self, message):
+        """Classify a single message locally. Returns (intent, confidence)."""
+        return self.classify_intents([message])[0]
+    
+    def classify_intents(self, messages):
+        """
+        Classify a batch of messages locally, running them through spaCy in
+        one nlp.pipe call when a pipeline is available.
+        Returns a list of (intent, confidence) tuples.
+        """
+        if self.nlp is not None:
+            token_lists = [
+                [token.lower_ for token in doc] + [token.lemma_.lower() for token in doc]
+                for doc in self.nlp.pipe(messages)
+            ]
+        else:
+            token_lists = [self._tokenize(message) for message in messages]
+        return [
+            self._score_intent(message, tokens)
+            for message, tokens in zip(messages, token_lists)
+        ]
+    
+    def _tokenize(self, message):
+        return re.findall(r"[a-z0-9']+|\?", message.lower())
+    
+    def _extract_topics(self, tokens):
+        """Return the chess_keywords topics mentioned in the tokens."""
+        token_set = set(tokens)
+        return {
+            topic for topic, words in self.chess_keywords.items()
+            if token_set.intersection(words)
+        }
+    
+    def _score_intent(self, message, tokens):
+        """Score each intent with keyword rules and pick the strongest."""
+        lowered = message.lower()
+        topics = self._extract_topics(tokens)
+        content_tokens = [t for t in tokens if t not in self.stop_words and t != '?']
+        mentions_move = self._find_move_text(message) is not None
+        
+        scores = dict.fromkeys(self.INTENTS, 0.0)
+        if 'greeting' in topics:
+            scores['greeting'] += 0.9 if len(content_tokens) <= 3 else 0.5
+        if 'help' in topics or any(phrase in lowered for phrase in self.HINT_PHRASES):
+            scores['hint'] += 0.8
+        if 'opening' in topics:
+            scores['opening_info'] += 0.8
+        if mentions_move:
+            scores['move_analysis'] += 0.5
+            if 'why' in topics or 'evaluation' in topics or set(tokens).intersection(self.MOVE_QUALITY_WORDS):
+                scores['move_analysis'] += 0.4
+        if topics.intersection(['tactic', 'strategy', 'endgame', 'piece', 'evaluation', 'why', 'time']):
+            scores['general'] += 0.6
+        
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        (best_intent, best), (_, second) = ranked[0], ranked[1]
+        if best == 0:
+            # Nothing chess related; leave it to the LLM to decide
+            return 'other', 0.3
+        # Two competing intents lower the confidence
+        confidence = min(best, 1.0) - 0.5 * min(second, 1.0)
+        return best_intent, round(confidence, 2)
+    
+    def _classify_intent_remote(self, message, default='general'):
+        """Classify a message with the LLM, falling back to default."""
+        # Compose a prompt for Gemini
+        prompt = INTENT_PROMPT.render(message=message)
+        try:
+            intent = get_gateway().complete(
+                prompt,
+                timeout=getattr(settings, 'LLM_INTENT_TIMEOUT', 3.0),
+                call_site='intent'
+            ).lower()
+        except Exception as e:
+            # print(f"Gemini intent detection failed: {e}")
+            return default
+        return intent if intent in self.INTENTS else default
+    
+    def _find_move_text(self, message):
+        """Return the first UCI or SAN move mentioned in the message, if any."""
+        # Try to find UCI format (e2e4, g1f3, etc.)
+        uci_match = re.search(r'\b([a-h][1-8][a-h][1-8][qrbn]?)\b', message.lower())
+        if uci_match:
+            return uci_match.group(1)
+        # Try to find SAN format (e4, Nf3, O-O, etc.)
+        san_match = re.search(r'\b([KQRBN]?[a-h]?[1-8]?x?[a-h][1-8](?:=[QRBN])?|O-O(?:-O)?)\b', message)
+        if san_match:
+            return san_match.group(1)
+        return None
+    
+    def _extract_move(self, message, board_fen=None):
+        """Extract a move from the message as a UCI string."""
+        move_text = self._find_move_text(message)
+        if move_text is None:
+            return None
+        if re.fullmatch(r'[a-h][1-8][a-h][1-8][qrbn]?', move_text):
+            return move_text
+        if board_fen:
+            try:
+                board = chess.Board(board_fen)
+                return board.parse_san(move_text).uci()
+            except ValueError:
+                pass
+        return None
+    
     def _determine_intent(self, message, topics, tokens):
         """Determine the primary intent of the message."""
         # Check for questions
@@ -471,7 +899,7 @@ class ChessNLP:
                 
             from chess_app.models import Move
             # Find the last AI move to explain
-            last_ai_move = Move.objects.filter(game=game, player='ai').order_by('-move_number').first()
+            last_ai_move = Move.objects.filter(game=game, player='ai', detached=False).order_by('-move_number').first()
             if last_ai_move:
                 return f"I played {last_ai_move.move_san} because {last_ai_move.feedback}"
             else:
@@ -526,6 +954,280 @@ class ChessNLP:
         else:
             return "That's interesting! Let me know if you want to discuss strategy, analyze a move, or just chat about chess (or anything else)."
 
+class ChatHistory:
+    """
+    Server-side conversation state for a game.
+    Recent messages are kept verbatim in a sliding window; older ones are
+    folded into a rolling summary on the game, so the prompt stays within
+    CHAT_TOKEN_BUDGET however long the conversation gets. Folding calls the
+    LLM, so it runs in the background (summarize) once CHAT_SUMMARY_BATCH
+    messages have left the window, never on the request thread.
+    """
+    def __init__(self, game, window=None, token_budget=None, summary_tokens=None):
+        self.game = game
+        self.window = window or getattr(settings, 'CHAT_WINDOW_MESSAGES', 8)
+        self.token_budget = token_budget or getattr(settings, 'CHAT_TOKEN_BUDGET', 1500)
+        self.summary_tokens = summary_tokens or getattr(settings, 'CHAT_SUMMARY_TOKENS', 300)
+        # Messages outside the window that are not summarized yet, set by context()
+        self.overflow = 0
+    
+    @staticmethod
+    def estimate_tokens(text):
+        """Rough token count (about four characters per token)."""
+        return estimate_tokens(text)
+    
+    def add(self, role, content):
+        """Append a message to the conversation."""
+        return ChatMessage.objects.create(game=self.game, role=role, content=content)
+    
+    def clear(self):
+        """Forget the conversation."""
+        ChatMessage.objects.filter(game=self.game).delete()
+        Game.objects.filter(id=self.game.id).update(chat_summary='')
+        self.game.chat_summary = ''
+    
+    def context(self):
+        """
+        Return (summary, recent_messages) for the prompt. Messages that no
+        longer fit the window or budget are left out until summarized.
+        """
+        overflow, recent = self._split()
+        self.overflow = len(overflow)
+        return self.game.chat_summary, [
+            {"role": message['role'], "content": message['content']} for message in recent
+        ]
+    
+    @property
+    def needs_summary(self):
+        return self.overflow >= getattr(settings, 'CHAT_SUMMARY_BATCH', 4)
+    
+    def summarize(self):
+        """Fold the messages that left the window into the summary (a background task)."""
+        lock = f"chat_summary:{self.game.id}"
+        if not cache.add(lock, True, int(getattr(settings, 'LLM_SUMMARY_TIMEOUT', 10.0)) + 5):
+            return  # Another worker is folding this conversation
+        try:
+            overflow, _ = self._split()
+            if overflow:
+                self._fold_into_summary(overflow)
+        finally:
+            cache.delete(lock)
+    
+    def _split(self):
+        """(older messages to summarize, recent messages), both oldest first."""
+        pending = list(
+            ChatMessage.objects.filter(game=self.game, in_summary=False)
+            .order_by('-created_at', '-id')
+            .values('id', 'role', 'content')
+        )
+        
+        # Keep the newest messages that fit both the window and the budget
+        budget = self.token_budget - self.estimate_tokens(self.game.chat_summary)
+        recent = []
+        for message in pending:
+            cost = self.estimate_tokens(message['content'])
+            if len(recent) >= self.window or cost > budget:
+                break
+            recent.append(message)
+            budget -= cost
+        recent.reverse()
+        overflow = pending[len(recent):]
+        overflow.reverse()
+        return overflow, recent
+    
+    def _fold_into_summary(self, messages):
+        """Merge messages into the rolling summary and mark them summarized."""
+        transcript = "\n".join(
+            f"{'User' if m['role'] == 'user' else 'Assistant'}: {m['content']}" for m in messages
+        )
+        max_chars = self.summary_tokens * 4
+        prompt = CHAT_SUMMARY_PROMPT.render(
+            max_tokens=self.summary_tokens,
+            summary=self.game.chat_summary or '(empty)',
+            transcript=transcript
+        )
+        try:
+            summary = get_gateway().complete(
+                prompt,
+                timeout=getattr(settings, 'LLM_SUMMARY_TIMEOUT', 10.0),
+                call_site='chat_summary'
+            )
+        except LLMUnavailable as e:
+            logger.warning(f"Chat summary unavailable, truncating instead: {e}")
+            summary = f"{self.game.chat_summary}\n{transcript}".strip()
+        # Keep the most recent part if the summary is still too long
+        summary = summary[-max_chars:]
+        
+        Game.objects.filter(id=self.game.id).update(chat_summary=summary)
+        ChatMessage.objects.filter(id__in=[m['id'] for m in messages]).update(in_summary=True)
+        self.game.chat_summary = summary
+
+class OpeningBook:
+    """
+    Opening theory compiled once per process: the positions reached along
+    each opening's moves and its main line as SAN. Entries are read-only,
+    so building them before the workers fork lets every worker share them.
+    """
+    _entries = {}
+    _lock = threading.Lock()
+    
+    @staticmethod
+    def _san_moves(text):
+        # Filter out move numbers (entries ending with '.')
+        return tuple(move for move in (text or '').split() if not move.endswith('.'))
+    
+    @classmethod
+    def get(cls, opening):
+        """Return the compiled entry for an Opening, compiling it if needed."""
+        # Keyed on the move text too, so an edited opening is recompiled
+        key = (opening.pk, opening.pgn_moves, opening.main_line)
+        entry = cls._entries.get(key)
+        if entry is None:
+            entry = cls._compile(opening)
+            with cls._lock:
+                cls._entries[key] = entry
+        return entry
+    
+    @classmethod
+    def _compile(cls, opening):
+        positions = set()
+        board = chess.Board()
+        for san_move in cls._san_moves(opening.pgn_moves):
+            try:
+                board.push(board.parse_san(san_move))
+            except ValueError as e:
+                logger.error(f"Error parsing opening move in {opening}: {e}")
+                continue
+            positions.add(position_key(board))
+        return {
+            'positions': frozenset(positions),
+            'main_line': cls._san_moves(opening.main_line),
+        }
+    
+    @classmethod
+    def compile_all(cls):
+        """Compile every opening in the database; returns the number compiled."""
+        openings = list(Opening.objects.only('id', 'pgn_moves', 'main_line'))
+        for opening in openings:
+            cls.get(opening)
+        return len(openings)
+
+class SolutionTree:
+    """
+    Challenge solutions compiled once per process into a map from the
+    position after each accepted solver move to the forced reply. Lines
+    are keyed by position, so transpositions and alternative solutions
+    given as PGN variations are accepted and checking a move is one lookup.
+    """
+    _entries = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls, challenge):
+        """Return the compiled tree for a Challenge, compiling it if needed."""
+        key = (challenge.pk, challenge.fen_position, challenge.solution_moves)
+        entry = cls._entries.get(key)
+        if entry is None:
+            entry = cls._compile(challenge)
+            with cls._lock:
+                cls._entries[key] = entry
+        return entry
+
+    @classmethod
+    def _compile(cls, challenge):
+        """
+        Returns {'color', 'replies', 'positions'}: replies maps the
+        position key after an accepted solver move to (reply uci or None,
+        completed), positions holds the keys where the solver is to move.
+        """
+        root = chess.Board(challenge.fen_position)
+        game = chess.pgn.read_game(io.StringIO(
+            f'[SetUp "1"]\n[FEN "{challenge.fen_position}"]\n\n{challenge.solution_moves}'
+        ))
+        for error in game.errors:
+            logger.error(f"Error parsing solution of challenge {challenge.pk}: {error}")
+
+        replies = {}
+        positions = {position_key(root)}
+        nodes = [game]
+        while nodes:
+            node = nodes.pop()
+            board = node.board()
+            for child in node.variations:
+                nodes.append(child)
+                if board.turn != root.turn:
+                    positions.add(position_key(child.board()))
+                    continue
+                # The main line reply is played; alternatives are compiled via the child
+                reply = child.variations[0] if child.variations else None
+                completed = reply is None or not any(
+                    branch.variations for branch in child.variations
+                )
+                replies.setdefault(
+                    position_key(child.board()),
+                    (reply.move.uci() if reply else None, completed)
+                )
+        return {
+            'color': root.turn,
+            'replies': replies,
+            'positions': frozenset(positions),
+        }
+
+    @classmethod
+    def check(cls, challenge, board, move):
+        """
+        Look up the position reached by the solver's move from board, which
+        must be a position of the solution with the solver to move. Returns
+        (reply uci or None, completed), or None if the move is not accepted.
+        """
+        tree = cls.get(challenge)
+        if board.turn != tree['color'] or position_key(board) not in tree['positions']:
+            return None
+        if move not in board.legal_moves:
+            return None
+        board = board.copy(stack=False)
+        board.push(move)
+        return tree['replies'].get(position_key(board))
+
+    @classmethod
+    def verify_line(cls, challenge, moves):
+        """
+        Replay a full line (SAN or UCI, both sides) from the challenge
+        position; True if it reaches the end of any solution line.
+        """
+        tree = cls.get(challenge)
+        board = chess.Board(challenge.fen_position)
+        for text in moves:
+            try:
+                move = board.parse_san(text)
+            except ValueError:
+                try:
+                    move = board.parse_uci(text)
+                except ValueError:
+                    return False
+            solver_move = board.turn == tree['color']
+            board.push(move)
+            key = position_key(board)
+            if solver_move:
+                if key not in tree['replies']:
+                    return False
+                if tree['replies'][key][1]:
+                    return True
+            elif key not in tree['positions']:
+                return False
+        return False
+
+    @classmethod
+    def compile_all(cls):
+        """Compile every challenge in the database; returns the number compiled."""
+        challenges = list(Challenge.objects.only('id', 'fen_position', 'solution_moves'))
+        for challenge in challenges:
+            try:
+                cls.get(challenge)
+            except ValueError as e:
+                logger.error(f"Invalid position in challenge {challenge.pk}: {e}")
+        return len(challenges)
+
 class OpeningExplorer:
     """Service for exploring chess openings and generating moves based on opening theory."""
     
@@ -556,19 +1258,11 @@ class OpeningExplorer:
             # logger.info(f"Position {board.fen()} is no longer in opening theory")
             return None
         
-        # Parse the main line, filtering out move numbers (entries ending with '.')
-        main_line_parts = opening.main_line.split()
-        main_line_moves = [move for move in main_line_parts if not move.endswith('.')]
+        main_line_moves = OpeningBook.get(opening)['main_line']
         
         # Get the move number we're at 
         # This should correspond to the index in the filtered moves list
         move_count = len(board.move_stack)
-        # Fix: Use a fresh board for SAN conversion
-        san_moves = []
-        temp_board = chess.Board()  # Always start from the initial position
-        for m in board.move_stack:
-            san_moves.append(temp_board.san(m))
-            temp_board.push(m)
 
         # Check if we're still within the opening book
         if move_count < len(main_line_moves):
@@ -603,43 +1297,9 @@ class OpeningExplorer:
             # logger.info(f"Move count {len(board.move_stack)} exceeds opening phase")
             return False
         
-        # Create a new board and apply the opening moves
-        theory_board = chess.Board()
-        
-        # Filter out move numbers (entries ending with '.')
-        pgn_parts = opening.pgn_moves.split()
-        pgn_moves = [move for move in pgn_parts if not move.endswith('.')]
-        
-        # Apply moves from the opening
-        for san_move in pgn_moves:
-            try:
-                move = theory_board.parse_san(san_move)
-                theory_board.push(move)
-            except ValueError as e:
-                logger.error(f"Error parsing opening move: {e}")
-                break
-        
         # Check if our position matches one of the positions in the opening theory
-        # We need to find if our current board state is reachable in the opening
-        test_board = chess.Board()
-        for san_move in pgn_moves:
-            try:
-                move = test_board.parse_san(san_move)
-                test_board.push(move)
-                
-                # Compare positions (ignoring move counters)
-                current_fen_parts = board.fen().split(' ')
-                test_fen_parts = test_board.fen().split(' ')
-                
-                # If positions match, we're still in opening theory
-                if current_fen_parts[:4] == test_fen_parts[:4]:
-                    return True
-            except ValueError:
-                continue
-            
-        # If we get here, we didn't find a match
-        # logger.info(f"Current position {board.fen()} not found in opening theory")
-        return False
+        # (ignoring move counters)
+        return position_key(board) in OpeningBook.get(opening)['positions']
     
     def generate_explanation(self, board, move, opening):
         """Generate an explanation for why a particular move was chosen in opening theory."""
@@ -673,17 +1333,900 @@ class OpeningExplorer:
         # Generic explanation
         return f"The move {move_san} follows sound opening principles by developing pieces and controlling the center."
 
+class ProgressTracker:
+    """
+    Keeps the UserProgress and UserProfile statistics up to date.
+    Each update is a single UPDATE computed by the database from the
+    current row, so concurrent requests cannot overwrite each other.
+    """
+    # Move quality as a percentage
+    QUALITY_SCORES = {
+        'best': 100,
+        'excellent': 90,
+        'good': 75,
+        'inaccuracy': 50,
+        'mistake': 25,
+        'blunder': 0,
+        'normal': 60
+    }
+    DEFAULT_SCORE = 60
+    
+    # Weight of the latest move in the running accuracy (80% new, 20% old)
+    RECENT_WEIGHT = 0.8
+    
+    # Games needed before mastery can reach the full accuracy
+    MASTERY_GAMES = 10
+    
+    @classmethod
+    def score(cls, move_quality):
+        return cls.QUALITY_SCORES.get(move_quality, cls.DEFAULT_SCORE)
+    
+    @classmethod
+    def mastery(cls, avg_accuracy, games_played):
+        return int(avg_accuracy * min(games_played / cls.MASTERY_GAMES, 1.0))
+    
+    @classmethod
+    def record_move(cls, user, opening, move_quality):
+        """Fold the score of one user move into the progress for an opening."""
+        score = float(cls.score(move_quality))
+        avg_accuracy = Case(
+            When(avg_accuracy=0, then=Value(score)),
+            default=Value(cls.RECENT_WEIGHT * score) + Value(1 - cls.RECENT_WEIGHT) * F('avg_accuracy'),
+            output_field=FloatField()
+        )
+        games_factor = Least(
+            Cast('games_played', FloatField()) / Value(float(cls.MASTERY_GAMES)), Value(1.0)
+        )
+        updates = {
+            'avg_accuracy': avg_accuracy,
+            'best_accuracy': Greatest('best_accuracy', Value(score)),
+            'mastery_level': Cast(Floor(avg_accuracy * games_factor), IntegerField()),
+            'last_played': timezone.now(),
+        }
+        if not UserProgress.objects.filter(user=user, opening=opening).update(**updates):
+            cls._create_progress(user, opening)
+            UserProgress.objects.filter(user=user, opening=opening).update(**updates)
+        ProfileDashboard.invalidate(user.id)
+    
+    @classmethod
+    def record_game_started(cls, user, opening):
+        """Count a new game for the opening and for the user's profile."""
+        if not UserProgress.objects.filter(user=user, opening=opening).update(
+            games_played=F('games_played') + 1
+        ):
+            if not cls._create_progress(user, opening, games_played=1):
+                UserProgress.objects.filter(user=user, opening=opening).update(
+                    games_played=F('games_played') + 1
+                )
+        UserProfile.objects.filter(user=user).update(games_played=F('games_played') + 1)
+        ProfileDashboard.invalidate(user.id)
+    
+    @staticmethod
+    def _create_progress(user, opening, games_played=1):
+        """Create the progress row; returns False if another request created it first."""
+        try:
+            with transaction.atomic():
+                UserProgress.objects.create(user=user, opening=opening, games_played=games_played)
+            return True
+        except IntegrityError:
+            return False
+    
+    @classmethod
+    def recompute(cls, users=None):
+        """
+        Rebuild progress and profile statistics from the stored games and
+        moves, replaying the running accuracy in the order the moves were
+        played. Returns the number of progress rows written.
+        """
+        games = Game.objects.all()
+        moves = Move.objects.filter(player='user')
+        if users is not None:
+            games = games.filter(user__in=users)
+            moves = moves.filter(game__user__in=users)
+        
+        stats = {}
+        for row in games.values('user_id', 'opening_id').annotate(games=Count('id')):
+            stats[(row['user_id'], row['opening_id'])] = {
+                'games_played': row['games'], 'avg_accuracy': 0.0, 'best_accuracy': 0.0
+            }
+        
+        played = moves.order_by('game__created_at', 'game_id', 'move_number').values_list(
+            'game__user_id', 'game__opening_id', 'quality'
+        )
+        for user_id, opening_id, quality in played.iterator():
+            entry = stats[(user_id, opening_id)]
+            score = float(cls.score(quality))
+            if entry['avg_accuracy'] == 0:
+                entry['avg_accuracy'] = score
+            else:
+                entry['avg_accuracy'] = cls.RECENT_WEIGHT * score + (1 - cls.RECENT_WEIGHT) * entry['avg_accuracy']
+            entry['best_accuracy'] = max(entry['best_accuracy'], score)
+        
+        with transaction.atomic():
+            existing = {
+                (p.user_id, p.opening_id): p
+                for p in UserProgress.objects.filter(
+                    user_id__in={user_id for user_id, _ in stats}
+                ).select_for_update()
+            }
+            to_update, to_create = [], []
+            for (user_id, opening_id), entry in stats.items():
+                progress = existing.get((user_id, opening_id))
+                if progress is None:
+                    progress = UserProgress(user_id=user_id, opening_id=opening_id)
+                    to_create.append(progress)
+                else:
+                    to_update.append(progress)
+                progress.games_played = entry['games_played']
+                progress.avg_accuracy = entry['avg_accuracy']
+                progress.best_accuracy = entry['best_accuracy']
+                progress.mastery_level = cls.mastery(entry['avg_accuracy'], entry['games_played'])
+            UserProgress.objects.bulk_update(
+                to_update, ['games_played', 'avg_accuracy', 'best_accuracy', 'mastery_level']
+            )
+            UserProgress.objects.bulk_create(to_create)
+            
+            # Profile totals: games played and games won with the user's colour
+            profiles = games.values('user_id').annotate(
+                played=Count('id'),
+                won=Count('id', filter=(
+                    Q(user_color='white', result='1-0') | Q(user_color='black', result='0-1')
+                ))
+            )
+            for row in profiles:
+                UserProfile.objects.filter(user_id=row['user_id']).update(
+                    games_played=row['played'], games_won=row['won']
+                )
+        for user_id in {user_id for user_id, _ in stats}:
+            ProfileDashboard.invalidate(user_id)
+        return len(stats)
+
+class ProfileDashboard:
+    """
+    Data for the user profile page, loaded with a fixed number of queries
+    however long the user's history is, and cached per user. Call
+    invalidate() whenever the user's games, progress or challenges change.
+    """
+    RECENT_GAMES = 5
+    UNSOLVED_CHALLENGES = 5
+    
+    @staticmethod
+    def cache_key(user_id):
+        return f'profile_dashboard:{user_id}'
+    
+    @classmethod
+    def get(cls, user):
+        data = cache.get(cls.cache_key(user.id))
+        if data is None:
+            data = cls._load(user)
+            cache.set(cls.cache_key(user.id), data, getattr(settings, 'DASHBOARD_CACHE_TTL', 300))
+        return data
+    
+    @classmethod
+    def invalidate(cls, user_id):
+        cache.delete(cls.cache_key(user_id))
+    
+    @classmethod
+    def _load(cls, user):
+        # UserProfile holds the per-user totals kept by ProgressTracker
+        profile, _ = UserProfile.objects.get_or_create(user=user)
+        profile.user = user
+        
+        # Get user progress across all openings
+        progress_list = list(
+            UserProgress.objects.filter(user=user)
+            .select_related('opening')
+            .only(
+                'opening__id', 'opening__name', 'games_played', 'mastery_level',
+                'avg_accuracy', 'user_id'
+            )
+            .order_by('-mastery_level')
+        )
+        
+        # Get recent games, without the move list and chat summary
+        recent_games = list(
+            Game.objects.filter(user=user)
+            .select_related('opening')
+            .only('opening__id', 'opening__name', 'status', 'updated_at', 'user_id')
+            .order_by('-updated_at')[:cls.RECENT_GAMES]
+        )
+        
+        # Get unsolved challenges
+        unsolved_challenges = list(
+            UserChallenge.objects.filter(user=user, is_solved=False)
+            .select_related('challenge__opening')[:cls.UNSOLVED_CHALLENGES]
+        )
+        
+        return {
+            'profile': profile,
+            'progress_list': progress_list,
+            'openings_studied': len(progress_list),
+            'best_mastery': progress_list[0].mastery_level if progress_list else 0,
+            'recent_games': recent_games,
+            'unsolved_challenges': unsolved_challenges,
+        }
+
+class ChallengeCatalog:
+    """
+    Keyset-paginated challenge listing with the user's solved status.
+    Cache keys carry a catalog version and a per-user version, which are
+    bumped when challenges or the user's results change, so cached pages
+    are never served stale.
+    """
+    # Sort orders, each ending in the primary key so the keyset is unique
+    SORTS = {
+        'difficulty': ('difficulty', 'id'),
+        'difficulty-desc': ('-difficulty', '-id'),
+        'title': ('title', 'id'),
+    }
+    DEFAULT_SORT = 'difficulty'
+    STATUSES = ('solved', 'unsolved')
+    
+    CATALOG_VERSION_KEY = 'challenges:version'
+    
+    @staticmethod
+    def _user_version_key(user_id):
+        return f'challenges:user:{user_id}:version'
+    
+    @staticmethod
+    def _version(key):
+        version = cache.get(key)
+        if version is None:
+            # Start from the clock so a lost counter never reuses old keys
+            cache.add(key, int(time.time() * 1000), None)
+            version = cache.get(key)
+        return version
+    
+    @classmethod
+    def invalidate(cls, user_id=None):
+        """Drop cached pages for one user, or for everyone if no user is given."""
+        key = cls._user_version_key(user_id) if user_id else cls.CATALOG_VERSION_KEY
+        try:
+            cache.incr(key)
+        except ValueError:
+            cls._version(key)
+    
+    @classmethod
+    def clean_params(cls, query):
+        """Validate the listing filters from a request's GET parameters."""
+        def to_int(value):
+            try:
+                return int(value)
+            except (TypeError, ValueError):
+                return None
+        
+        sort = query.get('sort')
+        status = query.get('status')
+        return {
+            'difficulty': to_int(query.get('difficulty')),
+            'opening_id': to_int(query.get('opening')),
+            'status': status if status in cls.STATUSES else None,
+            'sort': sort if sort in cls.SORTS else cls.DEFAULT_SORT,
+            'cursor': query.get('after') or None,
+        }
+    
+    @classmethod
+    def cache_key(cls, user, params):
+        raw = json.dumps(params, sort_keys=True)
+        return (
+            f"challenges:page:{cls._version(cls.CATALOG_VERSION_KEY)}:"
+            f"{user.id}:{cls._version(cls._user_version_key(user.id))}:"
+            f"{hashlib.sha256(raw.encode()).hexdigest()}"
+        )
+    
+    @staticmethod
+    def encode_cursor(values):
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+    
+    @classmethod
+    def decode_cursor(cls, cursor, sort=DEFAULT_SORT):
+        """The [sort value, id] a page starts after, or None if the cursor is not valid for the sort."""
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            value, last_id = values
+            if cls.SORTS[sort][0].lstrip('-') == 'title':
+                if not isinstance(value, str):
+                    return None
+            else:
+                value = int(value)
+            last_id = int(last_id)
+        except (ValueError, TypeError):
+            return None
+        # Larger integers cannot be bound as query parameters
+        if any(isinstance(v, int) and not -2 ** 63 <= v < 2 ** 63 for v in (value, last_id)):
+            return None
+        return [value, last_id]
+    
+    @classmethod
+    def page(cls, user, difficulty=None, opening_id=None, status=None,
+             sort=DEFAULT_SORT, cursor=None, page_size=None):
+        """
+        Return one page of challenges, each annotated with is_solved, and
+        the cursor for the next page (None on the last page). The page
+        is read in one query that starts at the cursor on an index.
+        """
+        page_size = page_size or getattr(settings, 'CHALLENGES_PAGE_SIZE', 24)
+        ordering = cls.SORTS[sort]
+        
+        challenges = (
+            Challenge.objects.select_related('opening')
+            .only('id', 'title', 'description', 'difficulty', 'opening__id', 'opening__name')
+            .annotate(is_solved=Exists(
+                UserChallenge.objects.filter(user=user, challenge=OuterRef('pk'), is_solved=True)
+            ))
+            .order_by(*ordering)
+        )
+        if difficulty:
+            challenges = challenges.filter(difficulty=difficulty)
+        if opening_id:
+            challenges = challenges.filter(opening_id=opening_id)
+        if status:
+            challenges = challenges.filter(is_solved=(status == 'solved'))
+        
+        # An invalid cursor starts from the first page
+        after = cls.decode_cursor(cursor, sort) if cursor else None
+        if after is not None:
+            field = ordering[0].lstrip('-')
+            op = 'lt' if ordering[0].startswith('-') else 'gt'
+            value, last_id = after
+            challenges = challenges.filter(
+                Q(**{f'{field}__{op}': value}) | Q(**{field: value, f'id__{op}': last_id})
+            )
+        
+        rows = list(challenges[:page_size + 1])
+        next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            last = rows[-1]
+            next_cursor = cls.encode_cursor([getattr(last, ordering[0].lstrip('-')), last.id])
+        return {'challenges': rows, 'next_cursor': next_cursor}
+    
+    @classmethod
+    def openings(cls):
+        """Openings that have challenges, for the filter menu."""
+        key = f"challenges:openings:{cls._version(cls.CATALOG_VERSION_KEY)}"
+        openings = cache.get(key)
+        if openings is None:
+            openings = list(
+                Opening.objects.filter(challenges__isnull=False).distinct()
+                .order_by('name').values_list('id', 'name')
+            )
+            cache.set(key, openings, getattr(settings, 'CHALLENGES_CACHE_TTL', 300))
+        return openings
+
+class SpeculativeReplies:
+    """
+    AI replies searched in the background as soon as the user's move is
+    recorded, keyed by game and ply, so get_ai_move can answer at once.
+    Entries also carry the position they were searched in, so an entry
+    left over from a reset game is never played.
+    """
+    PENDING = 'pending'
+    POLL_INTERVAL = 0.05
+    # A search is never waited for longer than AI_REPLY_WAIT anyway; this
+    # only clears the mark of a worker that died mid-search
+    PENDING_TTL = 30
+
+    @staticmethod
+    def cache_key(game_id, ply):
+        return f"ai_reply:{game_id}:{ply}"
+
+    @classmethod
+    def start(cls, game_id, ply):
+        """
+        Mark the search as running, from the task itself rather than when it is
+        queued, so get_ai_move only waits for a search that is under way.
+        False if one was already started.
+        """
+        return cache.add(cls.cache_key(game_id, ply), cls.PENDING, cls.PENDING_TTL)
+
+    @classmethod
+    def store(cls, game_id, board, move, evaluation):
+        cache.set(cls.cache_key(game_id, len(board.move_stack)), {
+            'position_key': position_key(board),
+            'move': move.uci(),
+            'evaluation': evaluation,
+        }, getattr(settings, 'AI_REPLY_CACHE_TTL', 300))
+
+    @classmethod
+    def discard(cls, game_id, ply):
+        cache.delete(cls.cache_key(game_id, ply))
+
+    @classmethod
+    def take(cls, game_id, board):
+        """
+        Return (move, evaluation) searched for this position and drop the
+        entry, waiting up to AI_REPLY_WAIT seconds (1 by default) for a
+        running search.
+        None if there is no usable reply.
+        """
+        key = cls.cache_key(game_id, len(board.move_stack))
+        deadline = time.monotonic() + getattr(settings, 'AI_REPLY_WAIT', 1.0)
+        entry = cache.get(key)
+        while entry == cls.PENDING and time.monotonic() < deadline:
+            time.sleep(cls.POLL_INTERVAL)
+            entry = cache.get(key)
+        if not isinstance(entry, dict):
+            return None
+        cache.delete(key)
+        move = chess.Move.from_uci(entry['move'])
+        if entry['position_key'] != position_key(board) or move not in board.legal_moves:
+            return None
+        return move, entry['evaluation']
+
+class BlunderMiner:
+    """
+    Incremental pipeline turning users' saved mistakes into challenges.
+    Each batch takes the mistakes saved after the watermark, confirms them
+    with a deeper parallel engine search, creates one Challenge per position
+    (solved by the engine's best move) and folds the confirmed mistakes into
+    UserProgress.common_mistakes.
+    """
+    WATERMARK = 'blunder_mining'
+    COMMON_MISTAKES_KEPT = 10
+    # Moves still waiting for feedback may yet be reclassified; after this
+    # long they are assumed to have failed and no longer hold the batch back
+    PENDING_GRACE = timedelta(hours=1)
+
+    @classmethod
+    def run(cls, pool, batch_size=None, depth=None, max_batches=None):
+        """Process batches until caught up; returns (mistakes scanned, challenges created)."""
+        batch_size = batch_size or getattr(settings, 'BLUNDER_MINING_BATCH_SIZE', 200)
+        depth = depth or getattr(settings, 'BLUNDER_MINING_DEPTH', 16)
+        scanned = created = batches = 0
+        while max_batches is None or batches < max_batches:
+            count, new = cls.run_batch(pool, batch_size, depth)
+            if not count:
+                break
+            scanned += count
+            created += new
+            batches += 1
+        return scanned, created
+
+    @classmethod
+    def _next_mistakes(cls, last_id, batch_size):
+        moves = Move.objects.filter(id__gt=last_id)
+        first_pending = (
+            moves.filter(feedback_status='pending', created_at__gte=timezone.now() - cls.PENDING_GRACE)
+            .order_by('id').values_list('id', flat=True).first()
+        )
+        if first_pending is not None:
+            moves = moves.filter(id__lt=first_pending)
+        return list(
+            moves.filter(player='user', is_mistake=True, detached=False)
+            .select_related('game__opening')
+            .order_by('id')[:batch_size]
+        )
+
+    @staticmethod
+    def _boards_before(moves):
+        """The board before each move, replaying each game once."""
+        by_game = {}
+        for move in moves:
+            by_game.setdefault(move.game_id, []).append(move)
+        boards = {}
+        for game_moves in by_game.values():
+            wanted = {move.move_number - 1: move for move in game_moves}
+            last = max(wanted)
+            board = chess.Board()
+            for ply, played in enumerate(game_moves[0].game.get_moves()):
+                if ply in wanted:
+                    boards[wanted[ply].id] = board.copy(stack=False)
+                if ply >= last or not board.is_legal(played):
+                    break
+                board.push(played)
+        return boards
+
+    @staticmethod
+    def _difficulty(loss):
+        # Bigger swings are easier to spot
+        if loss >= 5:
+            return 1
+        if loss >= 3:
+            return 2
+        return 3
+
+    @classmethod
+    def run_batch(cls, pool, batch_size, depth):
+        """Mine one batch; returns (mistakes scanned, challenges created)."""
+        mark, _ = PipelineWatermark.objects.get_or_create(name=cls.WATERMARK)
+        moves = cls._next_mistakes(mark.last_id, batch_size)
+        if not moves:
+            return 0, 0
+
+        boards = cls._boards_before(moves)
+        positions = []
+        for move in moves:
+            board = boards.get(move.id)
+            try:
+                played = chess.Move.from_uci(move.move_uci)
+            except ValueError:
+                continue
+            if board is None or not board.is_legal(played):
+                continue
+            after = board.copy(stack=False)
+            after.push(played)
+            positions.append((move, board, played, after.fen()))
+
+        results = pool.analyse_many(
+            [fen for _, board, _, after_fen in positions for fen in (board.fen(), after_fen)], depth
+        )
+        min_loss = getattr(settings, 'BLUNDER_MINING_MIN_LOSS', 1.0)
+        mistakes = []
+        for move, board, played, after_fen in positions:
+            best = results[board.fen()]
+            if not best['lines'] or best['lines'][0]['move'] == played:
+                continue
+            # Scores are from white's side; loss is from the mover's
+            sign = 1 if board.turn == chess.WHITE else -1
+            loss = sign * (best['score'] - results[after_fen]['score'])
+            if loss < min_loss:
+                continue
+            mistakes.append({
+                'move': move,
+                'key': position_key(board),
+                'fen': board.fen(),
+                'best_san': best['lines'][0]['san'],
+                'loss': loss,
+            })
+
+        with transaction.atomic():
+            # Claim the batch; another miner that got here first wins
+            claimed = PipelineWatermark.objects.filter(pk=mark.pk, last_id=mark.last_id).update(
+                last_id=moves[-1].id, updated_at=timezone.now()
+            )
+            if not claimed:
+                logger.warning(f"Blunder mining batch after move {mark.last_id} was processed concurrently")
+                return 0, 0
+            challenge_ids, created = cls._create_challenges(mistakes)
+            cls._record_common_mistakes(mistakes, challenge_ids)
+
+        if created:
+            ChallengeCatalog.invalidate()
+        logger.info(
+            f"Mined {len(moves)} mistakes up to move {moves[-1].id}: "
+            f"{len(mistakes)} confirmed, {created} new challenges"
+        )
+        return len(moves), created
+
+    @classmethod
+    def _create_challenges(cls, mistakes):
+        """Create a challenge for each new position; returns ({position key: challenge id}, created)."""
+        new = {}
+        for mistake in mistakes:
+            move = mistake['move']
+            lost = 'the game' if mistake['loss'] >= 50 else f"{mistake['loss']:.1f} pawns"
+            new.setdefault(mistake['key'], Challenge(
+                title=f"{move.game.opening.name}: find the improvement",
+                description=f"{move.move_san} was played here, costing {lost}. Find the best move.",
+                fen_position=mistake['fen'],
+                solution_moves=mistake['best_san'],
+                opening_id=move.game.opening_id,
+                difficulty=cls._difficulty(mistake['loss']),
+                position_key=mistake['key'],
+            ))
+        if not new:
+            return {}, 0
+        existing = set(
+            Challenge.objects.filter(position_key__in=new).values_list('position_key', flat=True)
+        )
+        to_create = [challenge for key, challenge in new.items() if key not in existing]
+        Challenge.objects.bulk_create(to_create, ignore_conflicts=True)
+        challenge_ids = dict(
+            Challenge.objects.filter(position_key__in=new).values_list('position_key', 'id')
+        )
+        return challenge_ids, len(to_create)
+
+    @classmethod
+    def _record_common_mistakes(cls, mistakes, challenge_ids):
+        """Merge confirmed mistakes into the JSON list on each (user, opening) progress row."""
+        by_progress = {}
+        for mistake in mistakes:
+            game = mistake['move'].game
+            by_progress.setdefault((game.user_id, game.opening_id), []).append(mistake)
+
+        for (user_id, opening_id), found in by_progress.items():
+            progress = (
+                UserProgress.objects.select_for_update()
+                .filter(user_id=user_id, opening_id=opening_id)
+                .only('id', 'common_mistakes').first()
+            )
+            if progress is None:
+                continue
+            try:
+                entries = {entry['position_key']: entry for entry in json.loads(progress.common_mistakes or '[]')}
+            except (ValueError, TypeError, KeyError):
+                entries = {}
+            for mistake in found:
+                entry = entries.setdefault(mistake['key'], {
+                    'position_key': mistake['key'],
+                    'fen': mistake['fen'],
+                    'move': mistake['move'].move_san,
+                    'best_move': mistake['best_san'],
+                    'loss': 0,
+                    'count': 0,
+                })
+                entry['count'] += 1
+                entry['loss'] = round(max(entry['loss'], mistake['loss']), 2)
+                entry['challenge_id'] = challenge_ids.get(mistake['key'])
+            kept = sorted(entries.values(), key=lambda e: (-e['count'], -e['loss']))[:cls.COMMON_MISTAKES_KEPT]
+            # update() leaves last_played alone
+            UserProgress.objects.filter(pk=progress.pk).update(common_mistakes=json.dumps(kept))
+
+class GameReviewer:
+    """
+    Whole-game review computed in one vectorized pass over the evaluation
+    series saved on the moves. Missing evaluations are filled by one batched
+    engine search and saved back, so reviewing a game again only reads the
+    moves and does the arithmetic.
+    """
+    # Stockfish's evaluation of the starting position, in pawns
+    START_EVAL = 0.2
+    # Mate scores are clipped so one mate does not swamp the averages
+    MAX_CP = 1000
+    OPENING_PLIES = 20
+    ENDGAME_MATERIAL = 26  # Non-pawn material left on the board, in pawns
+    PHASES = ('opening', 'middlegame', 'endgame')
+    # Drop in the mover's win percentage for each error class
+    THRESHOLDS = (('blunder', 15), ('mistake', 10), ('inaccuracy', 5))
+
+    @classmethod
+    def get(cls, game, pool=None):
+        """Return the stored review, reviewing the game again if it has moved on."""
+        return cls.stored(game) or cls.review(game, pool)
+
+    @staticmethod
+    def stored(game):
+        """The stored review if it is up to date with the game, else None."""
+        return GameReview.objects.filter(game=game, ply_count=game.ply_count).first()
+
+    @staticmethod
+    def _material(board):
+        return (
+            9 * chess.popcount(board.queens) + 5 * chess.popcount(board.rooks)
+            + 3 * chess.popcount(board.bishops | board.knights)
+        )
+
+    @classmethod
+    def review(cls, game, pool=None):
+        """Review the game and store the result; pool is an EnginePool for missing evaluations."""
+        rows = {
+            row.move_number: row
+            for row in Move.objects.filter(game=game, detached=False).only(
+                'id', 'move_number', 'move_san', 'player', 'eval_score'
+            )
+        }
+        board = chess.Board()
+        material, sans, unknown = [], [], {}
+        for ply, move in enumerate(game.get_moves(), 1):
+            if not board.is_legal(move):
+                break
+            sans.append(board.san(move))
+            board.push(move)
+            material.append(cls._material(board))
+            if ply not in rows or rows[ply].eval_score is None:
+                unknown[ply] = board.fen()
+
+        filled = cls._analyse(unknown, pool) if unknown else {}
+        updated = []
+        for ply, score in filled.items():
+            if ply in rows:
+                rows[ply].eval_score = score
+                updated.append(rows[ply])
+        Move.objects.bulk_update(updated, ['eval_score'])
+
+        evals = [
+            rows[ply].eval_score if ply in rows and rows[ply].eval_score is not None else filled.get(ply)
+            for ply in range(1, len(material) + 1)
+        ]
+        result = cls.compute(evals, material, game.user_color == 'white')
+        result['moves'] = [dict(entry, san=san) for entry, san in zip(result['moves'], sans)]
+        review, _ = GameReview.objects.update_or_create(game=game, defaults={
+            'ply_count': game.ply_count,
+            'user_accuracy': result['user_accuracy'],
+            'opponent_accuracy': result['opponent_accuracy'],
+            'avg_centipawn_loss': result['avg_centipawn_loss'],
+            'inaccuracies': result['counts']['inaccuracy'],
+            'mistakes': result['counts']['mistake'],
+            'blunders': result['counts']['blunder'],
+            'missing_evals': len(unknown) - len(filled),
+            'report': json.dumps({'moves': result['moves'], 'phases': result['phases']}),
+        })
+        return review
+
+    @classmethod
+    def _analyse(cls, fens, pool=None):
+        """Evaluate the positions in one parallel batch; returns {ply: score} for those searched."""
+        depth = getattr(settings, 'GAME_REVIEW_DEPTH', 14)
+        if pool is None:
+            with EnginePool() as pool:
+                return cls._analyse(fens, pool)
+        if not pool.available:
+            return {}
+        results = pool.analyse_many(fens.values(), depth)
+        return {ply: results[fen]['score'] for ply, fen in fens.items()}
+
+    @classmethod
+    def compute(cls, evals, material, user_white):
+        """
+        The review numbers from white's evaluation in pawns after each ply
+        (None where unknown) and the non-pawn material after each ply.
+        """
+        import numpy as np
+
+        plies = len(evals)
+        series = np.array([cls.START_EVAL] + evals, dtype=float)
+        # Unknown evaluations repeat the previous one, so no loss is charged
+        known = np.where(np.isnan(series), 0, np.arange(plies + 1))
+        series = series[np.maximum.accumulate(known)]
+        cp = np.clip(series * 100, -cls.MAX_CP, cls.MAX_CP)
+
+        # Everything below is from the mover's side: white moves on even plies
+        sign = np.where(np.arange(plies) % 2 == 0, 1.0, -1.0)
+        before, after = cp[:-1] * sign, cp[1:] * sign
+        cp_loss = np.maximum(before - after, 0)
+        # Win percentage and move accuracy as defined by Lichess
+        win_before = 50 + 50 * (2 / (1 + np.exp(-0.00368208 * before)) - 1)
+        win_after = 50 + 50 * (2 / (1 + np.exp(-0.00368208 * after)) - 1)
+        win_delta = np.maximum(win_before - win_after, 0)
+        accuracy = np.clip(103.1668 * np.exp(-0.04354 * win_delta) - 3.1669, 0, 100)
+        labels = np.select(
+            [win_delta >= limit for _, limit in cls.THRESHOLDS],
+            [label for label, _ in cls.THRESHOLDS],
+            default=''
+        )
+
+        ply_index = np.arange(plies)
+        phase = np.where(
+            np.asarray(material) <= cls.ENDGAME_MATERIAL, 2, np.where(ply_index < cls.OPENING_PLIES, 0, 1)
+        )
+        user = (sign > 0) if user_white else (sign < 0)
+
+        def mean(values, mask):
+            return round(float(values[mask].mean()), 1) if mask.any() else 0.0
+
+        return {
+            'user_accuracy': mean(accuracy, user),
+            'opponent_accuracy': mean(accuracy, ~user),
+            'avg_centipawn_loss': mean(cp_loss, user),
+            'counts': {label: int(np.count_nonzero(user & (labels == label))) for label, _ in cls.THRESHOLDS},
+            'phases': {
+                name: {
+                    'moves': int(np.count_nonzero(user & (phase == index))),
+                    'accuracy': mean(accuracy, user & (phase == index)),
+                    'avg_centipawn_loss': mean(cp_loss, user & (phase == index)),
+                }
+                for index, name in enumerate(cls.PHASES)
+            },
+            'moves': [
+                {
+                    'ply': ply + 1,
+                    'player': 'user' if is_user else 'opponent',
+                    'eval': round(float(score) / 100, 2),
+                    'centipawn_loss': int(loss),
+                    'win_delta': round(float(delta), 1),
+                    'accuracy': round(float(acc), 1),
+                    'classification': label,
+                    'phase': cls.PHASES[index],
+                }
+                for ply, (is_user, score, loss, delta, acc, label, index) in enumerate(zip(
+                    user.tolist(), cp[1:].tolist(), cp_loss.tolist(), win_delta.tolist(),
+                    accuracy.tolist(), labels.tolist(), phase.tolist()
+                ))
+            ],
+        }
+
+    @staticmethod
+    def as_dict(review):
+        return {
+            'ply_count': review.ply_count,
+            'user_accuracy': review.user_accuracy,
+            'opponent_accuracy': review.opponent_accuracy,
+            'avg_centipawn_loss': review.avg_centipawn_loss,
+            'inaccuracies': review.inaccuracies,
+            'mistakes': review.mistakes,
+            'blunders': review.blunders,
+            'missing_evals': review.missing_evals,
+            **json.loads(review.report),
+        }
+
+class FeedbackCache:
+    """
+    Content-addressed cache for AI move feedback.
+    A small in-process LRU sits in front of the CachedFeedback table; entries
+    expire after FEEDBACK_CACHE_TTL seconds and the table is trimmed to the
+    FEEDBACK_CACHE_MAX_ENTRIES most recently used rows.
+    """
+    EVICT_EVERY = 100  # Writes between eviction passes
+    
+    def __init__(self, ttl=None, max_entries=None, memory_entries=256):
+        self.ttl = ttl if ttl is not None else getattr(settings, 'FEEDBACK_CACHE_TTL', 30 * 24 * 3600)
+        self.max_entries = max_entries if max_entries is not None else getattr(settings, 'FEEDBACK_CACHE_MAX_ENTRIES', 50000)
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()  # key -> (stored_at, feedback)
+        self._lock = threading.Lock()
+        self._writes = 0
+    
+    @staticmethod
+    def make_key(board_fen, move_uci, classification, opening=None, prompt_version=1):
+        """Hash the inputs that determine the feedback text."""
+        # Normalize the position by dropping the move counters
+        position = ' '.join(str(board_fen).split()[:4])
+        parts = [
+            position,
+            move_uci,
+            classification,
+            opening.name if opening else '',
+            str(prompt_version),
+        ]
+        return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()
+    
+    def get(self, key):
+        """Return cached feedback for key, or None."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                stored_at, feedback = entry
+                if now - stored_at <= self.ttl:
+                    self._memory.move_to_end(key)
+                    return feedback
+                del self._memory[key]
+        
+        cutoff = timezone.now() - timedelta(seconds=self.ttl)
+        row = CachedFeedback.objects.filter(key=key, created_at__gte=cutoff).first()
+        if row is None:
+            return None
+        CachedFeedback.objects.filter(id=row.id).update(
+            hits=F('hits') + 1, last_used=timezone.now()
+        )
+        self._remember(key, row.feedback, row.created_at.timestamp())
+        return row.feedback
+    
+    def set(self, key, feedback):
+        """Store feedback under key."""
+        CachedFeedback.objects.update_or_create(
+            key=key, defaults={'feedback': feedback, 'created_at': timezone.now()}
+        )
+        self._remember(key, feedback, time.time())
+        
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % self.EVICT_EVERY == 0
+        if evict:
+            self.evict()
+    
+    def evict(self):
+        """Delete expired rows and the least recently used rows over the limit."""
+        cutoff = timezone.now() - timedelta(seconds=self.ttl)
+        CachedFeedback.objects.filter(created_at__lt=cutoff).delete()
+        stale_ids = list(
+            CachedFeedback.objects.order_by('-last_used')
+            .values_list('id', flat=True)[self.max_entries:]
+        )
+        if stale_ids:
+            CachedFeedback.objects.filter(id__in=stale_ids).delete()
+    
+    def _remember(self, key, feedback, stored_at):
+        with self._lock:
+            self._memory[key] = (stored_at, feedback)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
 class FeedbackGenerator:
     """
     Service to generate chess feedback based on move quality and position context.
     """
-    def __init__(self, stockfish_engine=None):
+    # Bump whenever the AI feedback prompt changes so cached feedback is not reused
+    PROMPT_VERSION = 2
+    
+    def __init__(self, stockfish_engine=None, feedback_cache=None):
         self.engine = stockfish_engine if stockfish_engine else StockfishEngine()
         self.opening_explorer = OpeningExplorer()
-        self.client = OpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            api_key=getattr(settings, 'OPENAI_API_KEY', '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')
-        )
+        self.feedback_cache = feedback_cache if feedback_cache else FeedbackCache()
+        self.llm = get_gateway()
     
     def _generate_ai_feedback(self, board_fen, move_uci, classification, stockfish_analysis, opening=None):
         """
@@ -700,77 +2243,71 @@ class FeedbackGenerator:
             gives_check = board.gives_check(move)
             
             # Create a prompt for the AI
-            prompt = f"""
-            You are a chess coach analyzing a move. Here are the details:
-            
-            Move: {move_uci}
-            Piece moved: {piece_moved.symbol().upper() if piece_moved else 'Unknown'}
-            Move classification: {classification}
-            Is capture: {is_capture}
-            Gives check: {gives_check}
-            Opening: {opening.name if opening else 'Not in a specific opening'}
-            Board FEN: {board_fen}
-            
-            Stockfish analysis:
-            - Best move: {stockfish_analysis.get('best_move', 'Unknown')}
-            - Evaluation: {stockfish_analysis.get('evaluation', 'Unknown')}
-            - Alternative moves: {stockfish_analysis.get('alternatives', [])}
-            
-            Please provide:
-            1. A brief analysis of the move
-            2. What was good or bad about it
-            3. A suggestion for improvement if needed
-            4. A teaching point about the position
-            5. Do not mention stockfish or the engine in the feedback
-            6. Classify the move as best, good, inaccuracy, mistake, or blunder
-            7. Suggest alternatives if the move is a mistake or blunder
-            
-            Keep the feedback concise, educational, and encouraging.
-            """
+            prompt = MOVE_FEEDBACK_PROMPT.render(
+                move_uci=move_uci,
+                piece=piece_moved.symbol().upper() if piece_moved else 'Unknown',
+                classification=classification,
+                is_capture=is_capture,
+                gives_check=gives_check,
+                opening=opening.name if opening else 'Not in a specific opening',
+                board_fen=board_fen,
+                best_move=stockfish_analysis.get('best_move', 'Unknown'),
+                evaluation=stockfish_analysis.get('evaluation', 'Unknown'),
+                alternatives=stockfish_analysis.get('alternatives', [])
+            )
             # print("classification", classification)
             # print("prompt", prompt)
             
             # Get AI response
-            completion = self.client.chat.completions.create(
-                model="google/gemini-2.0-flash-001",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ]
+            return self.llm.complete(
+                prompt,
+                timeout=getattr(settings, 'LLM_FEEDBACK_TIMEOUT', 15.0),
+                call_site='move_feedback'
             )
-            # print("ai feedback", completion.choices[0].message.content.strip())
-            return completion.choices[0].message.content.strip()
             
+        except LLMUnavailable as e:
+            logger.warning(f"AI feedback unavailable, using traditional feedback: {e}")
+            return None
         except Exception as e:
             logger.error(f"Error generating AI feedback: {e}")
             return None
     
-    def generate_move_feedback(self, board_fen, move_uci, classification, opening=None):
+    def generate_move_feedback(self, board_fen, move_uci, classification, opening=None, context=None):
         """
         Generate detailed feedback for a move based on its classification and position.
         Returns a tuple: (feedback_body, ai_classification)
         """
         try:
-            # Get Stockfish analysis
             board = board_fen if isinstance(board_fen, chess.Board) else chess.Board(board_fen)
-            top_moves = self.engine.get_top_moves(board_fen, 3)
             
-            stockfish_analysis = {
-                'best_move': top_moves[0]['san'] if top_moves else 'Unknown',
-                'evaluation': top_moves[0]['score'] if top_moves else 0.0,
-                'alternatives': [move['san'] for move in top_moves[1:]] if len(top_moves) > 1 else []
-            }
-            
-            # Try to get AI feedback first
-            ai_feedback = self._generate_ai_feedback(
-                board_fen, 
-                move_uci, 
-                classification, 
-                stockfish_analysis,
-                opening
+            # The same position, move and classification always get the same
+            # feedback, so a cache hit skips both the engine and the AI call
+            cache_key = self.feedback_cache.make_key(
+                board.fen(), move_uci, classification, opening, self.PROMPT_VERSION
             )
+            ai_feedback = self.feedback_cache.get(cache_key)
+            if ai_feedback:
+                record_usage('move_feedback', cache_hits=1)
+            else:
+                # Get Stockfish analysis
+                top_moves = self.engine.get_top_moves(board_fen, 3, context=context)
+                
+                stockfish_analysis = {
+                    'best_move': top_moves[0]['san'] if top_moves else 'Unknown',
+                    'evaluation': top_moves[0]['score'] if top_moves else 0.0,
+                    'alternatives': [move['san'] for move in top_moves[1:]] if len(top_moves) > 1 else []
+                }
+                
+                # Try to get AI feedback first
+                ai_feedback = self._generate_ai_feedback(
+                    board_fen, 
+                    move_uci, 
+                    classification, 
+                    stockfish_analysis,
+                    opening
+                )
+                if ai_feedback:
+                    self.feedback_cache.set(cache_key, ai_feedback)
             
             if ai_feedback:
                 # Try to extract the AI's classification from the feedback
@@ -926,9 +2463,10 @@ class FeedbackGenerator:
             logger.error(f"Error generating traditional feedback: {e}")
             return f"Move analysis: {classification.capitalize()}. Consider analyzing the position carefully."
 
-    def suggest_improvement(self, board_fen, classification):
+    def suggest_improvement(self, board_fen, classification, context=None):
         """
         Suggest improvement based on position and move classification.
+        board_fen is the position the move was played from.
         """
         if classification in ["best", "excellent"]:
             return "Keep up the good work!"
@@ -936,7 +2474,7 @@ class FeedbackGenerator:
         board = chess.Board(board_fen)
         
         # Get Stockfish suggestions
-        top_moves = self.engine.get_top_moves(board_fen, 1)
+        top_moves = self.engine.get_top_moves(board_fen, 1, context=context)
         
         if not top_moves:
             return "Consider analyzing the position more carefully before making your move."
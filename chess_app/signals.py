@@ -0,0 +1,13 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Challenge, Opening
+from .services import ChallengeCatalog
+
+@receiver(post_save, sender=Challenge)
+@receiver(post_delete, sender=Challenge)
+@receiver(post_save, sender=Opening)
+@receiver(post_delete, sender=Opening)
+def invalidate_challenge_pages(sender, **kwargs):
+    """Cached challenge pages show challenge and opening fields."""
+    ChallengeCatalog.invalidate()
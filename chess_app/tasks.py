@@ -0,0 +1,101 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .models import Game, Move
+from .services import ChatHistory, ProgressTracker
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    """Return the shared thread pool used for background work."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'BACKGROUND_WORKERS', 4),
+                    thread_name_prefix='chess-worker'
+                )
+    return _executor
+
+def _run_task(func, args, kwargs):
+    """Run a task on a worker thread with its own database connection."""
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    except Exception as e:
+        logger.error(f"Background task {func.__name__} failed: {e}")
+    finally:
+        close_old_connections()
+
+def run_in_background(func, *args, **kwargs):
+    """
+    Schedule a task to run off the request thread once the current
+    transaction commits. With BACKGROUND_TASKS_ENABLED off the task runs
+    inline, which keeps tests and management commands deterministic.
+    """
+    if not getattr(settings, 'BACKGROUND_TASKS_ENABLED', True):
+        return func(*args, **kwargs)
+    transaction.on_commit(
+        lambda: get_executor().submit(_run_task, func, args, kwargs)
+    )
+
+def generate_move_feedback(feedback_generator, move_id, context=None):
+    """
+    Produce the coaching text for a saved user move and store it on the row.
+    The move is persisted with the engine classification first; this may
+    refine it with the classification extracted from the AI feedback.
+    context is the AnalysisContext filled while classifying the move.
+    The move reaches the user's progress either way: with the refined
+    classification, or with the engine one if the feedback fails.
+    """
+    try:
+        move = Move.objects.select_related('game__opening', 'game__user').get(id=move_id)
+    except Move.DoesNotExist:
+        logger.warning(f"Move {move_id} disappeared before feedback was generated")
+        return
+
+    try:
+        feedback_body, ai_classification = feedback_generator.generate_move_feedback(
+            board_fen=move.position_before,
+            move_uci=move.move_uci,
+            classification=move.quality,
+            opening=move.game.opening,
+            context=context
+        )
+
+        # Generate improvement suggestion if needed
+        improvement = ""
+        if ai_classification not in ["best", "excellent", "good"]:
+            improvement = feedback_generator.suggest_improvement(
+                move.position_before, ai_classification, context=context
+            )
+    except Exception as e:
+        logger.error(f"Error generating feedback for move {move_id}: {e}")
+        Move.objects.filter(id=move_id).update(feedback_status='failed')
+        ProgressTracker.record_move(move.game.user, move.game.opening, move.quality)
+        return
+
+    Move.objects.filter(id=move_id).update(
+        feedback=feedback_body,
+        improvement_suggestion=improvement,
+        quality=ai_classification,
+        is_mistake=ai_classification in ["mistake", "blunder"],
+        feedback_status='ready'
+    )
+
+    # Update user progress with the final classification
+    ProgressTracker.record_move(move.game.user, move.game.opening, ai_classification)
+
+def summarize_chat(game_id):
+    """Fold the chat messages that left a game's window into its rolling summary."""
+    game = Game.objects.filter(id=game_id).only('id', 'chat_summary').first()
+    if game is not None:
+        ChatHistory(game).summarize()
@@ -1,3 +1,1245 @@
-from django.test import TestCase
+import io
+import json
+import time
+from array import array
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import chess
+import chess.engine
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.db.migrations.executor import MigrationExecutor
+from asgiref.testing import ApplicationCommunicator
+from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.urls import reverse
+from django.utils import timezone
+
+from . import tasks
+from .consumers import websocket_application
+from .llm import CircuitBreaker, LLMGateway, LLMUnavailable
+from .models import (
+    CachedFeedback, Challenge, Game, GameReview, Move, Opening, UserChallenge, UserProfile, UserProgress, decode_move, encode_move,
+    position_key
+)
+from .views import CHAT_ERROR_REPLY, MoveRejected, generate_ai_move, record_move
+from .services import (
+    STOP_WORDS, AnalysisCache, BlunderMiner, ChallengeCatalog, ChessNLP, EngineBusy, EnginePool, FeedbackCache,
+    GameReviewer, ProgressTracker, SolutionTree, SpeculativeReplies, StockfishEngine
+)
+
+@skipUnlessDBFeature('supports_explaining_query_execution')
+class QueryPlanTests(TestCase):
+    """The hot lookups must be served by their composite indexes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('player', password='secret')
+        cls.opening = Opening.objects.create(name='Italian Game', pgn_moves='1. e4 e5', description='')
+        cls.game = Game.objects.create(user=cls.user, opening=cls.opening)
+
+    def assertUsesIndex(self, queryset, index_name):
+        # The test tables are not ANALYZEd, so the planner assumes they are
+        # large and picks the index it would use in production
+        self.assertIn(index_name, queryset.explain())
+
+    def test_ongoing_game_lookup(self):
+        self.assertUsesIndex(
+            Game.objects.filter(user=self.user, opening=self.opening, status='ONGOING'),
+            'game_user_opening_status_idx'
+        )
+
+    def test_recent_games(self):
+        self.assertUsesIndex(
+            Game.objects.filter(user=self.user).order_by('-updated_at')[:5],
+            'game_user_updated_idx'
+        )
+
+    def test_move_history(self):
+        self.assertUsesIndex(
+            Move.objects.filter(game=self.game).order_by('move_number'),
+            'move_game_number_idx'
+        )
+
+    def test_last_move_by_player(self):
+        self.assertUsesIndex(
+            Move.objects.filter(game=self.game, player='ai').order_by('-move_number')[:1],
+            'move_game_player_number_idx'
+        )
+
+    def test_progress_list(self):
+        self.assertUsesIndex(
+            UserProgress.objects.filter(user=self.user).order_by('-mastery_level'),
+            'progress_user_mastery_idx'
+        )
+
+class PackedMovesTests(TestCase):
+    """Games store their moves packed, 16 bits each."""
+
+    def test_encoding_round_trips(self):
+        for move in [chess.Move.from_uci('e2e4'), chess.Move.from_uci('h7h8n'), chess.Move.from_uci('a2a1q')]:
+            self.assertEqual(decode_move(encode_move(move)), move)
+            self.assertLess(encode_move(move), 1 << 16)
+
+    def test_game_replays_its_moves(self):
+        user = User.objects.create_user('player', password='secret')
+        game = Game.objects.create(user=user, opening=Opening.objects.create(name='Any', pgn_moves='', description=''))
+        for uci in ['e2e4', 'e7e5', 'g1f3']:
+            game.append_move(chess.Move.from_uci(uci))
+        game.save()
+        game.refresh_from_db()
+        self.assertEqual(game.ply_count, 3)
+        self.assertEqual(game.board(1).fen(), 'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1')
+        self.assertEqual([m.uci() for m in game.board().move_stack], ['e2e4', 'e7e5', 'g1f3'])
+        move = Move.objects.create(game=game, move_number=2, move_uci='e7e5', move_san='e5', player='ai')
+        self.assertEqual(move.position_before, game.board(1).fen())
+        self.assertEqual(move.position_after, chess.Board(game.board(2).fen()).fen())
+
+class CompactMovesMigrationTests(TransactionTestCase):
+    """Games with moves that cannot be replayed are cut where replay stops, keeping the rows."""
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.migrate([('chess_app', target)])
+        return executor.loader.project_state([('chess_app', target)]).apps
+
+    def test_unreplayable_moves_are_detached(self):
+        apps = self.migrate('0005_llmusage')
+        try:
+            user = apps.get_model('auth', 'User').objects.create(username='player')
+            opening = apps.get_model('chess_app', 'Opening').objects.create(name='Any', pgn_moves='', description='')
+            game = apps.get_model('chess_app', 'Game').objects.create(user=user, opening=opening)
+            board = chess.Board()
+            # The third move was recorded against the wrong position
+            for uci in ['e2e4', 'e7e5', 'e2e4', 'g8f6']:
+                before = board.fen()
+                if board.is_legal(chess.Move.from_uci(uci)):
+                    board.push_uci(uci)
+                apps.get_model('chess_app', 'Move').objects.create(
+                    game=game, move_number=board.ply(), move_uci=uci, move_san=uci, player='user',
+                    position_before=before, position_after=board.fen(), feedback=f'About {uci}'
+                )
+        finally:
+            self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes('chess_app')[0][1])
+
+        game = Game.objects.get(id=game.id)
+        self.assertEqual(game.ply_count, 2)
+        self.assertEqual(game.fen_position, game.board().fen())
+        self.assertEqual(
+            list(game.moves.values_list('move_number', 'move_uci', 'detached')),
+            [(1, 'e2e4', False), (2, 'e7e5', False), (3, 'e2e4', True), (4, 'g8f6', True)]
+        )
+        self.assertEqual(game.moves.get(move_number=4).feedback, 'About g8f6')
+
+    def test_games_packed_with_unreplayable_moves_are_cut(self):
+        apps = self.migrate('0010_gamereview')
+        try:
+            user = apps.get_model('auth', 'User').objects.create(username='player')
+            opening = apps.get_model('chess_app', 'Opening').objects.create(name='Any', pgn_moves='', description='')
+            # As packed by 0006 before it stopped at the first unreplayable move
+            moves = [chess.Move.from_uci('e2e4'), chess.Move.from_uci('e7e5'), chess.Move.null()]
+            game = apps.get_model('chess_app', 'Game').objects.create(
+                user=user, opening=opening, move_data=array('H', map(encode_move, moves)).tobytes()
+            )
+            for ply, move in enumerate(moves, 1):
+                apps.get_model('chess_app', 'Move').objects.create(
+                    game=game, move_number=ply, move_uci=move.uci(), move_san='', player='user'
+                )
+        finally:
+            self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes('chess_app')[0][1])
+
+        game = Game.objects.get(id=game.id)
+        self.assertEqual(game.ply_count, 2)
+        self.assertEqual(list(game.moves.filter(detached=True).values_list('move_number', flat=True)), [3])
+        # New moves can be recorded again, and the history shows them in place of the detached row
+        board = game.board()
+        record_move(game, board, chess.Move.from_uci('g1f3'), player='user')
+        self.assertEqual(game.board().ply(), 3)
+        self.client.force_login(User.objects.get(id=game.user_id))
+        history = self.client.get(reverse('get_move_history', args=[game.id]), {'since': 2}).json()
+        self.assertEqual(history['moves'], [{'move_number': 3, 'move_san': 'Nf3', 'player': 'user'}])
+
+class PlaceholderEvalsMigrationTests(TransactionTestCase):
+    """Only the 0.0 evaluations saved for unsearched moves are cleared."""
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.migrate([('chess_app', target)])
+        return executor.loader.project_state([('chess_app', target)]).apps
+
+    def test_placeholders_are_cleared_and_their_reviews_removed(self):
+        apps = self.migrate('0011_truncate_unreplayable_moves')
+        try:
+            user = apps.get_model('auth', 'User').objects.create(username='player')
+            opening = apps.get_model('chess_app', 'Opening').objects.create(
+                name='Italian Game', pgn_moves='1. e4 e5 2. Nf3 Nc6', main_line='1. e4 e5 2. Nf3 Nc6', description=''
+            )
+            games = []
+            for line in [
+                # (san, player, quality, eval)
+                [('e4', 'user', 'good', 0.0), ('e5', 'ai', 'best', 0.0), ('Nf3', 'user', 'good', 0.0),
+                 ('Nc6', 'ai', 'best', 0.0), ('Bc4', 'user', 'good', 0.0), ('Bc5', 'ai', 'best', 0.0),
+                 ('c3', 'user', 'normal', 0.0), ('Nf6', 'ai', 'best', 0.3)],
+                [('a3', 'user', 'good', 0.0)],
+            ]:
+                board = chess.Board()
+                moves = [board.push_san(san) for san, *_ in line]
+                game = apps.get_model('chess_app', 'Game').objects.create(
+                    user=user, opening=opening, move_data=array('H', map(encode_move, moves)).tobytes()
+                )
+                for ply, ((san, player, quality, score), move) in enumerate(zip(line, moves), 1):
+                    apps.get_model('chess_app', 'Move').objects.create(
+                        game=game, move_number=ply, move_uci=move.uci(), move_san=san, player=player,
+                        quality=quality, eval_score=score
+                    )
+                apps.get_model('chess_app', 'GameReview').objects.create(
+                    game=game, ply_count=len(moves), user_accuracy=100, opponent_accuracy=100,
+                    avg_centipawn_loss=0, report='{}'
+                )
+                games.append(game.id)
+        finally:
+            self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes('chess_app')[0][1])
+
+        self.assertEqual(
+            list(Move.objects.filter(game_id=games[0]).values_list('move_san', 'eval_score')),
+            [('e4', None), ('e5', None), ('Nf3', None), ('Nc6', None),
+             ('Bc4', 0.0), ('Bc5', 0.0), ('c3', None), ('Nf6', 0.3)]
+        )
+        self.assertEqual(Move.objects.get(game_id=games[1]).eval_score, 0.0)
+        self.assertEqual(list(GameReview.objects.values_list('game_id', flat=True)), [games[1]])
+
+class ChessNLPTests(TestCase):
+    """Chat intents are classified locally, with the LLM only for unclear messages."""
+
+    def setUp(self):
+        self.nlp = ChessNLP()
+
+    def test_keyword_scores(self):
+        self.assertEqual(self.nlp.classify_intent('Hello!'), ('greeting', 0.9))
+        self.assertEqual(self.nlp.classify_intent('Can I get a hint?')[0], 'hint')
+        self.assertEqual(self.nlp.classify_intent('Which opening are we playing?')[0], 'opening_info')
+        self.assertEqual(self.nlp.classify_intent('Was Nf3 a mistake?'), ('move_analysis', 0.9))
+        self.assertEqual(self.nlp.classify_intent('What is a pin?')[0], 'general')
+        # Nothing chess related is left to the LLM
+        self.assertEqual(self.nlp.classify_intent('I like pizza'), ('other', 0.3))
+        # A greeting inside a longer question is less certain
+        self.assertLess(self.nlp.classify_intent('hi, how do I fork a knight and a rook in this ending?')[1], 0.6)
+
+    @mock.patch.object(LLMGateway, 'complete', return_value='General')
+    def test_only_unclear_messages_reach_the_llm(self, llm):
+        self.assertEqual(self.nlp.analyze_message('Was e2e4 good?'), {'intent': 'move_analysis', 'move_uci': 'e2e4'})
+        llm.assert_not_called()
+        self.assertEqual(self.nlp.analyze_message('Tell me a joke'), {'intent': 'general'})
+        self.assertEqual(llm.call_args.kwargs['call_site'], 'intent')
+
+    @mock.patch.object(LLMGateway, 'complete', side_effect=LLMUnavailable('No network in tests'))
+    def test_unavailable_llm_keeps_the_local_intent(self, llm):
+        self.assertEqual(self.nlp.analyze_message('Tell me a joke'), {'intent': 'other'})
+        self.assertEqual(self.nlp.analyze_message('Is this good?', board_fen=chess.STARTING_FEN), {'intent': 'other'})
+
+    def test_stopwords_are_never_downloaded(self):
+        missing = SimpleNamespace(words=mock.Mock(side_effect=LookupError('Resource stopwords not found')))
+        with mock.patch('nltk.corpus.stopwords', missing):
+            with mock.patch('nltk.download') as download:
+                self.assertEqual(self.nlp.classify_intent('hey'), ('greeting', 0.9))
+        download.assert_not_called()
+        self.assertIs(self.nlp.stop_words, STOP_WORDS)
+
+    def test_benchmark_runs_without_the_spacy_model(self):
+        out, err = io.StringIO(), io.StringIO()
+        with mock.patch('chess_app.registry.get_spacy_pipeline', return_value=None):
+            call_command('benchmark_intents', spacy=True, repeat=1, stdout=out, stderr=err)
+        self.assertIn('is not available', err.getvalue())
+        self.assertIn('local: accuracy', out.getvalue())
+
+class FeedbackCacheTests(TestCase):
+    """Cached feedback expires, stays within its limits and is purged from the table."""
+
+    def setUp(self):
+        self.feedback = FeedbackCache(ttl=60, max_entries=2, memory_entries=2)
+
+    def key(self, move_uci):
+        return FeedbackCache.make_key(chess.STARTING_FEN, move_uci, 'good')
+
+    def test_key_ignores_the_move_counters(self):
+        board = chess.Board()
+        board.push_san('Nf3')
+        board.push_san('Nf6')
+        board.push_san('Ng1')
+        board.push_san('Ng8')
+        self.assertEqual(FeedbackCache.make_key(board.fen(), 'e2e4', 'good'), self.key('e2e4'))
+        self.assertNotEqual(FeedbackCache.make_key(chess.STARTING_FEN, 'e2e4', 'good', prompt_version=2), self.key('e2e4'))
+
+    def test_entries_expire_after_the_ttl(self):
+        self.feedback.set(self.key('e2e4'), 'Takes the centre.')
+        self.assertEqual(self.feedback.get(self.key('e2e4')), 'Takes the centre.')
+        CachedFeedback.objects.update(created_at=timezone.now() - timedelta(seconds=61))
+        with mock.patch('chess_app.services.time.time', return_value=time.time() + 61):
+            self.assertIsNone(self.feedback.get(self.key('e2e4')))
+        self.assertNotIn(self.key('e2e4'), self.feedback._memory)
+
+    def test_memory_keeps_the_most_recently_used(self):
+        for move in ('e2e4', 'd2d4'):
+            self.feedback.set(self.key(move), move)
+        self.feedback.get(self.key('e2e4'))
+        self.feedback.set(self.key('c2c4'), 'c2c4')
+        self.assertEqual(list(self.feedback._memory), [self.key('e2e4'), self.key('c2c4')])
+        # Evicted from memory only: read back from the table
+        with self.assertNumQueries(2):
+            self.assertEqual(self.feedback.get(self.key('d2d4')), 'd2d4')
+        self.assertEqual(CachedFeedback.objects.get(key=self.key('d2d4')).hits, 1)
+
+    def test_writes_periodically_purge_the_table(self):
+        self.feedback.EVICT_EVERY = 3
+        expired = CachedFeedback.objects.create(key=self.key('g1f3'), feedback='Develops.')
+        CachedFeedback.objects.filter(id=expired.id).update(created_at=timezone.now() - timedelta(seconds=61))
+        self.feedback.set(self.key('e2e4'), 'e2e4')
+        self.feedback.set(self.key('d2d4'), 'd2d4')
+        CachedFeedback.objects.filter(key=self.key('e2e4')).update(last_used=timezone.now() - timedelta(seconds=10))
+        self.assertEqual(CachedFeedback.objects.count(), 3)
+        # The third write runs the purge: the expired row, then the least recently used over the limit
+        self.feedback.set(self.key('c2c4'), 'c2c4')
+        self.assertEqual(
+            set(CachedFeedback.objects.values_list('key', flat=True)), {self.key('d2d4'), self.key('c2c4')}
+        )
+
+class CircuitBreakerTests(TestCase):
+    """The breaker fails fast while open and lets one trial call through per cooldown."""
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('chess_app.llm.time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker(failure_threshold=3, cooldown=30.0)
+
+    def open(self):
+        for _ in range(self.breaker.failure_threshold):
+            self.breaker.record_failure()
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        # The success reset the count
+        self.breaker.record_failure()
+        self.assertFalse(self.breaker.is_open)
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.is_open)
+        self.assertFalse(self.breaker.allow())
+
+    def test_one_trial_call_after_the_cooldown(self):
+        self.open()
+        self.now += 29
+        self.assertFalse(self.breaker.allow())
+        self.now += 1
+        self.assertTrue(self.breaker.allow())
+        # Every other caller still fails fast while the trial runs
+        self.assertFalse(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertFalse(self.breaker.is_open)
+        self.assertTrue(self.breaker.allow())
+        self.assertTrue(self.breaker.allow())
+
+    def test_failed_trial_restarts_the_cooldown(self):
+        self.open()
+        self.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.is_open)
+        self.now += 29
+        self.assertFalse(self.breaker.allow())
+        self.now += 1
+        self.assertTrue(self.breaker.allow())
+
+    @override_settings(OPENAI_API_KEY='')
+    def test_missing_api_key_refuses_calls(self):
+        gateway = LLMGateway()
+        with mock.patch('openai.OpenAI') as client:
+            with self.assertRaises(LLMUnavailable):
+                gateway.complete('Which piece first?')
+            with self.assertRaises(LLMUnavailable):
+                next(gateway.stream('Which piece first?'))
+        client.assert_not_called()
+        # Refused calls are not provider failures
+        self.assertEqual(gateway.breaker._failures, 0)
+
+    def test_open_breaker_skips_the_provider(self):
+        gateway = LLMGateway()
+        gateway._client = mock.MagicMock()
+        gateway.breaker = self.breaker
+        self.open()
+        with self.assertRaises(LLMUnavailable):
+            gateway.complete('Which piece first?')
+        gateway._client.with_options.assert_not_called()
+
+class LLMGatewayTests(TestCase):
+    """Streams stop the provider and leave the circuit breaker usable."""
+
+    def setUp(self):
+        self.gateway = LLMGateway()
+        self.response = mock.MagicMock()
+        self.response.__iter__.return_value = iter([
+            SimpleNamespace(usage=None, choices=[SimpleNamespace(delta=SimpleNamespace(content=token))])
+            for token in ['Develop ', 'your ', 'knights.']
+        ])
+        self.gateway._client = mock.MagicMock()
+        self.gateway._client.with_options.return_value.chat.completions.create.return_value = self.response
+
+    def test_disconnect_during_trial_call_releases_the_breaker(self):
+        breaker = self.gateway.breaker
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+        breaker._opened_at -= breaker.cooldown
+
+        tokens = self.gateway.stream('Which piece first?')
+        self.assertEqual(next(tokens), 'Develop ')
+        self.assertFalse(breaker.allow())  # The trial call is running
+        tokens.close()
+        self.response.close.assert_called_once()
+        # Neither a success nor a failure: the next call is the new trial
+        self.assertTrue(breaker.is_open)
+        self.assertTrue(breaker.allow())
+
+class ProfileDashboardTests(TestCase):
+    """The profile page costs the same number of queries for any history size."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('player', password='secret')
+        UserProfile.objects.create(user=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def add_history(self, count):
+        for i in range(count):
+            opening = Opening.objects.create(name=f'Opening {i}', pgn_moves='1. e4 e5', description='')
+            Game.objects.create(user=self.user, opening=opening)
+            UserProgress.objects.create(user=self.user, opening=opening, mastery_level=i)
+            challenge = Challenge.objects.create(
+                title=f'Challenge {i}', description='', fen_position=chess.STARTING_FEN,
+                solution_moves='e4', opening=opening
+            )
+            UserChallenge.objects.create(user=self.user, challenge=challenge)
+
+    def assertProfileQueries(self, num):
+        with self.assertNumQueries(num):
+            response = self.client.get(reverse('user_profile'))
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_query_count_is_constant(self):
+        # Session, user, profile, progress, recent games and challenges
+        self.add_history(1)
+        self.assertProfileQueries(6)
+        cache.clear()
+        self.add_history(10)
+        response = self.assertProfileQueries(6)
+        self.assertEqual(response.context['openings_studied'], 11)
+
+    def test_cached_until_invalidated(self):
+        self.add_history(2)
+        self.assertProfileQueries(6)
+        # Session and user only
+        self.assertProfileQueries(2)
+        ProgressTracker.record_game_started(self.user, Opening.objects.first())
+        response = self.assertProfileQueries(6)
+        self.assertEqual(response.context['profile'].games_played, 1)
+
+class ProgressTrackerTests(TestCase):
+    """The per-move UPDATEs and the recompute_progress rebuild give the same numbers."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('player', password='secret')
+        UserProfile.objects.create(user=cls.user)
+        cls.italian = Opening.objects.create(name='Italian Game', pgn_moves='1. e4 e5', description='')
+        cls.french = Opening.objects.create(name='French Defense', pgn_moves='1. e4 e6', description='')
+
+    def start(self, opening):
+        ProgressTracker.record_game_started(self.user, opening)
+        return Game.objects.create(user=self.user, opening=opening)
+
+    def play(self, game, qualities):
+        """Record the user's moves of a game as the move view does."""
+        for number, quality in enumerate(qualities):
+            Move.objects.create(
+                game=game, move_number=2 * number + 1, move_uci='e2e4', move_san='e4', player='user', quality=quality
+            )
+            ProgressTracker.record_move(self.user, game.opening, quality)
+
+    def progress(self, opening):
+        return UserProgress.objects.values(
+            'games_played', 'avg_accuracy', 'best_accuracy', 'mastery_level'
+        ).get(user=self.user, opening=opening)
+
+    def assertProgress(self, opening, **expected):
+        progress = self.progress(opening)
+        for field, value in expected.items():
+            self.assertAlmostEqual(progress[field], value, msg=field)
+
+    def test_recompute_agrees_with_incremental_updates(self):
+        games = [self.start(self.italian), self.start(self.french), self.start(self.italian)]
+        self.play(games[0], ['best', 'inaccuracy', 'blunder', 'good'])
+        self.play(games[1], ['mistake', 'excellent'])
+        self.play(games[2], ['normal', 'best', 'best'])
+        incremental = {opening: self.progress(opening) for opening in (self.italian, self.french)}
+
+        UserProgress.objects.update(games_played=0, avg_accuracy=0, best_accuracy=0, mastery_level=0)
+        UserProfile.objects.update(games_played=0)
+        call_command('recompute_progress', stdout=io.StringIO())
+        for opening, expected in incremental.items():
+            self.assertProgress(opening, **expected)
+        self.assertEqual(UserProfile.objects.get(user=self.user).games_played, 3)
+
+    def test_moves_with_failed_feedback_still_count(self):
+        class Feedback:
+            """Refines good moves to best and fails on the rest, as with the provider down."""
+            def generate_move_feedback(self, board_fen, move_uci, classification, opening=None, context=None):
+                if classification != 'good':
+                    raise LLMUnavailable('LLM circuit breaker is open')
+                return 'Develops a piece.', 'best'
+
+            def suggest_improvement(self, board_fen, classification, context=None):
+                return ''
+
+        game = self.start(self.italian)
+        for number, quality in enumerate(['good', 'mistake', 'good', 'inaccuracy']):
+            move = Move.objects.create(
+                game=game, move_number=2 * number + 1, move_uci='e2e4', move_san='e4', player='user',
+                quality=quality, feedback_status='pending'
+            )
+            tasks.generate_move_feedback(Feedback(), move.id)
+        self.assertEqual(
+            list(game.moves.values_list('quality', 'feedback_status')),
+            [('best', 'ready'), ('mistake', 'failed'), ('best', 'ready'), ('inaccuracy', 'failed')]
+        )
+        incremental = self.progress(self.italian)
+        self.assertAlmostEqual(incremental['avg_accuracy'], 0.8 * 50 + 0.2 * (0.8 * 100 + 0.2 * (0.8 * 25 + 0.2 * 100)))
+
+        UserProgress.objects.update(avg_accuracy=0, best_accuracy=0, mastery_level=0)
+        call_command('recompute_progress', stdout=io.StringIO())
+        self.assertProgress(self.italian, **incremental)
+
+    def test_first_move_sets_the_accuracy(self):
+        self.play(self.start(self.italian), ['inaccuracy'])
+        # Not averaged against the empty starting value
+        self.assertProgress(self.italian, avg_accuracy=50, best_accuracy=50, mastery_level=5)
+
+    def test_latest_moves_outweigh_a_run_of_earlier_ones(self):
+        self.play(self.start(self.italian), ['best', 'best', 'best', 'mistake'])
+        self.assertProgress(self.italian, avg_accuracy=0.8 * 25 + 0.2 * 100, best_accuracy=100)
+        self.play(self.start(self.italian), ['best'])
+        self.assertProgress(self.italian, avg_accuracy=0.8 * 100 + 0.2 * 40, games_played=2, mastery_level=17)
+
+    def test_zero_accuracy_restarts_the_average(self):
+        # A blunder scores 0, the same as no moves yet
+        self.play(self.start(self.italian), ['blunder'])
+        self.assertProgress(self.italian, avg_accuracy=0, best_accuracy=0, mastery_level=0)
+        self.play(self.start(self.italian), ['good'])
+        self.assertProgress(self.italian, avg_accuracy=75, best_accuracy=75)
+
+    def test_unknown_quality_scores_the_default(self):
+        self.play(self.start(self.italian), ['brilliant'])
+        self.assertProgress(self.italian, avg_accuracy=ProgressTracker.DEFAULT_SCORE)
+
+    def test_mastery_is_capped_by_games_played(self):
+        for _ in range(ProgressTracker.MASTERY_GAMES + 2):
+            game = self.start(self.italian)
+        self.play(game, ['excellent'])
+        # Floor of the accuracy once enough games are played, never above it
+        self.assertProgress(self.italian, games_played=12, avg_accuracy=90, mastery_level=90)
+        call_command('recompute_progress', stdout=io.StringIO())
+        self.assertProgress(self.italian, games_played=12, avg_accuracy=90, mastery_level=90)
+
+@override_settings(CHALLENGES_PAGE_SIZE=2)
+class ChallengeListTests(TestCase):
+    """The challenges page is keyset-paginated and cached per user."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('player', password='secret')
+        cls.italian = Opening.objects.create(name='Italian Game', pgn_moves='1. e4 e5', description='')
+        cls.sicilian = Opening.objects.create(name='Sicilian Defense', pgn_moves='1. e4 c5', description='')
+        cls.challenges = [
+            Challenge.objects.create(
+                title=f'Challenge {i}', description='', fen_position=chess.STARTING_FEN,
+                solution_moves='e4', opening=cls.italian if i % 2 else cls.sicilian, difficulty=i % 3 + 1
+            )
+            for i in range(5)
+        ]
+        UserChallenge.objects.create(user=cls.user, challenge=cls.challenges[0], is_solved=True)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def walk(self, **params):
+        """Follow the next-page cursors and return the challenges in order."""
+        seen = []
+        while True:
+            response = self.client.get(reverse('challenges'), params)
+            self.assertEqual(response.status_code, 200)
+            page = ChallengeCatalog.page(self.user, **ChallengeCatalog.clean_params(params))
+            self.assertLessEqual(len(page['challenges']), 2)
+            seen.extend(page['challenges'])
+            if not response.context['next_cursor']:
+                return seen
+            params['after'] = response.context['next_cursor']
+
+    def test_pages_cover_every_challenge_once(self):
+        for sort in ChallengeCatalog.SORTS:
+            seen = self.walk(sort=sort)
+            self.assertEqual(sorted(c.id for c in seen), sorted(c.id for c in self.challenges))
+        titles = [c.title for c in self.walk(sort='title')]
+        self.assertEqual(titles, sorted(titles))
+
+    def test_filters_and_solved_status(self):
+        seen = self.walk(opening=self.italian.id, difficulty=2)
+        self.assertTrue(seen)
+        self.assertTrue(all(c.opening_id == self.italian.id and c.difficulty == 2 for c in seen))
+        solved = self.walk(status='solved')
+        self.assertEqual([c.id for c in solved], [self.challenges[0].id])
+        self.assertTrue(solved[0].is_solved)
+
+    def test_invalid_cursors_start_from_the_first_page(self):
+        first = ChallengeCatalog.page(self.user)['challenges']
+        for values in [['abc', 'x'], [1], {'a': 1}, [None, 2], [[1], 2], [1, 10 ** 30]]:
+            cursor = ChallengeCatalog.encode_cursor(values)
+            response = self.client.get(reverse('challenges'), {'after': cursor})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(ChallengeCatalog.page(self.user, cursor=cursor)['challenges'], first)
+        self.assertIsNone(ChallengeCatalog.decode_cursor(ChallengeCatalog.encode_cursor([2, 5]), 'title'))
+        self.assertEqual(ChallengeCatalog.decode_cursor('not base64!'), None)
+
+    def test_cached_page_skips_the_listing_query(self):
+        url = reverse('challenges')
+        self.client.get(url)
+        # Session and user only
+        with self.assertNumQueries(2):
+            self.client.get(url)
+        Challenge.objects.create(
+            title='New', description='', fen_position=chess.STARTING_FEN,
+            solution_moves='e4', opening=self.italian
+        )
+        with self.assertNumQueries(4):
+            self.client.get(url)
+
+class SolutionTreeTests(TestCase):
+    """Challenge moves are checked against the compiled solution tree."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('player', password='secret')
+        opening = Opening.objects.create(name='Italian Game', pgn_moves='1. e4 e5', description='')
+        cls.challenge = Challenge.objects.create(
+            title='Develop', description='', fen_position=chess.STARTING_FEN,
+            solution_moves='1. e4 e5 2. Nf3 (2. Bc4 Nc6 3. Nf3) Nc6 3. Bc4', opening=opening
+        )
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.board = chess.Board()
+
+    def post(self, san, position_before=None):
+        board = chess.Board(position_before) if position_before else self.board
+        return self.client.post(reverse('check_challenge_move', args=[self.challenge.id]), {
+            'position_before': board.fen(), 'move_uci': board.parse_san(san).uci()
+        })
+
+    def play(self, san):
+        """Play the solver's move on the client board, then the reply the server returns."""
+        response = self.post(san)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        if data['is_correct']:
+            self.board.push_san(san)
+            if data['opponent_move']:
+                self.board.push_san(data['opponent_move'])
+        else:
+            self.board.reset()
+        return data
+
+    def user_challenge(self):
+        return UserChallenge.objects.get(user=self.user, challenge=self.challenge)
+
+    def test_moves_return_the_forced_reply(self):
+        data = self.play('e4')
+        self.assertTrue(data['is_correct'])
+        self.assertEqual(data['opponent_move'], 'e5')
+        self.assertFalse(data['challenge_completed'])
+        # The variation transposes into the main line's final position
+        self.assertEqual(self.play('Bc4')['opponent_move'], 'Nc6')
+        data = self.play('Nf3')
+        self.assertTrue(data['challenge_completed'])
+        user_challenge = self.user_challenge()
+        self.assertTrue(user_challenge.is_solved)
+        self.assertEqual(user_challenge.attempts, 1)
+        self.assertEqual(user_challenge.progress_fen, '')
+
+    def test_wrong_move_ends_the_attempt(self):
+        self.play('e4')
+        data = self.play('d4')
+        self.assertFalse(data['is_correct'])
+        self.assertTrue(data['reset_position'])
+        self.assertEqual((self.user_challenge().attempts, self.user_challenge().progress_fen), (1, ''))
+        # Each wrong move is one failed attempt, and the next starts over
+        self.assertFalse(self.play('Nf3')['is_correct'])
+        self.assertEqual(self.user_challenge().attempts, 2)
+        self.assertEqual(self.play('e4')['opponent_move'], 'e5')
+
+    def test_moves_must_follow_the_attempt(self):
+        # The final move alone, from the position before it
+        final = chess.Board()
+        for move in ['e4', 'e5', 'Nf3', 'Nc6']:
+            final.push_san(move)
+        response = self.post('Bc4', position_before=final.fen())
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['fen'], chess.STARTING_FEN)
+        user_challenge = self.user_challenge()
+        self.assertFalse(user_challenge.is_solved)
+        self.assertEqual(user_challenge.attempts, 0)
+
+        # Reopening the challenge starts a new attempt
+        self.play('e4')
+        self.client.get(reverse('challenge_detail', args=[self.challenge.id]))
+        self.assertEqual(self.user_challenge().progress_fen, '')
+        self.assertEqual(self.post('Nf3').status_code, 409)
+
+    def test_full_line_accepts_any_notation(self):
+        self.assertTrue(SolutionTree.verify_line(self.challenge, ['e2e4', 'e5', 'f1c4', 'Nc6', 'Nf3']))
+        self.assertFalse(SolutionTree.verify_line(self.challenge, ['e4', 'e5', 'Nf3']))
+        self.assertFalse(SolutionTree.verify_line(self.challenge, ['e4', 'd5']))
+        response = self.client.post(
+            reverse('verify_challenge_solution', args=[self.challenge.id]), {'moves': ['1. e4 e5 2. Nf3 Nc6 3. Bc4']}
+        )
+        self.assertTrue(response.json()['is_correct'])
+
+class FixedEvaluations:
+    """Engine pool stand-in returning preset scores and best moves."""
+
+    available = True
+
+    def __init__(self, scores, best_moves):
+        self.scores = scores
+        self.best_moves = best_moves
+        self.searched = []
+
+    def analyse_many(self, fens, depth=15, num_moves=1):
+        self.searched.extend(fens)
+        results = {}
+        for fen in fens:
+            board = chess.Board(fen)
+            move = board.parse_san(self.best_moves[fen]) if fen in self.best_moves else next(iter(board.legal_moves))
+            score = self.scores.get(fen, 0.0)
+            results[fen] = {'score': score, 'lines': [{'move': move, 'san': board.san(move), 'score': score}]}
+        return results
+
+class BlunderMinerTests(TestCase):
+    """Mistakes become one challenge per position and feed common_mistakes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('player', password='secret')
+        cls.opening = Opening.objects.create(name="Bird's Opening", pgn_moves='1. f4', description='')
+        cls.progress = UserProgress.objects.create(user=cls.user, opening=cls.opening)
+        cls.before = chess.Board()
+        for san in ['f3', 'e5']:
+            cls.before.push_san(san)
+        after = cls.before.copy()
+        after.push_san('g4')
+        cls.pool = FixedEvaluations({after.fen(): -100.0}, {cls.before.fen(): 'Nc3'})
+
+    def play_game(self):
+        """Play 1. f3 e5 2. g4?? with the last move flagged as a blunder."""
+        game = Game.objects.create(user=self.user, opening=self.opening)
+        board = chess.Board()
+        for ply, san in enumerate(['f3', 'e5', 'g4']):
+            move = board.parse_san(san)
+            Move.objects.create(
+                game=game, move_number=ply + 1, move_uci=move.uci(), move_san=san,
+                player='ai' if ply % 2 else 'user', is_mistake=san == 'g4',
+                quality='blunder' if san == 'g4' else 'normal'
+            )
+            board.push(move)
+            game.append_move(move)
+        game.save()
+
+    def test_mistakes_are_mined_once(self):
+        self.play_game()
+        self.play_game()
+        self.assertEqual(BlunderMiner.run(self.pool), (2, 1))
+        challenge = Challenge.objects.get(position_key=position_key(self.before))
+        self.assertEqual(challenge.fen_position, self.before.fen())
+        self.assertEqual(challenge.solution_moves, 'Nc3')
+        self.progress.refresh_from_db()
+        [entry] = json.loads(self.progress.common_mistakes)
+        self.assertEqual((entry['move'], entry['count'], entry['challenge_id']), ('g4', 2, challenge.id))
+
+        # The watermark skips what was already mined
+        self.assertEqual(BlunderMiner.run(self.pool), (0, 0))
+        self.play_game()
+        self.assertEqual(BlunderMiner.run(self.pool), (1, 0))
+        self.assertEqual(Challenge.objects.count(), 1)
+        self.progress.refresh_from_db()
+        self.assertEqual(json.loads(self.progress.common_mistakes)[0]['count'], 3)
+
+    def test_pending_feedback_holds_the_batch(self):
+        self.play_game()
+        Move.objects.filter(move_san='f3').update(feedback_status='pending')
+        self.assertEqual(BlunderMiner.run(self.pool), (0, 0))
+        Move.objects.update(feedback_status='ready')
+        self.assertEqual(BlunderMiner.run(self.pool), (1, 1))
+
+class GameReviewTests(TestCase):
+    """Reviews are computed from the saved evaluations and stored."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('player', password='secret')
+        opening = Opening.objects.create(name='Italian Game', pgn_moves='1. e4 e5', description='')
+        cls.game = Game.objects.create(user=cls.user, opening=opening)
+        board = chess.Board()
+        # The user's third move hangs the queen; one evaluation was never saved
+        evals = [0.3, 0.3, 0.4, 0.3, None, -8.5]
+        for ply, (san, score) in enumerate(zip(['e4', 'e5', 'Qh5', 'Nc6', 'Qxe5+', 'Nxe5'], evals)):
+            move = board.parse_san(san)
+            Move.objects.create(
+                game=cls.game, move_number=ply + 1, move_uci=move.uci(), move_san=san,
+                player='ai' if ply % 2 else 'user', eval_score=score
+            )
+            board.push(move)
+            cls.game.append_move(move)
+            if score is None:
+                cls.missing_fen = board.fen()
+        cls.game.save()
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_review_fills_missing_evaluations(self):
+        pool = FixedEvaluations({self.missing_fen: -8.0}, {})
+        review = GameReviewer.get(self.game, pool)
+        self.assertEqual(pool.searched, [self.missing_fen])
+        self.assertEqual(Move.objects.get(game=self.game, move_number=5).eval_score, -8.0)
+        self.assertEqual((review.blunders, review.mistakes, review.missing_evals), (1, 0, 0))
+        self.assertLess(review.user_accuracy, review.opponent_accuracy)
+        report = GameReviewer.as_dict(review)
+        self.assertEqual(report['moves'][4]['classification'], 'blunder')
+        self.assertEqual(report['phases']['opening']['moves'], 3)
+
+        # Stored reviews are served without searching again
+        response = self.client.get(reverse('game_review', args=[self.game.id]))
+        self.assertEqual(response.json()['review']['blunders'], 1)
+        self.assertEqual(pool.searched, [self.missing_fen])
+
+    def test_unsearched_moves_are_missing_not_equal(self):
+        # Without an engine nothing is searched, and the view uses the worker's pool
+        Move.objects.filter(game=self.game, move_number__gt=2).update(eval_score=None)
+        with mock.patch('chess_app.registry.get_engine_pool', return_value=SimpleNamespace(available=False)):
+            review = self.client.get(reverse('game_review', args=[self.game.id])).json()['review']
+        self.assertEqual(review['missing_evals'], 4)
+        self.assertEqual(review['blunders'], 0)
+
+    def test_ai_moves_save_the_evaluation_after_the_move(self):
+        board = chess.Board()
+        board.push_san('e4')
+        with mock.patch.object(StockfishEngine(), '_engine', ShallowEngine()):
+            move, _, evaluation = generate_ai_move(board, None, depth=3)
+        # Black's -0.2 for its own move is +0.2 for white
+        self.assertEqual((move, evaluation), (chess.Move.from_uci('a7a6'), 0.2))
+        # Book moves are not searched, so no score is saved for them
+        opening = Opening.objects.create(name='Open', pgn_moves='1. e4 e5', main_line='1. e4 e5', description='')
+        self.assertIsNone(generate_ai_move(board, opening)[2])
+
+class ShallowEngine:
+    """Stockfish stand-in whose search always prefers the a-pawn."""
+
+    def __init__(self):
+        self.depths = []
+
+    def analyse(self, board, limit, multipv=None):
+        self.depths.append(limit.depth)
+        move = next(move for move in board.legal_moves if chess.square_file(move.from_square) == 0)
+        info = {'pv': [move], 'score': chess.engine.PovScore(chess.engine.Cp(-20), board.turn), 'depth': limit.depth}
+        return [info] if multipv else info
+
+class BatchAnalysisTests(TestCase):
+    """Cached positions are answered without touching the engine."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('player', password='secret')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def post(self, payload):
+        return self.client.post(reverse('analyze_batch'), json.dumps(payload), content_type='application/json')
+
+    def test_cached_and_invalid_positions(self):
+        board = chess.Board()
+        e4 = chess.Move.from_uci('e2e4')
+        AnalysisCache.store(board.fen(), {
+            'score': 0.3, 'depth': 18, 'multipv': 2,
+            'lines': [{'move': e4, 'san': 'e4', 'score': 0.3}, {'move': chess.Move.from_uci('d2d4'), 'san': 'd4', 'score': 0.3}],
+        })
+        # A shallower search is never written over a deeper one
+        AnalysisCache.store(board.fen(), {'score': 0.1, 'depth': 8, 'multipv': 1, 'lines': []})
+
+        response = self.post({'positions': [chess.STARTING_FEN, 'not a fen'], 'depth': 16})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(lines[0]['index'], 0)
+        self.assertTrue(lines[0]['cached'])
+        self.assertEqual(lines[0]['lines'], [{'move': 'e2e4', 'san': 'e4', 'score': 0.3}])
+        self.assertEqual(lines[1], {'index': 1, 'fen': 'not a fen', 'error': 'Invalid FEN'})
+        self.assertEqual(lines[-1], {'done': True, 'cached': 1, 'analysed': 0})
+
+    def test_engine_searches_read_the_shared_cache(self):
+        board = chess.Board()
+        board.push_san('e4')
+        board.push_san('e5')
+        # A pondered search: three lines, more than this position needs
+        AnalysisCache.store(board.fen(), {
+            'score': 0.4, 'depth': 15, 'multipv': 3,
+            'lines': [{'move': chess.Move.from_uci('g1f3'), 'san': 'Nf3', 'score': 0.4}],
+        })
+        # The engine process is never started, so only the cache can answer
+        result = StockfishEngine()._search(board.fen(), 1, 15)
+        self.assertEqual(result['lines'][0]['move'], chess.Move.from_uci('g1f3'))
+        self.assertIsNone(AnalysisCache.search_result(board.fen(), 16))
+        self.assertIsNotNone(AnalysisCache.search_result(board.fen(), 15, 5))
+
+    def test_ai_strength_is_not_raised_by_deeper_cached_searches(self):
+        board = chess.Board()
+        board.push_san('e4')
+        # Found by a deep analysis of the user's move
+        AnalysisCache.store(board.fen(), {
+            'score': 0.3, 'depth': 20, 'multipv': 3,
+            'lines': [{'move': chess.Move.from_uci('c7c5'), 'san': 'c5', 'score': 0.3}],
+        })
+        engine = StockfishEngine()
+        fake = ShallowEngine()
+        with mock.patch.object(engine, '_engine', fake):
+            move, san, _ = generate_ai_move(board, None, depth=3)
+        self.assertEqual(san, 'a6')
+        self.assertIn(3, fake.depths)
+        # The shallow search does not replace the deeper one
+        self.assertEqual(AnalysisCache.get(board.fen(), 0)['depth'], 20)
+
+    def test_rejects_malformed_requests(self):
+        self.assertEqual(self.post({'fens': []}).status_code, 400)
+        self.assertEqual(self.post({'positions': [chess.STARTING_FEN] * 101}).status_code, 400)
+
+class DeepeningSearch:
+    """Engine pool stand-in whose search reports depths 1 to 5."""
+
+    available = True
+
+    def __init__(self):
+        self.stopped = False
+
+    def analysis_depths(self, fen, depth=15, num_moves=1, time=None):
+        e4 = chess.Move.from_uci('e2e4')
+        try:
+            for reached in range(1, min(depth, 5) + 1):
+                yield {
+                    'score': reached / 10, 'depth': reached, 'multipv': num_moves,
+                    'lines': [{'move': e4, 'san': 'e4', 'score': reached / 10, 'pv': '1. e4 e5'}],
+                }
+        finally:
+            self.stopped = True
+
+class LiveAnalysisTests(TestCase):
+    """The live evaluation streams each new depth and stops with the client."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('player', password='secret')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+        self.pool = DeepeningSearch()
+        patcher = mock.patch('chess_app.registry.get_engine_pool', return_value=self.pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def stream(self, **params):
+        return self.client.get(reverse('analyze_stream'), {'fen': chess.STARTING_FEN, **params})
+
+    def test_cached_depth_first_then_deeper_ones(self):
+        AnalysisCache.store(chess.STARTING_FEN, {
+            'score': 0.2, 'depth': 2, 'multipv': 1,
+            'lines': [{'move': chess.Move.from_uci('d2d4'), 'san': 'd4', 'score': 0.2}],
+        })
+        response = self.stream(depth=4)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = b''.join(response.streaming_content).decode().strip().split('\n\n')
+        updates = [json.loads(event[len('data: '):]) for event in events[:-1]]
+        self.assertEqual([(u['depth'], u['cached']) for u in updates], [(2, True), (3, False), (4, False)])
+        self.assertEqual(updates[-1]['lines'][0], {'move': 'e2e4', 'san': 'e4', 'score': 0.4, 'pv': '1. e4 e5'})
+        self.assertEqual(events[-1], 'event: done\ndata: {"depth": 4}')
+        self.assertEqual(AnalysisCache.get(chess.STARTING_FEN, 0)['depth'], 4)
+
+    def test_disconnect_stops_the_search(self):
+        response = self.stream(depth=20)
+        next(response.streaming_content)
+        response.close()
+        self.assertTrue(self.pool.stopped)
+        self.assertEqual(AnalysisCache.get(chess.STARTING_FEN, 0)['depth'], 1)
+
+    def test_rejects_invalid_positions(self):
+        self.assertEqual(self.client.get(reverse('analyze_stream'), {'fen': 'not a fen'}).status_code, 400)
+
+    def test_busy_pool_answers_instead_of_waiting(self):
+        # Its only engine is checked out by another stream
+        pool = EnginePool(1, checkout_timeout=0.01)
+        pool._started = [mock.Mock()]
+        with self.assertRaises(EngineBusy):
+            pool.analyse(chess.STARTING_FEN)
+        with mock.patch('chess_app.registry.get_engine_pool', return_value=pool):
+            events = b''.join(self.stream(depth=4).streaming_content).decode().strip().split('\n\n')
+        self.assertEqual(events, ['event: error\ndata: {"message": "Engine busy"}', 'event: done\ndata: {"depth": 0}'])
+
+@override_settings(CHAT_WINDOW_MESSAGES=4, CHAT_SUMMARY_BATCH=2)
+class ChatHistoryTests(TestCase):
+    """Older messages are summarized in the background, not on the request thread."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('player', password='secret')
+        opening = Opening.objects.create(name='Italian Game', pgn_moves='1. e4 e5', main_line='1. e4 e5', description='')
+        cls.game = Game.objects.create(user=cls.user, opening=opening)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+        self.url = reverse('chat', args=[self.game.id])
+
+    def ask(self, message):
+        return self.client.post(self.url, {'message': message}).json()['response']
+
+    @mock.patch.object(LLMGateway, 'complete', return_value='Castle early.')
+    def test_summary_runs_as_a_background_task(self, llm):
+        with mock.patch('chess_app.tasks.run_in_background') as schedule:
+            for turn in range(4):
+                self.ask(f'Question {turn}')
+        # Only the answers were requested: nothing was folded inline
+        self.assertEqual([c.kwargs['call_site'] for c in llm.call_args_list], ['chat'] * 4)
+        task, game_id = schedule.call_args.args
+        task(game_id)
+        self.assertEqual(llm.call_args.kwargs['call_site'], 'chat_summary')
+        self.game.refresh_from_db()
+        self.assertEqual(self.game.chat_summary, 'Castle early.')
+        self.assertEqual(
+            list(self.game.chat_messages.filter(in_summary=False).values_list('content', flat=True)),
+            ['Question 2', 'Castle early.', 'Question 3', 'Castle early.']
+        )
+
+    @mock.patch.object(LLMGateway, 'complete', side_effect=LLMUnavailable('No network in tests'))
+    def test_error_replies_are_not_saved(self, llm):
+        self.assertEqual(self.ask('Any plan?'), CHAT_ERROR_REPLY)
+        self.assertFalse(self.game.chat_messages.exists())
+
+@override_settings(BACKGROUND_TASKS_ENABLED=False)
+class PlayTests(TestCase):
+    """One request records the user's move and the AI's reply."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('player', password='secret')
+        UserProfile.objects.create(user=cls.user)
+        opening = Opening.objects.create(
+            name='Italian Game', pgn_moves='1. e4 e5 2. Nf3 Nc6 3. Bc4', main_line='1. e4 e5 2. Nf3 Nc6 3. Bc4', description=''
+        )
+        cls.game = Game.objects.create(user=cls.user, opening=opening)
+        UserProgress.objects.create(user=cls.user, opening=opening)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+        # The feedback runs inline; answer it as if the provider were down
+        patcher = mock.patch.object(LLMGateway, 'complete', side_effect=LLMUnavailable('No network in tests'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_move_and_reply_in_one_round_trip(self):
+        url = reverse('play', args=[self.game.id])
+        response = self.client.post(url, {'move_uci': 'e2e4', 'position_before': chess.STARTING_FEN})
+        data = response.json()
+        self.assertEqual(data['status'], 'success')
+        # The book reply
+        self.assertEqual(data['ai_move']['move'], 'e5')
+        self.assertEqual(
+            [(m['move_number'], m['move_san'], m['player']) for m in data['history']],
+            [(1, 'e4', 'user'), (2, 'e5', 'ai')]
+        )
+        self.game.refresh_from_db()
+        self.assertEqual(self.game.board().fen(), data['fen'])
+
+        # A stale client board is refused without recording anything
+        response = self.client.post(url, {'move_uci': 'd2d4', 'position_before': chess.STARTING_FEN})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Move.objects.filter(game=self.game).count(), 2)
+
+    def test_move_stands_when_the_reply_is_not_recorded(self):
+        url = reverse('play', args=[self.game.id])
+        with mock.patch('chess_app.views.play_ai_move', side_effect=MoveRejected('Board is out of sync with the game', 409)):
+            data = self.client.post(url, {'move_uci': 'e2e4', 'position_before': chess.STARTING_FEN}).json()
+        self.assertEqual(data['status'], 'success')
+        self.assertEqual(data['move'], 'e2e4')
+        self.assertIsNone(data['ai_move'])
+        self.assertTrue(data['resync'])
+        self.assertEqual(Move.objects.get(game=self.game).move_uci, 'e2e4')
+
+    def test_reply_is_searched_after_make_move(self):
+        self.client.post(reverse('make_move', args=[self.game.id]), {'move_uci': 'e2e4'})
+        self.assertEqual(cache.get(SpeculativeReplies.cache_key(self.game.id, 1))['move'], 'e7e5')
+        response = self.client.get(reverse('get_ai_move', args=[self.game.id]))
+        self.assertEqual(response.json()['move'], 'e5')
+        self.assertIsNone(cache.get(SpeculativeReplies.cache_key(self.game.id, 1)))
+
+    def test_queued_or_failed_searches_are_not_waited_for(self):
+        # Still queued behind other background work: nothing is marked yet
+        with mock.patch('chess_app.tasks.run_in_background') as schedule:
+            self.client.post(reverse('make_move', args=[self.game.id]), {'move_uci': 'e2e4'})
+        self.assertIsNone(cache.get(SpeculativeReplies.cache_key(self.game.id, 1)))
+        # The search itself fails
+        task, game_id, ply = schedule.call_args_list[-1].args
+        with mock.patch('chess_app.views.generate_ai_move', side_effect=RuntimeError('engine crashed')):
+            with self.assertRaises(RuntimeError):
+                task(game_id, ply)
+        self.assertIsNone(cache.get(SpeculativeReplies.cache_key(self.game.id, 1)))
+        with self.settings(AI_REPLY_WAIT=30):
+            self.assertIsNone(SpeculativeReplies.take(self.game.id, self.game.board()))
+
+    def test_reply_for_another_position_is_ignored(self):
+        board = chess.Board()
+        board.push_san('d4')
+        SpeculativeReplies.store(self.game.id, board, chess.Move.from_uci('d7d5'), 0.0)
+        board = chess.Board()
+        board.push_san('e4')
+        self.assertIsNone(SpeculativeReplies.take(self.game.id, board))
+
+class MoveHistoryTests(TestCase):
+    """Move history supports deltas and conditional requests."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('player', password='secret')
+        opening = Opening.objects.create(name='Italian Game', pgn_moves='1. e4 e5', description='')
+        cls.game = Game.objects.create(user=cls.user, opening=opening)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.url = reverse('get_move_history', args=[self.game.id])
+
+    def add_move(self, san):
+        board = self.game.board()
+        move = board.parse_san(san)
+        Move.objects.create(
+            game=self.game, move_number=self.game.ply_count + 1, move_uci=move.uci(), move_san=san,
+            player='user' if self.game.ply_count % 2 == 0 else 'ai'
+        )
+        self.game.append_move(move)
+        self.game.save()
+
+    def test_since_and_etag(self):
+        for san in ['e4', 'e5', 'Nf3']:
+            self.add_move(san)
+        response = self.client.get(self.url, {'since': 1})
+        self.assertEqual([m['move_san'] for m in response.json()['moves']], ['e5', 'Nf3'])
+        self.assertEqual(response.json()['ply'], 3)
+
+        # Session, user and the game's ply count only
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url, {'since': 1}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        etag = self.client.get(self.url)['ETag']
+        self.add_move('Nc6')
+        response = self.client.get(self.url, {'since': 3}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([m['move_san'] for m in response.json()['moves']], ['Nc6'])
+
+@mock.patch.object(LLMGateway, 'complete', return_value='Classification: good. A classical central move.')
+class GameChannelTests(TransactionTestCase):
+    """The WebSocket game channel plays moves against the server-held board."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('player', password='secret')
+        UserProfile.objects.create(user=self.user)
+        opening = Opening.objects.create(
+            name='Italian Game', pgn_moves='1. e4 e5 2. Nf3 Nc6 3. Bc4', main_line='1. e4 e5 2. Nf3 Nc6 3. Bc4', description=''
+        )
+        UserProgress.objects.create(user=self.user, opening=opening)
+        self.game = Game.objects.create(user=self.user, opening=opening)
+        self.client.force_login(self.user)
+        self.cookie = f"sessionid={self.client.cookies['sessionid'].value}"
+
+    def connect(self, cookie, origin='http://localhost:8000'):
+        return ApplicationCommunicator(websocket_application, {
+            'type': 'websocket',
+            'path': f'/ws/game/{self.game.id}/',
+            'headers': [(b'cookie', cookie.encode()), (b'origin', origin.encode())],
+        })
+
+    async def receive(self, communicator):
+        message = await communicator.receive_output(timeout=20)
+        return json.loads(message['text'])
+
+    async def play_e4(self):
+        channel = self.connect(self.cookie)
+        await channel.send_input({'type': 'websocket.connect'})
+        self.assertEqual((await channel.receive_output(timeout=5))['type'], 'websocket.accept')
+        self.assertEqual((await self.receive(channel))['fen'], chess.STARTING_FEN)
+        await channel.send_input({'type': 'websocket.receive', 'text': json.dumps({'type': 'move', 'uci': 'e2e4'})})
+        return channel
+
+    async def test_move_reply_and_feedback_are_pushed(self, llm):
+        channel = await self.play_e4()
+        received = {}
+        while 'feedback' not in received:
+            message = await self.receive(channel)
+            received[message['type']] = message
+        # The feedback is only generated once the reply is recorded
+        self.assertEqual([kind for kind in received if kind != 'eval'], ['move', 'ai_move', 'feedback'])
+        self.assertEqual(received['move']['san'], 'e4')
+        self.assertEqual(received['ai_move']['san'], 'e5')
+        self.assertEqual(received['feedback']['move_id'], received['move']['move_id'])
+        self.assertEqual(received['feedback']['feedback'], 'A classical central move.')
+        self.assertEqual(received['feedback']['status'], 'ready')
+
+        # Only the side to move may play
+        await channel.send_input({'type': 'websocket.receive', 'text': json.dumps({'type': 'move', 'uci': 'e7e5'})})
+        self.assertEqual((await self.receive(channel))['type'], 'error')
+        await channel.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await channel.wait(timeout=5)
+
+    async def test_failed_feedback_is_reported(self, llm):
+        with mock.patch('chess_app.tasks.generate_move_feedback', side_effect=DatabaseError('database table is locked')):
+            channel = await self.play_e4()
+            message = {}
+            while message.get('type') != 'error':
+                message = await self.receive(channel)
+        move = await Move.objects.aget(id=message['move_id'])
+        self.assertEqual(move.feedback_status, 'failed')
+        await channel.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await channel.wait(timeout=5)
+
+    async def test_refuses_anonymous_and_cross_site_connections(self, llm):
+        for cookie, origin, code in [('', 'http://localhost', 4001), (self.cookie, 'http://evil.example', 4003)]:
+            with self.settings(ALLOWED_HOSTS=['localhost']):
+                channel = self.connect(cookie, origin)
+                await channel.send_input({'type': 'websocket.connect'})
+                self.assertEqual(await channel.receive_output(timeout=5), {'type': 'websocket.close', 'code': code})
@@ -11,12 +11,18 @@ urlpatterns = [
     
     # API endpoints
     path('api/game/<int:game_id>/move/', views.make_move, name='make_move'),
+    path('api/game/<int:game_id>/move/<int:move_id>/feedback/', views.get_move_feedback, name='get_move_feedback'),
     path('api/game/<int:game_id>/ai_move/', views.get_ai_move, name='get_ai_move'),
+    path('api/game/<int:game_id>/play/', views.play, name='play'),
     path('api/game/<int:game_id>/hint/', views.get_hint, name='get_hint'),
     path('api/game/<int:game_id>/chat/', views.chat, name='chat'),
+    path('api/game/<int:game_id>/chat/stream/', views.chat_stream, name='chat_stream'),
     path('api/game/<int:game_id>/reset/', views.reset_game, name='reset_game'),
     path('api/ask_question/', views.ask_question, name='ask_question'),
+    path('api/analyze/batch', views.analyze_batch, name='analyze_batch'),
+    path('api/analyze/stream', views.analyze_stream, name='analyze_stream'),
     path('api/game/<int:game_id>/move_history/', views.get_move_history, name='get_move_history'),
+    path('api/game/<int:game_id>/review/', views.game_review, name='game_review'),
     
     # Opening Explorer
     path('explorer/', views.opening_explorer, name='opening_explorer'),
@@ -30,4 +36,6 @@ urlpatterns = [
     path('challenges/<int:challenge_id>/', views.challenge_detail, name='challenge_detail'),
     path('api/challenges/<int:challenge_id>/verify/', 
          views.verify_challenge_solution, name='verify_challenge_solution'),
+    path('api/check_challenge_move/<int:challenge_id>/',
+         views.check_challenge_move, name='check_challenge_move'),
 ] 
\ No newline at end of file
@@ -1,7 +1,8 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import JsonResponse
+from django.template.loader import render_to_string
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.contrib.auth.decorators import login_required
-from django.views.decorators.http import require_POST, require_GET
+from django.views.decorators.http import condition, require_POST, require_GET
 from django.views.decorators.csrf import csrf_exempt, csrf_protect
 import json
 import chess
@@ -9,43 +10,31 @@ import chess.pgn
 import io
 import logging
 import random
-import spacy
-import openai
-from openai import OpenAI
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib import messages
 from django.core.mail import send_mail
 from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
 from django import forms
 
 from .models import (
-    Opening, Game, Move, UserProfile, UserProgress, Challenge, UserChallenge
+    Opening, Game, Move, UserProfile, UserProgress, Challenge, UserChallenge, position_key
 )
 from .services import (
-    StockfishEngine, ChessNLP, FeedbackGenerator, OpeningExplorer
-)  # noqa: E501
+    AnalysisCache, AnalysisContext, ChallengeCatalog, ChatHistory, EngineBusy, GameReviewer, OpeningExplorer,
+    ProfileDashboard, ProgressTracker, SolutionTree, SpeculativeReplies
+)
+from . import registry, tasks
+from .llm import get_gateway
+from .prompts import CHAT_PROMPT
 
 # Configure logging to output to the console
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize services
-stockfish_engine = StockfishEngine()
-chess_nlp = ChessNLP()
-feedback_generator = FeedbackGenerator(stockfish_engine)
-
-# Load the spaCy model
-nlp = spacy.load('en_core_web_sm')
-
-# Set your OpenAI API key
-openai.api_key = 'YOUR_API_KEY'  # noqa: E501
-
-# Initialize OpenAI client with Gemini
-client = OpenAI(
-    base_url="https://openrouter.ai/api/v1",
-    api_key="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"
-)  # noqa: E501
-
 def home(request):
     """Home page view."""
     return render(request, 'chess_app/home.html')
@@ -70,6 +59,9 @@ def game(request, opening_id):
         defaults={'user_color': 'white'}  # Default to white, could be randomized
     )
     
+    if created:
+        ProgressTracker.record_game_started(request.user, opening)
+    
     # Get or create user progress for this opening
     progress, _ = UserProgress.objects.get_or_create(
         user=request.user,
@@ -85,87 +77,180 @@ def game(request, opening_id):
 @login_required
 @require_POST
 def make_move(request, game_id):
-    """API endpoint to record a user's move and get feedback."""
+    """
+    API endpoint to record a user's move.
+    Responds with the engine classification straight away; the detailed
+    feedback is generated in the background and fetched via get_move_feedback.
+    """
     game_obj = get_object_or_404(Game, id=game_id, user=request.user)
+    try:
+        board, move_obj, classification, reason = submit_user_move(request, game_obj)
+    except MoveRejected as e:
+        return e.response()
+    
+    # Search the AI's reply now, so get_ai_move finds it ready
+    if not board.is_game_over():
+        tasks.run_in_background(precompute_ai_reply, game_obj.id, len(board.move_stack))
+    
+    response = {
+        'status': 'success',
+        'move': move_obj.move_uci,
+        'move_id': move_obj.id,
+        'feedback': reason,
+        'improvement': '',
+        'move_classification': classification,
+        'feedback_status': 'pending'
+    }
+    # logger.info(f"Returning move analysis response: {response}")
+    return JsonResponse(response)
+
+@login_required
+@require_POST
+def play(request, game_id):
+    """
+    API endpoint for a whole turn, in place of make_move, get_ai_move and
+    get_move_history: records the user's move and responds with its
+    classification, the AI's reply and the new move-history entries.
+    The user's feedback is generated in the background while the reply
+    is searched. If the reply cannot be recorded, the user's move still
+    stands: ai_move is null and resync asks the client to reload the game.
+    """
+    game_obj = get_object_or_404(Game, id=game_id, user=request.user)
+    try:
+        board, move_obj, classification, reason = submit_user_move(request, game_obj)
+    except MoveRejected as e:
+        return e.response()
+    
+    ai_move_obj = None
+    resync = False
+    if not board.is_game_over():
+        try:
+            ai_move_obj = play_ai_move(game_obj, board)
+        except MoveRejected as e:
+            logger.warning(f"AI reply in game {game_obj.id} not recorded: {e}")
+            resync = True
+    
+    new_moves = [move_obj] if ai_move_obj is None else [move_obj, ai_move_obj]
+    return JsonResponse({
+        'status': 'success',
+        'move': move_obj.move_uci,
+        'move_id': move_obj.id,
+        'feedback': reason,
+        'improvement': '',
+        'move_classification': classification,
+        'feedback_status': 'pending',
+        'ai_move': ai_move_obj and {
+            'move': ai_move_obj.move_san,
+            'move_uci': ai_move_obj.move_uci,
+            'feedback': ai_move_obj.feedback
+        },
+        'history': [
+            {'move_number': m.move_number, 'move_san': m.move_san, 'player': m.player}
+            for m in new_moves
+        ],
+        'resync': resync,
+        'fen': game_obj.fen_position if resync else board.fen()
+    })
+
+class MoveRejected(Exception):
+    """A submitted move that cannot be recorded; carries the error response."""
+    def __init__(self, message, status=400, fen=None):
+        super().__init__(message)
+        self.status = status
+        self.fen = fen
     
+    def response(self):
+        data = {'status': 'error', 'message': str(self)}
+        if self.fen:
+            data['fen'] = self.fen
+        return JsonResponse(data, status=self.status)
+
+def submit_user_move(request, game_obj):
+    """
+    Validate and record the user's move posted to make_move or play, and
+    schedule its feedback. Returns (board, move, classification,
+    reason) with the move pushed on the board; raises MoveRejected.
+    """
     # Get move data from request
     move_uci = request.POST.get('move_uci')  # Ensure this is a UCI move string
     position_before = request.POST.get('position_before')
     
-    # Log the received move and board state
-    # logger.info(f"Received move: {move_uci} for game: {game_id}")
-    # logger.info(f"Board position before move: {position_before}")
+    # The game's own move list is authoritative; the client's position is
+    # only used to detect a board that has drifted out of sync
+    board = game_obj.board()
+    if position_before and position_before.split(' ')[:4] != board.fen().split(' ')[:4]:
+        logger.warning(f"Client position {position_before} does not match game {game_obj.id}: {board.fen()}")
+        raise MoveRejected('Board is out of sync with the game', 409, board.fen())
     
-    # Create a chess board from the position before the move
-    board = chess.Board(position_before)
-    move = chess.Move.from_uci(move_uci)
+    try:
+        move = chess.Move.from_uci(move_uci)
+    except (TypeError, ValueError):
+        raise MoveRejected('Illegal move')
     # logger.info(f"Checking legality of move {move_uci} on board: {board.fen()}")
     
+    move_obj, classification, reason, analysis_context = record_user_move(game_obj, board, move)
+    tasks.run_in_background(
+        tasks.generate_move_feedback, registry.get_feedback_generator(), move_obj.id, analysis_context
+    )
+    return board, move_obj, classification, reason
+
+def record_user_move(game_obj, board, move):
+    """
+    Classify and record a user's move in the game's current position
+    (board), pushing it on the board. Returns (move, classification, reason,
+    analysis context); the caller schedules the feedback with the context.
+    Raises MoveRejected.
+    """
+    move_uci = move.uci()
     # Validate the move
     if move not in board.legal_moves:
         logger.warning(f"Illegal move attempted: {move_uci} on board: {board.fen()}")
-        return JsonResponse({'status': 'error', 'message': 'Illegal move'}, status=400)
+        raise MoveRejected('Illegal move')
     
-    # Analyze the move using Stockfish BEFORE pushing the move
-    eval_score, classification, reason = stockfish_engine.analyze_move(
-        position_before, move_uci
+    # Analyze the move using Stockfish BEFORE pushing the move; the context
+    # keeps the searches so the feedback worker does not repeat them
+    analysis_context = AnalysisContext()
+    eval_score, classification, reason = registry.get_stockfish_engine().analyze_move(
+        board.fen(), move_uci, context=analysis_context
     )
     # logger.info(f"Analysis result: eval_score={eval_score}, classification={classification}, reason={reason}")
     if classification == "illegal":
-        logger.warning(f"Analysis found move illegal: {move_uci} on board: {position_before}")
-        return JsonResponse({'status': 'error', 'message': reason}, status=400)
+        logger.warning(f"Analysis found move illegal: {move_uci} on board: {board.fen()}")
+        raise MoveRejected(reason)
     
-    # Now push the move
-    board.push(move)
-    # logger.info(f"Board after move: {board.fen()}")
-    
-    # Generate detailed feedback using the board state BEFORE the move
-    feedback_body, ai_classification = feedback_generator.generate_move_feedback(
-        board_fen=position_before,
-        move_uci=move_uci,
-        classification=classification,
-        opening=game_obj.opening
-    )
-    
-    # Generate improvement suggestion if needed
-    improvement = ""
-    if ai_classification not in ["best", "excellent", "good"]:
-        improvement = feedback_generator.suggest_improvement(
-            board.fen(), ai_classification
-        )
-    
-    # Save the move to the database
-    Move.objects.create(
-        game=game_obj,
-        move_number=get_next_move_number(game_obj),
-        move_uci=move_uci,
-        move_san=move_uci,  # Assuming SAN is the same for simplicity
-        position_before=position_before,
-        position_after=board.fen(),
+    # Save the move with the engine classification; the detailed feedback
+    # and improvement text are filled in by a background worker
+    move_obj = record_move(
+        game_obj, board, move,
         player='user',
         eval_score=eval_score,
-        is_mistake=ai_classification in ["mistake", "blunder"],
-        quality=ai_classification,
-        feedback=feedback_body,
-        improvement_suggestion=improvement
+        is_mistake=classification in ["mistake", "blunder"],
+        quality=classification,
+        feedback_status='pending'
+    )
+    if move_obj is None:
+        raise MoveRejected('Board is out of sync with the game', 409, game_obj.fen_position)
+    return move_obj, classification, reason, analysis_context
+
+@login_required
+@require_GET
+def get_move_feedback(request, game_id, move_id):
+    """API endpoint to poll for the background feedback of a user's move."""
+    move_obj = get_object_or_404(
+        Move, id=move_id, game_id=game_id, game__user=request.user
     )
     
-    # Update the game state
-    game_obj.fen_position = board.fen()
-    game_obj.save()
-    
-    # Update user progress
-    update_user_progress(request.user, game_obj.opening, ai_classification)
+    if move_obj.feedback_status == 'pending':
+        return JsonResponse({'status': 'pending', 'move_id': move_obj.id})
     
-    response = {
+    return JsonResponse({
         'status': 'success',
-        'move': move_uci,
-        'feedback': feedback_body,
-        'improvement': improvement,
-        'move_classification': ai_classification
-    }
-    # logger.info(f"Returning move analysis response: {response}")
-    return JsonResponse(response)
+        'move_id': move_obj.id,
+        'feedback': move_obj.feedback or "",
+        'improvement': move_obj.improvement_suggestion or "",
+        'move_classification': move_obj.quality,
+        'feedback_status': move_obj.feedback_status
+    })
 
 @login_required
 @require_GET
@@ -173,53 +258,18 @@ def get_ai_move(request, game_id):
     """API endpoint to get the AI's next move."""
     game_obj = get_object_or_404(Game, id=game_id, user=request.user)
     
-    # Reconstruct the board from the full move history
-    board = chess.Board()
-    moves = Move.objects.filter(game=game_obj).order_by('move_number')
-    for m in moves:
-        try:
-            board.push_uci(m.move_uci)
-        except Exception as e:
-            # print(f"Error pushing move {m.move_uci}: {e}")
-            break
-    
-    # Generate AI move based on the opening or engine
-    ai_move, san_move, evaluation = generate_ai_move(
-        board,
-        game_obj.opening,
-        game_obj.ai_strength
-    )  # noqa: E501
+    # Reconstruct the board from the game's move list
+    board = game_obj.board()
+    try:
+        move_obj = play_ai_move(game_obj, board)
+    except MoveRejected as e:
+        return e.response()
     
-    if ai_move:
-        # Generate feedback for the AI move
-        feedback = generate_ai_explanation(
-            board,
-            ai_move,
-            game_obj.opening
-        )  # noqa: E501
-        
-        # Save the move to the database
-        move_obj = Move.objects.create(
-            game=game_obj,
-            move_number=get_next_move_number(game_obj),
-            move_uci=ai_move.uci(),
-            move_san=san_move,
-            position_before=board.fen(),
-            position_after=board.fen(),
-            player='ai',
-            eval_score=evaluation,
-            quality='best',  # AI always plays best moves
-            feedback=feedback
-        )
-        
-        # Update the game state
-        game_obj.fen_position = board.fen()
-        game_obj.save()
-        
+    if move_obj:
         return JsonResponse({
             'status': 'success',
-            'move': san_move,
-            'move_uci': ai_move.uci(),
+            'move': move_obj.move_san,
+            'move_uci': move_obj.move_uci,
             'feedback': move_obj.feedback
         })
     
@@ -228,6 +278,49 @@ def get_ai_move(request, game_id):
         'message': 'Could not generate AI move'
     }, status=400)
 
+def play_ai_move(game_obj, board):
+    """
+    Generate, explain and record the AI's move in the game's current
+    position (board), pushing it on the board. Returns the saved Move, or
+    None if no move could be generated; raises MoveRejected on a desync.
+    """
+    # Use the reply searched in the background after make_move if there is one
+    precomputed = SpeculativeReplies.take(game_obj.id, board)
+    if precomputed:
+        ai_move, evaluation = precomputed
+    else:
+        # Generate AI move based on the opening or engine
+        ai_move, _, evaluation = generate_ai_move(
+            board,
+            game_obj.opening,
+            game_obj.ai_strength
+        )  # noqa: E501
+    if not ai_move:
+        return None
+    
+    # Generate feedback for the AI move
+    feedback = generate_ai_explanation(
+        board,
+        ai_move,
+        game_obj.opening
+    )  # noqa: E501
+    
+    # Save the move to the database; this also plays it on the board
+    move_obj = record_move(
+        game_obj, board, ai_move,
+        player='ai',
+        eval_score=evaluation,
+        quality='best',  # AI always plays best moves
+        feedback=feedback
+    )
+    if move_obj is None:
+        raise MoveRejected('Board is out of sync with the game', 409)
+    
+    # Analyse the user's position while they think about their move
+    if getattr(settings, 'PONDER_ENABLED', True) and not board.is_game_over():
+        tasks.run_in_background(registry.get_stockfish_engine().ponder, board.fen())
+    return move_obj
+
 @login_required
 @require_GET
 def get_hint(request, game_id):
@@ -239,7 +332,7 @@ def get_hint(request, game_id):
     # board = chess.Board(game_obj.fen_position)
     
     # Use Stockfish to get top moves
-    top_moves = stockfish_engine.get_top_moves(game_obj.fen_position, 1)
+    top_moves = registry.get_stockfish_engine().get_top_moves(game_obj.fen_position, 1)
     
     if top_moves:
         best_move = top_moves[0]
@@ -278,49 +371,79 @@ def get_hint(request, game_id):
         'hint': hint
     })
 
-@login_required
-@require_POST
-def chat(request, game_id):
-    # print("Chat request received")
-    """API endpoint for chat interaction with the AI."""
-    game_obj = get_object_or_404(Game, id=game_id, user=request.user)
-    
+def _parse_chat_request(request, game_obj):
+    """Extract the message and FEN from a JSON or form chat request."""
     # Robustly extract message and FEN from JSON or form POST
     if request.content_type == 'application/json':
         try:
             data = json.loads(request.body)
             message = data.get('message', '')
             board_fen = data.get('fen', game_obj.fen_position)
-            conversation_history = data.get('history', [])  # Get conversation history
             # print("fen in try", board_fen)
-            # print("conversation history:", conversation_history)
         except Exception as e:
             # print(f"Error parsing JSON body: {e}")
             message = ''
             board_fen = game_obj.fen_position
-            conversation_history = []
             # print("fen in except", board_fen)
     else:
         message = request.POST.get('message', '')
         board_fen = request.POST.get('fen', game_obj.fen_position)
-        conversation_history = request.POST.get('history', [])
         # print("fen in else", board_fen)
+    return message, board_fen
 
-    # Add the new message to the conversation history
-    conversation_history.append({"role": "user", "content": message})
+@login_required
+@require_POST
+def chat(request, game_id):
+    # print("Chat request received")
+    """
+    API endpoint for chat interaction with the AI.
+    The conversation is kept on the server; the client sends only the new message.
+    """
+    game_obj = get_object_or_404(Game, id=game_id, user=request.user)
+    
+    message, board_fen = _parse_chat_request(request, game_obj)
 
-    # Generate response with context
-    response = analyze_question(message, board_fen, conversation_history)
+    # Generate response with the recent messages and the summary of older ones
+    history = ChatHistory(game_obj)
+    summary, recent_messages = history.context()
+    response = analyze_question(message, board_fen, recent_messages, summary)
 
-    # Add the AI's response to the conversation history
-    conversation_history.append({"role": "assistant", "content": response})
+    # A canned error reply is not part of the conversation
+    if response != CHAT_ERROR_REPLY:
+        history.add('user', message)
+        history.add('assistant', response)
+    if history.needs_summary:
+        tasks.run_in_background(tasks.summarize_chat, game_obj.id)
 
     return JsonResponse({
         'status': 'success',
-        'response': response,
-        'history': conversation_history  # Return updated history
+        'response': response
     })
 
+@login_required
+@require_POST
+def chat_stream(request, game_id):
+    """API endpoint that streams the AI's chat answer as server-sent events."""
+    game_obj = get_object_or_404(Game, id=game_id, user=request.user)
+    
+    message, board_fen = _parse_chat_request(request, game_obj)
+    history = ChatHistory(game_obj)
+    summary, recent_messages = history.context()
+    if history.needs_summary:
+        tasks.run_in_background(tasks.summarize_chat, game_obj.id)
+    
+    def save_exchange(answer):
+        history.add('user', message)
+        history.add('assistant', answer)
+    
+    response = StreamingHttpResponse(
+        stream_answer(message, board_fen, recent_messages, summary, on_complete=save_exchange),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Stop proxies from buffering the stream
+    return response
+
 @login_required
 @require_POST
 def reset_game(request, game_id):
@@ -329,11 +452,14 @@ def reset_game(request, game_id):
     
     # Reset the game
     game_obj.fen_position = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+    game_obj.move_data = b''
     game_obj.in_opening_book = True
     game_obj.save()
     
-    # Delete all moves from this game
+    # Delete all moves and the chat from this game
     Move.objects.filter(game=game_obj).delete()
+    ChatHistory(game_obj).clear()
+    ProfileDashboard.invalidate(request.user.id)
     
     return JsonResponse({
         'status': 'success',
@@ -373,41 +499,35 @@ def opening_explorer(request, opening_id=None):
 @login_required
 def user_profile(request):
     """View to display user profile and progress."""
-    user_profile, created = UserProfile.objects.get_or_create(user=request.user)
-    
-    # Get user progress across all openings
-    progress_list = UserProgress.objects.filter(user=request.user).order_by('-mastery_level')
-    
-    # Get recent games
-    recent_games = Game.objects.filter(user=request.user).order_by('-updated_at')[:5]
-    
-    # Get unsolved challenges
-    unsolved_challenges = UserChallenge.objects.filter(
-        user=request.user, 
-        is_solved=False
-    ).select_related('challenge')[:5]
-    
-    return render(request, 'chess_app/user_profile.html', {
-        'profile': user_profile,
-        'progress_list': progress_list,
-        'recent_games': recent_games,
-        'unsolved_challenges': unsolved_challenges
-    })
+    return render(request, 'chess_app/user_profile.html', ProfileDashboard.get(request.user))
 
 @login_required
 def challenges(request):
-    """View to see all available chess challenges."""
-    challenges = Challenge.objects.all()
+    """View to browse chess challenges, one page at a time."""
+    params = ChallengeCatalog.clean_params(request.GET)
     
-    # Get user-challenge associations for the current user
-    user_challenges = {
-        uc.challenge_id: uc for uc in 
-        UserChallenge.objects.filter(user=request.user)
-    }
+    # The rendered grid is cached per page and user, so a hit costs no query
+    cache_key = ChallengeCatalog.cache_key(request.user, params)
+    page = cache.get(cache_key)
+    if page is None:
+        result = ChallengeCatalog.page(request.user, **params)
+        page = {
+            'grid': render_to_string('chess_app/challenge_grid.html', result),
+            'next_cursor': result['next_cursor'],
+        }
+        cache.set(cache_key, page, getattr(settings, 'CHALLENGES_CACHE_TTL', 300))
+    
+    # Filters are kept in the pagination links
+    filters = request.GET.copy()
+    filters.pop('after', None)
     
     return render(request, 'chess_app/challenges.html', {
-        'challenges': challenges,
-        'user_challenges': user_challenges
+        'grid': page['grid'],
+        'next_cursor': page['next_cursor'],
+        'filters': params,
+        'filter_query': filters.urlencode(),
+        'openings': ChallengeCatalog.openings(),
+        'difficulties': Challenge.DIFFICULTY_CHOICES,
     })
 
 @login_required
@@ -420,98 +540,326 @@ def challenge_detail(request, challenge_id):
         user=request.user,
         challenge=challenge
     )
+    if created:
+        ProfileDashboard.invalidate(request.user.id)
+    elif user_challenge.progress_fen:
+        # The page starts a new attempt from the challenge position
+        UserChallenge.objects.filter(id=user_challenge.id).update(progress_fen='')
     
     return render(request, 'chess_app/challenge_detail.html', {
         'challenge': challenge,
-        'user_challenge': user_challenge
+        'user_challenge': user_challenge,
+        'user_attempts': user_challenge.attempts,
+        # The solver plays the side to move in the challenge position
+        'player_color': 'white' if challenge.fen_position.split(' ')[1] == 'w' else 'black'
     })
 
+def record_challenge_attempt(user, challenge, solved):
+    """Count an attempt at a challenge, marking it solved if it was; the next attempt starts over."""
+    fields = {'attempts': F('attempts') + 1, 'progress_fen': ''}
+    if solved:
+        fields.update(is_solved=True, solved_date=timezone.now())
+    UserChallenge.objects.filter(user=user, challenge=challenge).update(**fields)
+    ProfileDashboard.invalidate(user.id)
+    if solved:
+        ChallengeCatalog.invalidate(user.id)
+
 @login_required
 @require_POST
-def verify_challenge_solution(request, challenge_id):
-    """API endpoint to verify a user's solution to a challenge."""
+def check_challenge_move(request, challenge_id):
+    """
+    API endpoint to check one move of a challenge against its solution tree.
+    The attempt's position is kept on the UserChallenge, so each move is
+    checked from where the solver's accepted moves and the forced replies
+    left it; the client's position_before only detects a board out of sync.
+    A wrong move ends the attempt: it counts as a failed attempt and the
+    next move starts from the challenge position again.
+    """
     challenge = get_object_or_404(Challenge, id=challenge_id)
-    user_challenge, created = UserChallenge.objects.get_or_create(
-        user=request.user,
-        challenge=challenge
-    )
-    
-    # Get the moves from the request
-    moves = request.POST.getlist('moves')
+    user_challenge, _ = UserChallenge.objects.get_or_create(user=request.user, challenge=challenge)
     
-    # Increment attempt counter
-    user_challenge.attempts += 1
+    board = chess.Board(user_challenge.progress_fen or challenge.fen_position)
+    position_before = request.POST.get('position_before')
+    try:
+        move = chess.Move.from_uci(request.POST.get('move_uci', ''))
+        out_of_sync = position_before and position_key(chess.Board(position_before)) != position_key(board)
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid position or move'}, status=400)
+    if out_of_sync:
+        return JsonResponse(
+            {'status': 'error', 'message': 'Board is out of sync with the challenge', 'fen': board.fen()}, status=409
+        )
     
-    # Check if the solution is correct
-    solution_pgn = challenge.solution_moves
-    user_pgn = ' '.join(moves)
+    result = SolutionTree.check(challenge, board, move)
+    if result is None:
+        record_challenge_attempt(request.user, challenge, solved=False)
+        return JsonResponse({
+            'status': 'success',
+            'is_correct': False,
+            'message': 'That move is not part of the solution.',
+            'reset_position': True
+        })
     
-    # Simple string comparison for now - in a real app,
-    # you'd want to compare actual moves more robustly
-    is_correct = user_pgn.strip() == solution_pgn.strip()
+    reply, completed = result
+    opponent_move = None
+    board.push(move)
+    if reply:
+        opponent_move = board.san(chess.Move.from_uci(reply))
+        board.push_uci(reply)
+    if completed:
+        record_challenge_attempt(request.user, challenge, solved=True)
+    # Only advance from the position this move was checked in
+    elif not UserChallenge.objects.filter(
+        id=user_challenge.id, progress_fen=user_challenge.progress_fen
+    ).update(progress_fen=board.fen()):
+        return JsonResponse({'status': 'error', 'message': 'Board is out of sync with the challenge'}, status=409)
     
-    if is_correct:
-        user_challenge.is_solved = True
-        from django.utils import timezone
-        user_challenge.solved_date = timezone.now()
+    return JsonResponse({
+        'status': 'success',
+        'is_correct': True,
+        'opponent_move': opponent_move,
+        'challenge_completed': completed,
+        'completion_message': 'Well done!' if completed else '',
+        'solution': challenge.solution_moves if completed else None
+    })
+
+@login_required
+@require_POST
+def verify_challenge_solution(request, challenge_id):
+    """API endpoint to verify a user's full solution line to a challenge."""
+    challenge = get_object_or_404(Challenge, id=challenge_id)
+    UserChallenge.objects.get_or_create(user=request.user, challenge=challenge)
     
-    user_challenge.save()
+    # Moves of both sides, in SAN or UCI; move numbers are skipped
+    moves = [
+        move for text in request.POST.getlist('moves') for move in text.split()
+        if not move.endswith('.')
+    ]
+    is_correct = SolutionTree.verify_line(challenge, moves)
+    record_challenge_attempt(request.user, challenge, solved=is_correct)
     
     return JsonResponse({
         'status': 'success',
         'is_correct': is_correct,
-        'attempts': user_challenge.attempts
+        'attempts': UserChallenge.objects.get(user=request.user, challenge=challenge).attempts
     })
 
-def analyze_question(question, board_fen=None, conversation_history=None):
+def build_chat_prompt(question, board_fen=None, conversation_history=None, summary=None):
+    """
+    Build the chess-coach prompt for a chat question.
+    conversation_history holds the recent messages and summary the
+    rolling summary of anything older (see ChatHistory).
+    """
+    # Prepare the conversation context
+    context = ""
+    if summary:
+        context = f"Summary of the earlier conversation:\n{summary}\n\n"
+    if conversation_history:
+        context += "Previous conversation:\n"
+        for msg in conversation_history:
+            role = "User" if msg["role"] == "user" else "Assistant"
+            context += f"{role}: {msg['content']}\n"
+    if context:
+        context += "\nCurrent question:\n"
+
+    return CHAT_PROMPT.render(context=context, question=question, board_fen=board_fen)
+
+# Shown when the provider fails; never saved to the conversation
+CHAT_ERROR_REPLY = "Error processing your request. Please try again later."
+
+def analyze_question(question, board_fen=None, conversation_history=None, summary=None):
     # print("analyze_question method called")
     # logger.info(f"Received question: {question}")
     # logger.info(f"Board FEN: {board_fen}")
     # logger.info(f"Conversation history: {conversation_history}")
     
     try:
-        # Prepare the conversation context
-        context = ""
-        if conversation_history:
-            context = "Previous conversation:\n"
-            for msg in conversation_history:
-                role = "User" if msg["role"] == "user" else "Assistant"
-                context += f"{role}: {msg['content']}\n"
-            context += "\nCurrent question:\n"
-
-        prompt = (
-            f"You are a highly skilled chess expert with extensive knowledge of chess strategy, tactics, and board dynamics. "
-            f"You are currently being used as a chat agent in the backend for an agentic chess application designed to help users improve their openings. "
-            f"{context}"
-            f"The user asks: '{question}'. Carefully analyze the user's question, considering the context and nuances, and respond with a clear and insightful answer. "
-            "If the question is not related to the current board position or does not require a strategic recommendation, avoid referencing the FEN. "
-            "However, if the user asks about what move to make next, what action to take, or what strategy to adopt based on the current position, do not mention the FEN directly. "
-            "Focus on understanding the user's intent and providing a response that is not only accurate but also actionable. "
-            "Provide guidance that could improve the user's chess game, whether it's through suggesting the best move, explaining a strategy, or offering advice on improving play. "
-            "Your answer should be structured, well thought-out, and tailored to the user's level of experience, aiming to help them understand both the move and the reasoning behind it. "
-            "If the question is open-ended or vague, ask for further clarification to ensure you provide the most relevant and helpful response. "
-            f"This is the current board state: {board_fen}"
-        )
+        prompt = build_chat_prompt(question, board_fen, conversation_history, summary)
 
-        completion = client.chat.completions.create(
-            extra_body={},
-            model="google/gemini-2.0-flash-001",
-            messages=[
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ]
+        # The canned reply below doubles as the fallback when the provider is slow
+        return get_gateway().complete(
+            prompt,
+            timeout=getattr(settings, 'LLM_CHAT_TIMEOUT', 20.0),
+            call_site='chat'
         )
-        # print("completion", completion)
-        
-        # Extract the final response from the completion
-        raw_response = completion.choices[0].message.content
-
-        return raw_response
     except Exception as e:
         logger.error(f"Error with Gemini API: {e}")
-        return "Error processing your request. Please try again later."
+        return CHAT_ERROR_REPLY
+
+def stream_answer(question, board_fen=None, conversation_history=None, summary=None, on_complete=None):
+    """
+    Yield server-sent events carrying the answer to a chat question as the
+    tokens arrive, followed by a final 'done' event with the full text.
+    Tokens are only pulled from the provider as fast as the client reads
+    them, and closing this generator cancels the upstream completion.
+    on_complete is called with the full answer once it has been sent, unless
+    the stream failed.
+    """
+    prompt = build_chat_prompt(question, board_fen, conversation_history, summary)
+    chunks = []
+    failed = False
+    tokens = get_gateway().stream(
+        prompt,
+        timeout=getattr(settings, 'LLM_CHAT_TIMEOUT', 20.0),
+        call_site='chat_stream'
+    )
+    try:
+        for token in tokens:
+            chunks.append(token)
+            yield f"data: {json.dumps({'token': token})}\n\n"
+    except Exception as e:
+        logger.error(f"Error streaming from Gemini API: {e}")
+        failed = True
+        if not chunks:
+            chunks.append(CHAT_ERROR_REPLY)
+            yield f"data: {json.dumps({'token': CHAT_ERROR_REPLY})}\n\n"
+    finally:
+        tokens.close()
+    answer = ''.join(chunks)
+    if on_complete and not failed:
+        on_complete(answer)
+    yield f"event: done\ndata: {json.dumps({'response': answer})}\n\n"
+
+@login_required
+@require_POST
+def analyze_batch(request):
+    """
+    API endpoint analysing many positions in one request. Expects JSON with
+    "positions" (FENs) and optional "depth", "time" (seconds per position)
+    and "lines". Cached positions are answered first; the rest are searched
+    in parallel and streamed back as newline-delimited JSON as they finish.
+    """
+    try:
+        data = json.loads(request.body)
+        fens = data['positions']
+        depth = int(data.get('depth', 15))
+        time_limit = float(data['time']) if data.get('time') is not None else None
+        num_moves = int(data.get('lines', 1))
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return JsonResponse({'status': 'error', 'message': 'Expected JSON with a list of positions'}, status=400)
+    max_positions = getattr(settings, 'ANALYZE_BATCH_MAX_POSITIONS', 100)
+    if not isinstance(fens, list) or not all(isinstance(fen, str) for fen in fens) or len(fens) > max_positions:
+        return JsonResponse(
+            {'status': 'error', 'message': f'positions must be a list of at most {max_positions} FENs'}, status=400
+        )
+    depth = max(1, min(depth, getattr(settings, 'ANALYZE_BATCH_MAX_DEPTH', 20)))
+    if time_limit is not None:
+        time_limit = max(0.01, min(time_limit, getattr(settings, 'ANALYZE_BATCH_MAX_TIME', 5.0)))
+    num_moves = max(1, min(num_moves, 5))
+    
+    response = StreamingHttpResponse(
+        stream_batch_analysis(fens, depth, num_moves, time_limit),
+        content_type='application/x-ndjson'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Stop proxies from buffering the stream
+    return response
+
+def stream_batch_analysis(fens, depth, num_moves, time_limit):
+    """Yield one JSON line per requested position, then a summary line."""
+    def line(index, fen, **fields):
+        return json.dumps({'index': index, 'fen': fen, **fields}) + '\n'
+    
+    pending = {}
+    cached = 0
+    for index, fen in enumerate(fens):
+        try:
+            board = chess.Board(fen)
+        except ValueError:
+            yield line(index, fen, error='Invalid FEN')
+            continue
+        if not board.is_valid():
+            yield line(index, fen, error='Illegal position')
+            continue
+        result = AnalysisCache.get(fen, depth, num_moves)
+        if result is not None:
+            cached += 1
+            yield line(index, fen, cached=True, **result)
+        else:
+            pending.setdefault(board.fen(), []).append((index, fen))
+    
+    failed = 0
+    if pending:
+        pool = registry.get_engine_pool()
+        if pool.available:
+            results = pool.analyse_iter(pending, depth, num_moves, time_limit)
+        else:
+            results = ((fen, None) for fen in pending)
+        for board_fen, result in results:
+            entry = AnalysisCache.store(board_fen, result) if result is not None else None
+            for index, fen in pending[board_fen]:
+                if entry is None:
+                    failed += 1
+                    yield line(index, fen, error='Analysis failed' if pool.available else 'Engine unavailable')
+                else:
+                    yield line(index, fen, cached=False, **entry)
+    
+    yield json.dumps({'done': True, 'cached': cached, 'analysed': sum(map(len, pending.values())) - failed}) + '\n'
+
+@login_required
+@require_GET
+def analyze_stream(request):
+    """
+    API endpoint streaming a live evaluation of the "fen" position as
+    server-sent events: one event per completed search depth, with the
+    score and the best "lines" and their PVs, until "depth" is reached or
+    the client disconnects. A cached evaluation is sent first.
+    """
+    try:
+        board = chess.Board(request.GET.get('fen', ''))
+        depth = int(request.GET.get('depth', 18))
+        num_moves = int(request.GET.get('lines', 1))
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid FEN or parameters'}, status=400)
+    if not board.is_valid():
+        return JsonResponse({'status': 'error', 'message': 'Illegal position'}, status=400)
+    depth = max(1, min(depth, getattr(settings, 'ANALYSIS_STREAM_MAX_DEPTH', 22)))
+    num_moves = max(1, min(num_moves, 5))
+    
+    response = StreamingHttpResponse(
+        stream_live_analysis(board.fen(), depth, num_moves),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Stop proxies from buffering the stream
+    return response
+
+def stream_live_analysis(fen, depth, num_moves):
+    """Yield an event per new search depth, then a 'done' event with the depth reached."""
+    reported = 0
+    cached = AnalysisCache.get(fen, 0, num_moves)
+    if cached is not None:
+        reported = cached['depth']
+        yield f"data: {json.dumps(dict(cached, fen=fen, cached=True))}\n\n"
+    
+    if reported < depth:
+        pool = registry.get_engine_pool()
+        if not pool.available:
+            if cached is None:
+                yield f"event: error\ndata: {json.dumps({'message': 'Engine unavailable'})}\n\n"
+        else:
+            deepest = None
+            results = pool.analysis_depths(fen, depth, num_moves, getattr(settings, 'ANALYSIS_STREAM_MAX_TIME', 10.0))
+            try:
+                for result in results:
+                    if result['depth'] <= reported:
+                        continue
+                    deepest = result
+                    reported = result['depth']
+                    lines = [dict(line, move=line['move'].uci()) for line in result['lines']]
+                    yield f"data: {json.dumps(dict(result, lines=lines, fen=fen, cached=False))}\n\n"
+            except EngineBusy:
+                yield f"event: error\ndata: {json.dumps({'message': 'Engine busy'})}\n\n"
+            except Exception as e:
+                logger.error(f"Error streaming analysis of {fen}: {e}")
+                yield f"event: error\ndata: {json.dumps({'message': 'Analysis failed'})}\n\n"
+            finally:
+                # Also runs when the client disconnects, which stops the search
+                results.close()
+                if deepest is not None:
+                    AnalysisCache.store(fen, deepest)
+    
+    yield f"event: done\ndata: {json.dumps({'depth': reported})}\n\n"
 
 @csrf_exempt
 def ask_question(request):
@@ -549,13 +897,64 @@ def validate_move(board, move):
     logger.warning(f"Illegal move: {move.uci()} on board: {board.fen()}")
     return False, board_copy
 
-def get_next_move_number(game):
-    """Get the next move number for a game."""
-    last_move = Move.objects.filter(game=game).order_by('-move_number').first()
-    return 1 if last_move is None else last_move.move_number + 1
+def record_move(game_obj, board, move, **fields):
+    """
+    Append a move to the game's packed move list and save its Move row.
+    board must be the game's current position; the move is pushed onto it.
+    Returns None if another request added a move to the game meanwhile.
+    """
+    with transaction.atomic():
+        locked = Game.objects.select_for_update().get(id=game_obj.id)
+        if locked.ply_count != len(board.move_stack):
+            logger.warning(f"Game {game_obj.id} changed while a move was being recorded")
+            game_obj.fen_position = locked.fen_position
+            return None
+        
+        move_obj = Move.objects.create(
+            game=locked,
+            move_number=locked.ply_count + 1,
+            move_uci=move.uci(),
+            move_san=board.san(move),
+            position_key=position_key(board),
+            **fields
+        )
+        board.push(move)
+        
+        # Update the game state
+        locked.append_move(move)
+        locked.fen_position = board.fen()
+        locked.save()
+    
+    game_obj.move_data = locked.move_data
+    game_obj.fen_position = locked.fen_position
+    # The game moved to the top of the recent games
+    ProfileDashboard.invalidate(locked.user_id)
+    return move_obj
+
+def precompute_ai_reply(game_id, ply):
+    """Background task: search the AI's reply to the user's move that ended at ply."""
+    if not SpeculativeReplies.start(game_id, ply):
+        return
+    stored = False
+    try:
+        game_obj = Game.objects.select_related('opening').filter(id=game_id).first()
+        board = game_obj.board() if game_obj else None
+        # Unless the game moved on meanwhile
+        if board is not None and len(board.move_stack) == ply:
+            ai_move, _, evaluation = generate_ai_move(board, game_obj.opening, game_obj.ai_strength)
+            if ai_move:
+                SpeculativeReplies.store(game_id, board, ai_move, evaluation)
+                stored = True
+    finally:
+        # Never leave get_ai_move waiting on a search that is not running
+        if not stored:
+            SpeculativeReplies.discard(game_id, ply)
 
 def generate_ai_move(board, opening, depth=15):
-    """Generate a move for the AI based on the opening or engine."""
+    """
+    Generate a move for the AI based on the opening or engine. Returns
+    (move, san, white's evaluation after the move or None if not searched).
+    """
     opening_explorer = OpeningExplorer()
     
     # First check if we're in the opening book
@@ -570,7 +969,7 @@ def generate_ai_move(board, opening, depth=15):
             # First check if the move is legal in the current position
             if book_move in board.legal_moves:
                 san_move = board.san(book_move)
-                return book_move, san_move, 0  # Evaluation is not relevant for book moves
+                return book_move, san_move, None  # Book moves are not searched
         except Exception as e:
             logger.error(
                 f"Error converting book move to SAN: {e}"
@@ -580,8 +979,10 @@ def generate_ai_move(board, opening, depth=15):
     # If we're not in the opening book or there's no suitable book move,
     # fall back to the engine
     try:
-        # Get a move from Stockfish
-        engine_move = stockfish_engine.get_best_move(board.fen(), depth)
+        # Get a move from Stockfish; the same search provides the evaluation
+        stockfish_engine = registry.get_stockfish_engine()
+        analysis_context = AnalysisContext()
+        engine_move = stockfish_engine.get_best_move(board.fen(), depth, context=analysis_context)
         if engine_move:
             # Handle both UCI string and Move object returns from get_best_move
             if isinstance(engine_move, str):
@@ -591,8 +992,10 @@ def generate_ai_move(board, opening, depth=15):
                 
             # Check if the move is legal in the current position
             if ai_move in board.legal_moves:
-                # Get the evaluation of the position
-                evaluation = stockfish_engine.evaluate_position(board.fen())
+                # The search's score for the move is white's evaluation after it
+                searched = analysis_context.get(board.fen(), depth)
+                lines = searched['lines'] if searched else []
+                evaluation = lines[0]['score'] if lines and lines[0]['move'] == ai_move else None
                 san_move = board.san(ai_move)
                 return ai_move, san_move, evaluation
     except Exception as e:
@@ -604,12 +1007,12 @@ def generate_ai_move(board, opening, depth=15):
         random_move = random.choice(legal_moves)
         try:
             san_move = board.san(random_move)
-            return random_move, san_move, 0
+            return random_move, san_move, None
         except Exception as e:
             logger.error(f"Error converting random move to SAN: {e}")
     
     # If we somehow have no legal moves, return None
-    return None, None, 0
+    return None, None, None
 
 def generate_ai_explanation(board, move, opening):
     """Generate an explanation for the AI's move."""
@@ -696,56 +1099,64 @@ def generate_ai_explanation(board, move, opening):
         logger.error(f"Error generating move explanation: {e}")
         return "I made a move, but I'm having trouble explaining it in detail."
 
-def update_user_progress(user, opening, move_quality):
-    """Update the user's progress for an opening based on move quality."""
-    progress, created = UserProgress.objects.get_or_create(
-        user=user,
-        opening=opening
-    )
-    # Increment games played if it's a new game
-    if created:
-        progress.games_played = 1
-    # Calculate move quality as a percentage 
-    quality_scores = {
-        'best': 100,
-        'excellent': 90,
-        'good': 75,
-        'inaccuracy': 50,
-        'mistake': 25,
-        'blunder': 0,
-        'normal': 60
-    }
-    move_score = quality_scores.get(move_quality, 60)
-    # Update average accuracy with a weighted approach to recent games
-    if progress.avg_accuracy == 0:
-        progress.avg_accuracy = move_score
-    else:
-        # Weight recent games more heavily (80% new, 20% old)
-        progress.avg_accuracy = (0.8 * move_score) + (0.2 * progress.avg_accuracy)
-    # Update best accuracy if this is better
-    if move_score > progress.best_accuracy:
-        progress.best_accuracy = move_score
-    # Calculate mastery level based on accuracy and games played
-    # More games played increases mastery, as does higher accuracy
-    games_factor = min(progress.games_played / 10, 1.0)  # Caps at 10 games
-    progress.mastery_level = int(progress.avg_accuracy * games_factor)
-    progress.save()
-    return progress
+def _move_history_state(request, game_id):
+    """(ply count, updated_at) of the user's game, or None; looked up once per request."""
+    if not hasattr(request, '_move_history_state'):
+        row = (
+            Game.objects.filter(id=game_id, user=request.user)
+            .values_list('move_data', 'updated_at').first()
+        )
+        request._move_history_state = row and (len(row[0]) // 2, row[1])
+    return request._move_history_state
+
+def _move_history_etag(request, game_id):
+    state = _move_history_state(request, game_id)
+    # updated_at tells apart the same ply count before and after a reset
+    return state and f"{state[0]}-{state[1].timestamp()}"
+
+def _move_history_last_modified(request, game_id):
+    state = _move_history_state(request, game_id)
+    return state and state[1]
 
 @login_required
 @require_GET
+@condition(etag_func=_move_history_etag, last_modified_func=_move_history_last_modified)
 def get_move_history(request, game_id):
-    game_obj = get_object_or_404(Game, id=game_id, user=request.user)
-    moves = Move.objects.filter(game=game_obj).order_by('move_number')
+    """
+    API endpoint for the move list. since=<ply> returns only the moves
+    after that ply; the ETag follows the game's ply count, so polling an
+    unchanged game gets a 304.
+    """
+    state = _move_history_state(request, game_id)
+    if state is None:
+        raise Http404("No game found")
+    try:
+        since = int(request.GET.get('since', 0))
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'since must be a ply number'}, status=400)
+    
+    moves = (
+        Move.objects.filter(game_id=game_id, move_number__gt=since, detached=False)
+        .order_by('move_number')
+        .values_list('move_number', 'move_san', 'player')
+    )
     move_list = [
-        {
-            'move_number': m.move_number,
-            'move_san': m.move_san,
-            'player': m.player
-        }
-        for m in moves
+        {'move_number': number, 'move_san': san, 'player': player}
+        for number, san, player in moves
     ]
-    return JsonResponse({'status': 'success', 'moves': move_list})
+    return JsonResponse({'status': 'success', 'moves': move_list, 'ply': state[0]})
+
+@login_required
+@require_GET
+def game_review(request, game_id):
+    """API endpoint returning the post-game review, reviewed again only when the game has moved on."""
+    game_obj = get_object_or_404(Game, id=game_id, user=request.user)
+    # The worker's engine pool, so no engines are started per request
+    try:
+        review = GameReviewer.stored(game_obj) or GameReviewer.review(game_obj, registry.get_engine_pool())
+    except EngineBusy:
+        return JsonResponse({'status': 'error', 'message': 'Engine busy'}, status=503)
+    return JsonResponse({'status': 'success', 'review': GameReviewer.as_dict(review)})
 
 # Create a custom form that includes email
 class CustomUserCreationForm(UserCreationForm):
@@ -2,6 +2,9 @@
 ASGI config for chess_project project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP requests go to Django; WebSocket connections to /ws/game/<id>/ go to
+the game channel in chess_app.consumers. Serve it with e.g.
+``daphne chess_project.asgi:application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
@@ -11,4 +14,13 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chess_project.settings')
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once Django is set up
+from chess_app.consumers import websocket_application  # noqa: E402
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        await websocket_application(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
@@ -83,6 +83,16 @@ DATABASES = {
     }
 }
 
+# Cache for page data (profile dashboard, challenge listings). Per process;
+# point this at a shared backend (e.g. Redis) when running several workers
+# so invalidations reach all of them.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'chess-trainer',
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -167,11 +177,83 @@ LOGGING = {
 STOCKFISH_DEPTH = 15  # Default depth for Stockfish analysis
 STOCKFISH_TIMEOUT = 2.0  # Timeout in seconds
 
+# Background work (move feedback etc.)
+BACKGROUND_TASKS_ENABLED = True  # Set to False to run tasks inline
+BACKGROUND_WORKERS = 4  # Threads in the background worker pool
+
+# LLM provider settings
+OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY', '')  # From the environment only; LLM calls fail fast without it
+LLM_BASE_URL = 'https://openrouter.ai/api/v1'
+LLM_MODEL = 'google/gemini-2.0-flash-001'
+LLM_TIMEOUT = 15.0  # Default deadline per call in seconds, retries included
+LLM_CHAT_TIMEOUT = 20.0
+LLM_FEEDBACK_TIMEOUT = 15.0
+LLM_INTENT_TIMEOUT = 3.0
+LLM_SUMMARY_TIMEOUT = 10.0
+INTENT_CONFIDENCE_THRESHOLD = 0.6  # Local intent classifications below this go to the LLM
+LLM_MAX_RETRIES = 2  # Retries after the first attempt, within the deadline
+LLM_MAX_CONNECTIONS = 20  # Pooled HTTP connections to the provider
+LLM_BREAKER_THRESHOLD = 5  # Consecutive failures before the breaker opens
+LLM_BREAKER_COOLDOWN = 30.0  # Seconds before a trial call is let through
+LLM_USAGE_TRACKING = True  # Record daily per call site token and latency totals (LLMUsage)
+# Estimated prompt tokens allowed per call site; larger prompts are refused
+LLM_PROMPT_BUDGETS = {
+    'chat': 2500,
+    'chat_stream': 2500,
+    'move_feedback': 800,
+    'intent': 300,
+    'chat_summary': 2000,
+}
+
+# Chat history kept on the server
+CHAT_WINDOW_MESSAGES = 8  # Recent messages sent verbatim
+CHAT_TOKEN_BUDGET = 1500  # Prompt tokens for the summary plus recent messages
+CHAT_SUMMARY_TOKENS = 300  # Upper bound for the rolling summary
+CHAT_SUMMARY_BATCH = 4  # Messages past the window before they are summarized in the background
+
+# AI feedback cache
+FEEDBACK_CACHE_TTL = 30 * 24 * 3600  # Seconds before cached feedback expires
+FEEDBACK_CACHE_MAX_ENTRIES = 50000  # Least recently used entries beyond this are evicted
+
+# Profile dashboard cache
+DASHBOARD_CACHE_TTL = 300  # Seconds; entries are also invalidated on game, move and challenge events
+
+# Challenges listing
+CHALLENGES_PAGE_SIZE = 24
+CHALLENGES_CACHE_TTL = 300  # Seconds a rendered page is cached
+
+# Batch engine analysis (mine_blunders)
+ENGINE_POOL_SIZE = None  # Stockfish processes run in parallel; None uses one per CPU
+BLUNDER_MINING_BATCH_SIZE = 200  # Mistakes analysed per batch
+BLUNDER_MINING_DEPTH = 16
+BLUNDER_MINING_MIN_LOSS = 1.0  # Pawns a mistake must lose against the best move to become a challenge
+GAME_REVIEW_DEPTH = 14  # Search depth for moves reviewed without a saved evaluation
+
+# AI replies searched in the background after the user's move
+AI_REPLY_WAIT = 1.0  # Seconds get_ai_move waits for a search already running
+AI_REPLY_CACHE_TTL = 300
+# Analyse the user's position in the background after the AI moves
+PONDER_ENABLED = True
+PONDER_TIME = 2.0  # Seconds per ponder search
+
+# Batch analysis API (/api/analyze/batch)
+ANALYSIS_POOL_SIZE = 2  # Stockfish processes per web worker
+ANALYSIS_POOL_TIMEOUT = 2.0  # Seconds a request waits for a free engine before answering "engine busy"
+ANALYSIS_CACHE_TTL = 24 * 3600  # Seconds engine results are shared through the cache
+ANALYZE_BATCH_MAX_POSITIONS = 100
+ANALYZE_BATCH_MAX_DEPTH = 20
+ANALYZE_BATCH_MAX_TIME = 5.0  # Seconds per position
+ANALYSIS_STREAM_MAX_DEPTH = 22  # Deepest search a live evaluation runs to
+ANALYSIS_STREAM_MAX_TIME = 10.0  # Seconds a live evaluation may hold an engine
+
 # NLP settings
 NLTK_DATA_PATH = os.path.join(BASE_DIR, 'nltk_data')
 if not os.path.exists(NLTK_DATA_PATH):
     os.makedirs(NLTK_DATA_PATH)
 os.environ['NLTK_DATA'] = NLTK_DATA_PATH
+NLP_SPACY_MODEL = 'en_core_web_sm'  # Lemmatizer for chat intents, loaded on first use; None to disable
+# Build the opening book and NLP resources in the master process before workers fork
+PRELOAD_SERVICES = os.environ.get('PRELOAD_SERVICES') == 'True'
 
 # Email settings
 # print("Configuring email settings...")
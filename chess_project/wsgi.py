@@ -15,6 +15,12 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chess_project.settings')
 
 application = get_wsgi_application()
 
+# Build shared read-only state before the workers fork (e.g. gunicorn --preload)
+from django.conf import settings
+if settings.PRELOAD_SERVICES:
+    from chess_app.registry import preload
+    preload()
+
 # Development server configuration
 if os.environ.get('DJANGO_DEVELOPMENT') == 'True':
     from django.core.management.commands.runserver import Command